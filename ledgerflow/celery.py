@@ -0,0 +1,11 @@
+import os
+
+from celery import Celery
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "ledgerflow.settings")
+
+app = Celery("ledgerflow")
+
+# All CELERY_* settings in ledgerflow/settings.py configure the app
+app.config_from_object("django.conf:settings", namespace="CELERY")
+app.autodiscover_tasks()
@@ -83,6 +83,117 @@ CELERY_ACCEPT_CONTENT = ["json"]
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_TIMEZONE = "UTC"
+# Run ProcessingTasks from the admin on Celery ("celery") or in a
+# process_task subprocess ("subprocess")
+TASK_BACKEND = env("TASK_BACKEND", default="subprocess")
+# One queue per task type so each can get its own workers, e.g.
+#   celery -A ledgerflow worker -Q classification -c 4
+CELERY_TASK_DEFAULT_QUEUE = "ledgerflow"
+CELERY_TASK_TYPE_QUEUES = {
+    "payee_lookup": "payee_lookup",
+    "classification": "classification",
+    "ingestion": "ingestion",  # batch statement uploads (IngestionJob)
+}
+# Agent calls take seconds: take one message at a time and only ack it once
+# done, so a dead worker's message goes back to the queue
+CELERY_WORKER_PREFETCH_MULTIPLIER = env.int(
+    "CELERY_WORKER_PREFETCH_MULTIPLIER", default=1
+)
+CELERY_TASK_ACKS_LATE = True
+CELERY_TASK_REJECT_ON_WORKER_LOST = True
+CELERY_TASK_ALWAYS_EAGER = env.bool("CELERY_TASK_ALWAYS_EAGER", default=False)
+CELERY_BEAT_SCHEDULE = {
+    "requeue-stale-work": {
+        "task": "profiles.requeue_stale_work",
+        "schedule": 60.0,
+    },
+}
+
+# Agent execution: max in-flight call_agent invocations per agent.
+# AGENT_CONCURRENCY overrides the default for individual agents by name.
+AGENT_MAX_CONCURRENCY = env.int("AGENT_MAX_CONCURRENCY", default=4)
+AGENT_CONCURRENCY = {}
+# Transactions per Classification Agent request (0 = one per request).
+# A task can override it with task_metadata["classification_batch_size"].
+CLASSIFICATION_BATCH_SIZE = env.int("CLASSIFICATION_BATCH_SIZE", default=0)
+
+# Outbound rate limiting (profiles.rate_limit). Per-model limits are set on
+# LLMConfig; these defaults apply when a model leaves them blank.
+LLM_RATE_LIMIT_DEFAULTS = {
+    "requests_per_minute": env.int("LLM_REQUESTS_PER_MINUTE", default=500),
+    "tokens_per_minute": env.int("LLM_TOKENS_PER_MINUTE", default=200000),
+}
+TOOL_RATE_LIMITS = {
+    "searxng_search": {
+        "requests_per_minute": env.int("SEARXNG_REQUESTS_PER_MINUTE", default=60),
+        "max_concurrency": 4,
+    },
+}
+RATE_LIMIT_MAX_CONCURRENCY = env.int("RATE_LIMIT_MAX_CONCURRENCY", default=8)
+# Cache holding the per-minute budgets shared by all worker processes
+RATE_LIMIT_CACHE_ALIAS = "default"
+RATE_LIMIT_BACKOFF_BASE = 1.0
+RATE_LIMIT_BACKOFF_MAX = 60.0
+
+# Deterministic classification rules (profiles.rule_engine) run before the LLM.
+RULE_ENGINE_ENABLED = env.bool("RULE_ENGINE_ENABLED", default=True)
+RULE_ENGINE_CACHE_TTL = 300  # seconds before a client's compiled rules are rebuilt
+
+# Per-client learned classifier (profiles.learned_classifier); retrain with
+# `manage.py train_classifier`. Predictions below these thresholds go to the LLM.
+LEARNED_CLASSIFIER_ENABLED = env.bool("LEARNED_CLASSIFIER_ENABLED", default=True)
+LEARNED_CLASSIFIER_MIN_SIMILARITY = env.float(
+    "LEARNED_CLASSIFIER_MIN_SIMILARITY", default=0.6
+)
+LEARNED_CLASSIFIER_MIN_MARGIN = 0.1
+LEARNED_CLASSIFIER_MIN_SUPPORT = (
+    3  # reviewed examples a class needs before it is applied
+)
+LEARNED_CLASSIFIER_CACHE_TTL = 300
+
+# ProcessingTask workers (`manage.py run_workers`, profiles.task_queue)
+TASK_WORKERS = env.int("TASK_WORKERS", default=2)
+TASK_POLL_INTERVAL = 2  # seconds an idle worker waits between claims
+TASK_HEARTBEAT_INTERVAL = 10
+TASK_HEARTBEAT_TIMEOUT = 60  # a task is reclaimed after this long without a heartbeat
+TASK_MAX_ATTEMPTS = 3
+# Tasks larger than this are split into work units shared by all workers
+# (0 disables; a task can override it with task_metadata["chunk_size"]).
+TASK_CHUNK_SIZE = env.int("TASK_CHUNK_SIZE", default=250)
+# Scheduling (profiles.scheduler): tasks this small get a priority boost, and
+# waiting tasks gain one priority level per TASK_PRIORITY_AGING_SECONDS.
+# TASK_CLIENT_WEIGHTS gives clients a larger fair share, e.g. "acme=2,beta=0.5".
+TASK_INTERACTIVE_MAX_TRANSACTIONS = env.int(
+    "TASK_INTERACTIVE_MAX_TRANSACTIONS", default=50
+)
+TASK_PRIORITY_AGING_SECONDS = env.int("TASK_PRIORITY_AGING_SECONDS", default=600)
+TASK_CLIENT_WEIGHTS = env.dict("TASK_CLIENT_WEIGHTS", cast={"value": float}, default={})
+# How often a running task re-reads ProcessingTask.control (pause/cancel)
+TASK_CONTROL_CHECK_SECONDS = env.float("TASK_CONTROL_CHECK_SECONDS", default=2.0)
+# Admin progress polling: counters cached this long, log tail size
+TASK_PROGRESS_CACHE_SECONDS = 2
+TASK_LOG_TAIL_BYTES = 64 * 1024
+# Bearer token required on /metrics (Prometheus task telemetry); when empty,
+# only logged-in staff users can read it
+METRICS_TOKEN = env("METRICS_TOKEN", default="")
+TASK_SCHEDULER_WINDOW = 500  # pending tasks considered per scheduling decision
+TASK_STATS_WINDOW_HOURS = 24
+# Agent results are written with bulk_update and progress counters with F()
+# increments, each at most every N rows or S seconds, whichever comes first.
+RESULT_FLUSH_ROWS = env.int("RESULT_FLUSH_ROWS", default=100)
+RESULT_FLUSH_SECONDS = env.float("RESULT_FLUSH_SECONDS", default=2.0)
+PROGRESS_FLUSH_ROWS = env.int("PROGRESS_FLUSH_ROWS", default=100)
+PROGRESS_FLUSH_SECONDS = env.float("PROGRESS_FLUSH_SECONDS", default=2.0)
+# Statement rows are inserted with bulk_create, this many per query
+INGEST_BATCH_SIZE = env.int("INGEST_BATCH_SIZE", default=1000)
+# Processes parsing batch-uploaded statements in parallel (0 = one per CPU)
+STATEMENT_PARSE_WORKERS = env.int("STATEMENT_PARSE_WORKERS", default=0)
+# PDF-extractor checkout to put on sys.path for the statement parsers; leave
+# empty when dataextractai is installed as a package
+STATEMENT_PARSERS_PATH = env("STATEMENT_PARSERS_PATH", default="")
+# With TASK_BACKEND "subprocess", start a process_ingestion_job process for
+# each batch upload. Disable when a run_workers service takes the jobs.
+INGESTION_START_WORKER = env.bool("INGESTION_START_WORKER", default=True)
 
 # Cache
 CACHES = {
@@ -95,6 +206,28 @@ CACHES = {
     }
 }
 
+# Offline Batch API execution (ProcessingTask execution_mode "batch_api").
+# LLM_BATCH_BACKEND "local" uses the file-backed stand-in in profiles/batch_api.py.
+LLM_BATCH_BACKEND = env("LLM_BATCH_BACKEND", default="openai")
+LLM_BATCH_DIR = os.path.join(BASE_DIR, "data", "batches")
+LLM_BATCH_POLL_INTERVAL = env.int("LLM_BATCH_POLL_INTERVAL", default=30)
+LLM_BATCH_LOCAL_RESPONDER = "profiles.batch_api.chat_completion_responder"
+
+# Agent response cache (see profiles/llm_cache.py)
+LLM_RESPONSE_CACHE_ENABLED = env.bool("LLM_RESPONSE_CACHE_ENABLED", default=True)
+LLM_RESPONSE_CACHE_ALIAS = "default"
+LLM_RESPONSE_CACHE_TTL = env.int("LLM_RESPONSE_CACHE_TTL", default=60 * 60 * 24 * 30)
+LLM_RESPONSE_CACHE_LOCAL_MAX_ENTRIES = 2048
+# Hit/miss counters are added to the shared cache every this many lookups
+# or seconds, whichever comes first
+LLM_RESPONSE_CACHE_STATS_FLUSH_COUNT = 100
+LLM_RESPONSE_CACHE_STATS_FLUSH_SECONDS = 10.0
+
+# Compiled Agent.prompt templates (see profiles/prompt_utils.py).
+# Bytecode defaults to a per-user directory under the system temp dir.
+PROMPT_TEMPLATE_CACHE_SIZE = 400
+PROMPT_TEMPLATE_BYTECODE_DIR = env("PROMPT_TEMPLATE_BYTECODE_DIR", default=None)
+
 # Static files (CSS, JavaScript, Images)
 STATIC_URL = "/static/"
 STATICFILES_DIRS = [os.path.join(BASE_DIR, "static")]
@@ -5,10 +5,12 @@ from django.urls import path, include
 from django.contrib.admin.views.decorators import staff_member_required
 from django.conf import settings
 from django.conf.urls.static import static
+from profiles.views import metrics
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("reports/", include(("reports.urls", "reports"), namespace="reports")),
+    path("metrics", metrics, name="metrics"),
     # path('profiles/', include('profiles.urls')),
     # ... (comment out any other custom app URLs) ...
 ]
@@ -16,6 +16,9 @@ from .models import (
     PAYEE_EXTRACTION_METHOD_UNPROCESSED,
     ParsingRun,
     TaxChecklistItem,
+    ClassifierModel,
+    IngestionJob,
+    IngestionJobFile,
 )
 from django.utils.translation import gettext_lazy as _
 from django.http import HttpResponseRedirect
@@ -40,6 +43,16 @@ from django.db import transaction as db_transaction
 from django import forms
 from django.utils.html import format_html
 import re
+from . import llm_cache, telemetry
+from .agent_registry import get_compiled_agent, get_openai_client
+from .agent_runner import run_agent_concurrently
+from .batch_api import EXECUTION_MODE_BATCH_API
+from .rate_limit import (
+    estimate_tokens,
+    get_llm_rate_limiter,
+    get_tool_rate_limiter,
+    usage_total_tokens,
+)
 from .utils import (
     extract_pdf_metadata,
     get_update_fields_from_response,
@@ -54,7 +67,7 @@ from dataextractai.utils.normalize_api import normalize_parsed_data_df
 from django.core.exceptions import ValidationError
 import pandas as pd
 import tempfile
-from profiles.prompt_utils import get_fallback_payee_prompts
+from profiles.prompt_utils import get_fallback_payee_prompts, render_agent_prompt
 import jinja2
 
 # Add the root directory to the Python path
@@ -274,14 +287,9 @@ class BusinessProfileAdmin(admin.ModelAdmin):
             api_key = os.environ.get("OPENAI_API_KEY")
             # Render prompt from UI (Jinja2)
             try:
-                env = jinja2.Environment(undefined=jinja2.StrictUndefined)
-                template = env.from_string(agent.prompt)
-                rendered = template.render(business_profile=obj)
-                if "---USER---" in rendered:
-                    system_prompt, user_prompt = rendered.split("---USER---", 1)
-                else:
-                    system_prompt = rendered
-                    user_prompt = ""
+                system_prompt, user_prompt = render_agent_prompt(
+                    agent.id, agent.prompt, {"business_profile": obj}
+                )
             except Exception as e:
                 from django.contrib import messages
 
@@ -397,105 +405,91 @@ def build_allowed_categories(transaction):
     return "\n".join(lines)
 
 
+def build_agent_prompts(agent, transaction):
+    """
+    Render (system_prompt, user_prompt) for a CompiledAgent and transaction
+    from Agent.prompt, falling back to the built-in prompts if it is missing
+    or fails to render.
+    """
+    # Patch: always build allowed_categories for classification agents
+    allowed_categories = ""
+    if agent.is_classification:
+        allowed_categories = build_allowed_categories(transaction)
+        logger.info(f"Allowed categories sent to LLM:\n{allowed_categories}")
+    context = {
+        "transaction": transaction,
+        "allowed_categories": allowed_categories,
+        "business_profile": getattr(transaction, "client", None),
+        "payee_reasoning": getattr(transaction, "payee_reasoning", None),
+    }
+    # Always use Agent.prompt (UI template) as primary for ALL agents
+    template_rendered = False
+    system_prompt = None
+    user_prompt = None
+    if agent.prompt:
+        try:
+            # Compiled once per agent/prompt version, split on ---USER---
+            system_prompt, user_prompt = render_agent_prompt(
+                agent.id, agent.prompt, context
+            )
+            template_rendered = True
+            logger.info("[PROMPT] Used Agent.prompt from UI for agent '%s'", agent.name)
+        except Exception as e:
+            logger.warning(
+                f"[PROMPT] Failed to render Agent.prompt for agent '%s': %s. Falling back.",
+                agent.name,
+                e,
+            )
+    if not template_rendered:
+        # Use fallback for any agent type if template missing or fails
+        if "payee" in agent.name.lower():
+            system_prompt, user_prompt = get_fallback_payee_prompts(transaction)
+            logger.info(
+                "[PROMPT] Used fallback payee prompt for agent '%s'", agent.name
+            )
+        else:
+            # Generic fallback for other agents (can be improved with more helpers)
+            system_prompt = "Classification fallback prompt not implemented."
+            user_prompt = ""
+            logger.info(
+                "[PROMPT] Used fallback generic prompt for agent '%s'", agent.name
+            )
+    return system_prompt, user_prompt
+
+
 def call_agent(
     agent_name, transaction, model=None, max_retries=2, escalate_on_fail=True
 ):
     """Call the specified agent with the transaction data."""
-    import os
-    from openai import OpenAI
-
     logger = logging.getLogger(__name__)
     try:
-        agent = Agent.objects.get(name=agent_name)
-        # Ensure tool_definitions is always defined
-        tool_definitions = []
-        if hasattr(agent, "tools"):
-            for tool in agent.tools.all():
-                tool_def = {
-                    "name": tool.name,
-                    "type": "function",
-                    "function": {
-                        "name": tool.name,
-                        "description": tool.description,
-                        "parameters": {
-                            "type": "object",
-                            "properties": {
-                                "query": {
-                                    "type": "string",
-                                    "description": "The search query to look up",
-                                }
-                            },
-                            "required": ["query"],
-                        },
-                    },
-                }
-                tool_definitions.append(tool_def)
-        # Patch: always build allowed_categories for classification agents
-        is_classification = (
-            "classification" in (agent.purpose or "").lower()
-            or "classification" in (agent.name or "").lower()
-        )
-        allowed_categories = ""
-        if is_classification:
-            allowed_categories = build_allowed_categories(transaction)
-            logger.info(f"Allowed categories sent to LLM:\n{allowed_categories}")
-        context = {
-            "transaction": transaction,
-            "allowed_categories": allowed_categories,
-            "business_profile": getattr(transaction, "client", None),
-            "payee_reasoning": getattr(transaction, "payee_reasoning", None),
-        }
-        # Always use Agent.prompt (UI template) as primary for ALL agents
-        template_rendered = False
-        system_prompt = None
-        user_prompt = None
-        if agent.prompt:
-            try:
-                env = jinja2.Environment(undefined=jinja2.StrictUndefined)
-                template = env.from_string(agent.prompt)
-                rendered = template.render(**context)
-                # Split into system/user if delimiter present, else use as system
-                if "---USER---" in rendered:
-                    system_prompt, user_prompt = rendered.split("---USER---", 1)
-                else:
-                    system_prompt = rendered
-                    user_prompt = ""
-                template_rendered = True
-                logger.info(
-                    "[PROMPT] Used Agent.prompt from UI for agent '%s'", agent_name
-                )
-            except Exception as e:
-                logger.warning(
-                    f"[PROMPT] Failed to render Agent.prompt for agent '%s': %s. Falling back.",
-                    agent_name,
-                    e,
-                )
-        if not template_rendered:
-            # Use fallback for any agent type if template missing or fails
-            if "payee" in agent_name.lower():
-                system_prompt, user_prompt = get_fallback_payee_prompts(transaction)
-                logger.info(
-                    "[PROMPT] Used fallback payee prompt for agent '%s'", agent_name
-                )
-            else:
-                # Generic fallback for other agents (can be improved with more helpers)
-                system_prompt = "Classification fallback prompt not implemented."
-                user_prompt = ""
+        # Compiled once per process; invalidated on Agent/Tool/LLMConfig changes
+        agent = get_compiled_agent(agent_name)
+        # Repeat vendors are answered from the response cache without any LLM/tool calls
+        cache_key = None
+        if llm_cache.is_enabled() and agent.model:
+            cache_key = llm_cache.build_cache_key(agent, agent.model, transaction)
+            cached = llm_cache.lookup(cache_key)
+            if cached is not None:
                 logger.info(
-                    "[PROMPT] Used fallback generic prompt for agent '%s'", agent_name
+                    f"[LLM CACHE] Hit for transaction {transaction.id} with agent '{agent_name}'"
                 )
+                return cached
+        tool_definitions = agent.tool_definitions
+        with telemetry.stage("prompt_build"):
+            system_prompt, user_prompt = build_agent_prompts(agent, transaction)
         # Log the actual prompts being sent
         logger.info(f"System Prompt Sent: {system_prompt!r}")
         logger.info(f"User Prompt Sent: {user_prompt!r}")
         # Model selection logic: ONLY use agent.llm.model from UI
-        if not (agent.llm and agent.llm.model):
+        if not agent.model:
             logger.error(
                 f"Agent '{agent_name}' does not have an LLM model configured in the UI. Aborting."
             )
             raise ValueError(
                 f"Agent '{agent_name}' does not have an LLM model configured in the UI."
             )
-        model = agent.llm.model
+        model = agent.model
         # Log the actual model and tools used right before the API call
         logger.info(f"Using OpenAI model: {model}")
         if tool_definitions:
@@ -504,7 +498,7 @@ def call_agent(
             logger.info("No tools passed to LLM for this agent.")
         # ... existing code to call LLM ...
         try:
-            client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+            client = get_openai_client()
             messages = [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_prompt},
@@ -525,7 +519,20 @@ def call_agent(
                 if tools:
                     payload["tools"] = tools
                     payload["tool_choice"] = "auto"
-                response = client.chat.completions.create(**payload)
+                # Shared per-model limiter: request/token buckets, adaptive
+                # concurrency and backoff on 429/5xx (the SDK's own retries are off)
+                response = get_llm_rate_limiter(agent).call(
+                    lambda: telemetry.timed(
+                        "llm_call",
+                        lambda: client.with_options(
+                            max_retries=0
+                        ).chat.completions.create(**payload),
+                    ),
+                    estimated_tokens=estimate_tokens(messages),
+                    max_retries=max_retries,
+                    usage_tokens=usage_total_tokens,
+                )
+                telemetry.record_usage(getattr(response, "usage", None))
                 logger.info(f"Raw LLM Response: {response}")
                 msg = response.choices[0].message
                 # If the LLM returns a tool call, append the assistant message and then the tool message(s)
@@ -568,15 +575,18 @@ def call_agent(
                             f"Executing tool: {tool_name} with args: {tool_args}"
                         )
                         try:
-                            tool_obj = Tool.objects.get(name=tool_name)
-                            module_path = tool_obj.module_path
-                            module_name = module_path.split(".")[-1]
-                            module = __import__(module_path, fromlist=[module_name])
-                            if tool_name == "searxng_search":
-                                tool_function = getattr(module, "searxng_search")
-                            else:
-                                tool_function = getattr(module, tool_name)
-                            tool_result = tool_function(**tool_args)
+                            tool_function = agent.tool_functions.get(tool_name)
+                            if tool_function is None:
+                                raise ValueError(
+                                    f"Tool '{tool_name}' is not available to agent '{agent_name}'"
+                                )
+                            tool_result = get_tool_rate_limiter(tool_name).call(
+                                lambda: telemetry.timed(
+                                    "tool_call", lambda: tool_function(**tool_args)
+                                ),
+                                max_retries=max_retries,
+                            )
+                            telemetry.record_tool(tool_name)
                             logger.info(f"Tool result: {tool_result}")
                             # Track tool usage
                             tool_usage_counter[tool_name] = (
@@ -601,6 +611,8 @@ def call_agent(
                         result = json.loads(msg.content)
                         if tool_usage_counter:
                             result["_tool_usage"] = tool_usage_counter
+                        if cache_key:
+                            llm_cache.store(cache_key, result)
                         return result
                     except Exception as e:
                         logger.warning(
@@ -624,6 +636,47 @@ def call_agent(
         raise
 
 
+def apply_agent_results(request, agent, queryset):
+    """
+    Run ``agent`` over ``queryset`` and save each result. A failed
+    transaction is logged and counted, and the rest are still processed.
+    """
+    processed = 0
+    failed = []
+    for result in run_agent_concurrently(agent, queryset):
+        transaction = result.transaction
+        if result.error is not None:
+            logger.error(
+                f"Error processing transaction {transaction.id} with {agent.name}: "
+                f"{result.error}"
+            )
+            failed.append(transaction.id)
+            continue
+        update_fields = result.update_fields
+        logger.info(f"Update fields for transaction {transaction.id}: {update_fields}")
+        rows_updated = Transaction.objects.filter(id=transaction.id).update(
+            **update_fields
+        )
+        logger.info(f"Updated {rows_updated} rows for transaction {transaction.id}")
+        updated_tx = Transaction.objects.get(id=transaction.id)
+        logger.info(
+            f"Transaction {transaction.id} after update: payee={updated_tx.payee}, classification_type={updated_tx.classification_type}, worksheet={updated_tx.worksheet}, confidence={updated_tx.confidence}, category={updated_tx.category}"
+        )
+        processed += 1
+    if processed:
+        messages.success(
+            request,
+            f"Successfully processed {processed} transactions with {agent.name}",
+        )
+    if failed:
+        messages.error(
+            request,
+            f"Failed to process {len(failed)} transactions with {agent.name} "
+            f"(ids: {', '.join(str(i) for i in failed)}); see the log for details",
+        )
+    return processed, failed
+
+
 def process_transactions(modeladmin, request, queryset):
     if "agent" not in request.POST:
         # Show the agent selection form
@@ -649,45 +702,7 @@ def process_transactions(modeladmin, request, queryset):
     agent_id = request.POST["agent"]
     try:
         agent = Agent.objects.get(id=agent_id)
-        for transaction in queryset:
-            response = call_agent(agent.name, transaction)
-            logger.info(f"Agent response: {response}")
-            # Robust agent_type mapping
-            purpose = (
-                getattr(agent, "purpose", "").lower()
-                if hasattr(agent, "purpose")
-                else ""
-            )
-            name = getattr(agent, "name", "").lower() if hasattr(agent, "name") else ""
-            if "payee" in purpose or "payee" in name:
-                agent_type = "payee"
-            else:
-                agent_type = "classification"
-            # Detect tool usage from response if present
-            tool_usage = None
-            if isinstance(response, dict) and "_tool_usage" in response:
-                tool_usage = response.pop("_tool_usage")
-            update_fields = get_update_fields_from_response(
-                agent,
-                response,
-                agent_type,
-                tool_usage=tool_usage,
-            )
-            logger.info(
-                f"Update fields for transaction {transaction.id}: {update_fields}"
-            )
-            rows_updated = Transaction.objects.filter(id=transaction.id).update(
-                **update_fields
-            )
-            logger.info(f"Updated {rows_updated} rows for transaction {transaction.id}")
-            updated_tx = Transaction.objects.get(id=transaction.id)
-            logger.info(
-                f"Transaction {transaction.id} after update: payee={updated_tx.payee}, classification_type={updated_tx.classification_type}, worksheet={updated_tx.worksheet}, confidence={updated_tx.confidence}, category={updated_tx.category}"
-            )
-        messages.success(
-            request,
-            f"Successfully processed {queryset.count()} transactions with {agent.name}",
-        )
+        apply_agent_results(request, agent, queryset)
     except Agent.DoesNotExist:
         messages.error(request, "Selected agent not found")
     except Exception as e:
@@ -1168,54 +1183,10 @@ class TransactionAdmin(admin.ModelAdmin):
     def _create_agent_action(self, agent):
         def process_with_agent(modeladmin, request, queryset):
             try:
-                for transaction in queryset:
-                    logger.info(
-                        f"Processing transaction {transaction.id} with agent {agent.name}"
-                    )
-                    response = call_agent(agent.name, transaction)
-                    logger.info(f"Agent response: {response}")
-                    # Robust agent_type mapping
-                    purpose = (
-                        getattr(agent, "purpose", "").lower()
-                        if hasattr(agent, "purpose")
-                        else ""
-                    )
-                    name = (
-                        getattr(agent, "name", "").lower()
-                        if hasattr(agent, "name")
-                        else ""
-                    )
-                    if "payee" in purpose or "payee" in name:
-                        agent_type = "payee"
-                    else:
-                        agent_type = "classification"
-                    # Detect tool usage from response if present
-                    tool_usage = None
-                    if isinstance(response, dict) and "_tool_usage" in response:
-                        tool_usage = response.pop("_tool_usage")
-                    update_fields = get_update_fields_from_response(
-                        agent,
-                        response,
-                        agent_type,
-                        tool_usage=tool_usage,
-                    )
-                    logger.info(
-                        f"Update fields for transaction {transaction.id}: {update_fields}"
-                    )
-                    rows_updated = Transaction.objects.filter(id=transaction.id).update(
-                        **update_fields
-                    )
-                    logger.info(
-                        f"Updated {rows_updated} rows for transaction {transaction.id}"
-                    )
-                    updated_tx = Transaction.objects.get(id=transaction.id)
-                    logger.info(
-                        f"Transaction {transaction.id} after update: payee={updated_tx.payee}, classification_type={updated_tx.classification_type}, worksheet={updated_tx.worksheet}, confidence={updated_tx.confidence}, category={updated_tx.category}"
-                    )
-                messages.success(
-                    request,
-                    f"Successfully processed {queryset.count()} transactions with {agent.name}",
+                logger.info(
+                    f"Processing {queryset.count()} transactions with agent {agent.name}"
                 )
+                apply_agent_results(request, agent, queryset)
             except Exception as e:
                 logger.error(
                     f"Error processing transactions with {agent.name}: {str(e)}",
@@ -1243,7 +1214,13 @@ class TransactionAdmin(admin.ModelAdmin):
 
 @admin.register(LLMConfig)
 class LLMConfigAdmin(admin.ModelAdmin):
-    list_display = ("provider", "model", "url")
+    list_display = (
+        "provider",
+        "model",
+        "url",
+        "requests_per_minute",
+        "tokens_per_minute",
+    )
     search_fields = ("provider", "model")
     exclude = ("id",)  # Prevent manual id entry in admin
 
@@ -1290,6 +1267,14 @@ class BusinessExpenseCategoryAdmin(admin.ModelAdmin):
     ordering = ("business", "category_name")
 
 
+@admin.register(ClassifierModel)
+class ClassifierModelAdmin(admin.ModelAdmin):
+    list_display = ("client", "example_count", "class_count", "trained_at")
+    search_fields = ("client__client_id", "client__company_name")
+    readonly_fields = ("example_count", "class_count", "metrics", "trained_at")
+    exclude = ("state",)  # Large term-count blob; retrain with train_classifier
+
+
 @admin.register(ProcessingTask)
 class ProcessingTaskAdmin(admin.ModelAdmin):
     list_display = (
@@ -1297,6 +1282,7 @@ class ProcessingTaskAdmin(admin.ModelAdmin):
         "task_type",
         "client",
         "status",
+        "priority",
         "transaction_count",
         "processed_count",
         "error_count",
@@ -1306,6 +1292,7 @@ class ProcessingTaskAdmin(admin.ModelAdmin):
     list_filter = (
         "task_type",
         "status",
+        "priority",
         "client",
         "created_at",
         "updated_at",
@@ -1329,39 +1316,79 @@ class ProcessingTaskAdmin(admin.ModelAdmin):
         "error_details",
         "task_metadata",
     )
-    actions = ["retry_failed_tasks", "cancel_tasks", "run_task"]
+    actions = [
+        "retry_failed_tasks",
+        "cancel_tasks",
+        "pause_tasks",
+        "resume_tasks",
+        "run_task",
+        "use_batch_api",
+    ]
+
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path(
+                "<uuid:task_id>/progress/",
+                self.admin_site.admin_view(self.progress_view),
+                name="profiles_processingtask_progress",
+            ),
+        ]
+        return custom_urls + urls
+
+    def progress_view(self, request, task_id):
+        """
+        JSON progress for the change page to poll: cached counters plus the
+        log lines written since ``?offset=`` (see profiles.task_progress).
+        """
+        from django.http import Http404, JsonResponse
+
+        from .task_progress import get_progress_snapshot, get_task_log_path, tail_log
+
+        snapshot = get_progress_snapshot(task_id)
+        if snapshot is None:
+            raise Http404("Task not found")
+        offset = request.GET.get("offset")
+        log, next_offset = tail_log(
+            get_task_log_path(task_id),
+            offset=int(offset) if offset and offset.isdigit() else None,
+        )
+        return JsonResponse({**snapshot, "log": log, "log_offset": next_offset})
 
     def change_view(self, request, object_id, form_url="", extra_context=None):
+        from .task_progress import get_task_log_path, tail_log
+
         extra_context = extra_context or {}
         task = self.get_object(request, object_id)
         # Always read-only
         extra_context["hide_save"] = True
-        # Auto-refresh if running
-        if task and task.status in ["pending", "processing"]:
-            extra_context["auto_refresh"] = True
-        # Add log viewer if log file exists
-        import os
-        from django.conf import settings
-        from pathlib import Path
-
-        log_file = Path(settings.BASE_DIR) / "logs" / f"task_{task.task_id}.log"
+        if task is None:
+            return super().change_view(
+                request, object_id, form_url, extra_context=extra_context
+            )
+        # Poll for progress while the task is running
+        if task.status in ["pending", "processing"]:
+            extra_context["progress_url"] = reverse(
+                "admin:profiles_processingtask_progress", args=[task.task_id]
+            )
+        log_file = get_task_log_path(task.task_id)
         if log_file.exists():
             try:
-                with open(log_file, "r") as f:
-                    lines = f.readlines()[-100:]
-                log_content = mark_safe(
-                    '<pre style="max-height:300px;overflow:auto;background:#222;color:#eee;padding:10px;">{}</pre>'.format(
-                        "".join(lines)
-                    )
+                log, log_offset = tail_log(log_file)
+                extra_context["log_content"] = format_html(
+                    '<pre id="task-log" style="max-height:300px;overflow:auto;'
+                    'background:#222;color:#eee;padding:10px;">{}</pre>',
+                    log,
                 )
-                extra_context["log_content"] = log_content
+                extra_context["log_offset"] = log_offset
             except Exception:
                 extra_context["log_content"] = mark_safe(
                     '<pre style="color:red;">Error reading log file.</pre>'
                 )
         else:
             extra_context["log_content"] = mark_safe(
-                '<pre style="color:#888;">No log file found for this task.</pre>'
+                '<pre id="task-log" data-empty="1" style="color:#888;">'
+                "No log file found for this task.</pre>"
             )
         return super().change_view(
             request, object_id, form_url, extra_context=extra_context
@@ -1369,6 +1396,8 @@ class ProcessingTaskAdmin(admin.ModelAdmin):
 
     def run_task(self, request, queryset):
         """Execute the selected task and show progress."""
+        if settings.TASK_BACKEND == "celery":
+            return self._enqueue_tasks(request, queryset)
         if queryset.count() > 1:
             messages.error(request, "Please select only one task to run at a time.")
             return
@@ -1391,11 +1420,12 @@ class ProcessingTaskAdmin(admin.ModelAdmin):
                 messages.error(request, f"Task {task.task_id} is not in pending state.")
                 return
 
-            # Update task status to processing and commit it
-            with db_transaction.atomic():
-                task.status = "processing"
-                task.started_at = timezone.now()
-                task.save(force_update=True)
+            # Claim it like a worker would, so run_workers can't pick it up too
+            from .task_queue import claim_task
+
+            if claim_task(task.task_id, f"admin:{request.user}") is None:
+                messages.error(request, f"Task {task.task_id} was already claimed.")
+                return
 
             # Start the task processing command
             python_executable = sys.executable
@@ -1496,13 +1526,39 @@ class ProcessingTaskAdmin(admin.ModelAdmin):
 
     run_task.short_description = "Run selected task"
 
+    def _enqueue_tasks(self, request, queryset):
+        """Send the selected pending tasks to their Celery queues."""
+        from .tasks import enqueue_processing_task
+
+        enqueued = 0
+        for task in queryset.filter(status="pending"):
+            enqueue_processing_task(task)
+            enqueued += 1
+        skipped = queryset.count() - enqueued
+        self.message_user(request, f"Enqueued {enqueued} tasks")
+        if skipped:
+            messages.warning(request, f"Skipped {skipped} tasks not in pending state")
+
     def retry_failed_tasks(self, request, queryset):
         """Retry failed processing tasks."""
         for task in queryset.filter(status="failed"):
             task.status = "pending"
+            task.control = ""
             task.error_count = 0
             task.error_details = {}
+            task.task_metadata.pop("cursor", None)
             task.save()
+            skipped = task.transaction_states.filter(status="done").count()
+            if skipped:
+                messages.info(
+                    request,
+                    f"Task {task.task_id}: {skipped} transactions already succeeded "
+                    f"and will be skipped",
+                )
+            if settings.TASK_BACKEND == "celery":
+                from .tasks import enqueue_processing_task
+
+                enqueue_processing_task(task)
             messages.success(request, f"Retrying task {task.task_id}")
         messages.success(
             request, f"Retried {queryset.filter(status='failed').count()} failed tasks"
@@ -1511,22 +1567,59 @@ class ProcessingTaskAdmin(admin.ModelAdmin):
     retry_failed_tasks.short_description = "Retry failed tasks"
 
     def cancel_tasks(self, request, queryset):
-        """Cancel selected processing tasks."""
-        for task in queryset.filter(status__in=["pending", "processing"]):
-            task.status = "failed"
-            task.error_details = {
-                "cancelled": True,
-                "cancelled_at": str(datetime.now()),
-            }
-            task.save()
-            messages.success(request, f"Cancelled task {task.task_id}")
-        messages.success(
-            request,
-            f"Cancelled {queryset.filter(status__in=['pending', 'processing']).count()} tasks",
-        )
+        """Cancel selected processing tasks; running workers stop cooperatively."""
+        from .task_queue import cancel_task
+
+        cancelled = 0
+        for task in queryset:
+            if cancel_task(task):
+                cancelled += 1
+                messages.success(request, f"Cancelled task {task.task_id}")
+        messages.success(request, f"Cancelled {cancelled} tasks")
 
     cancel_tasks.short_description = "Cancel selected tasks"
 
+    def pause_tasks(self, request, queryset):
+        """Pause selected tasks; running ones stop after their current results."""
+        from .task_queue import pause_task
+
+        paused = sum(1 for task in queryset if pause_task(task))
+        messages.success(request, f"Pausing {paused} tasks")
+
+    pause_tasks.short_description = "Pause selected tasks"
+
+    def resume_tasks(self, request, queryset):
+        """Resume selected paused tasks where they left off."""
+        from .task_queue import resume_task
+
+        resumed = 0
+        for task in queryset:
+            if not resume_task(task):
+                continue
+            resumed += 1
+            if settings.TASK_BACKEND == "celery":
+                from .tasks import enqueue_processing_task, enqueue_work_units
+
+                task.refresh_from_db()
+                if task.status == "pending":
+                    enqueue_processing_task(task)
+                elif task.status == "processing":
+                    enqueue_work_units(task)
+        messages.success(request, f"Resumed {resumed} tasks")
+
+    resume_tasks.short_description = "Resume selected paused tasks"
+
+    def use_batch_api(self, request, queryset):
+        """Run selected pending tasks through the offline Batch API when started."""
+        updated = 0
+        for task in queryset.filter(status="pending"):
+            task.task_metadata["execution_mode"] = EXECUTION_MODE_BATCH_API
+            task.save(update_fields=["task_metadata", "updated_at"])
+            updated += 1
+        messages.success(request, f"{updated} pending tasks will use the Batch API")
+
+    use_batch_api.short_description = "Use offline Batch API for selected tasks"
+
     def view_task_transactions(self, request, task_id):
         """View transactions associated with a processing task."""
         task = get_object_or_404(ProcessingTask, task_id=task_id)
@@ -1566,7 +1659,9 @@ class StatementFileAdminForm(forms.ModelForm):
 
 def get_parser_module_choices():
     try:
-        sys.path.append("/Users/greg/repos/LedgerFlow_AI/PDF-extractor")
+        parsers_path = getattr(settings, "STATEMENT_PARSERS_PATH", "")
+        if parsers_path and parsers_path not in sys.path:
+            sys.path.append(parsers_path)
         from dataextractai.parsers_core.autodiscover import autodiscover_parsers
 
         autodiscover_parsers()
@@ -1754,200 +1849,29 @@ class StatementFileAdmin(admin.ModelAdmin):
                 auto_parse = form.cleaned_data["auto_parse"]
                 files = request.FILES.getlist("files")
                 uploaded_by = request.user if request.user.is_authenticated else None
-                results = []
-                import sys
-
-                sys.path.append("/Users/greg/repos/LedgerFlow_AI/PDF-extractor")
-                from dataextractai.parsers_core.autodiscover import autodiscover_parsers
-
-                autodiscover_parsers()
-                import importlib
-
-                registry_mod = importlib.import_module(
-                    "dataextractai.parsers_core.registry"
+                from .ingestion_queue import create_ingestion_job
+
+                # Only store the files here; a worker parses and imports them
+                job = create_ingestion_job(
+                    client,
+                    files,
+                    file_type=file_type,
+                    parser_module=parser_module,
+                    account_number=account_number,
+                    auto_parse=auto_parse,
+                    uploaded_by=uploaded_by,
                 )
-                registry = getattr(registry_mod, "ParserRegistry")
-                for f in files:
-                    result = {"file": f.name}
-                    temp_file_path = None
-                    try:
-                        import tempfile, os
-
-                        with tempfile.NamedTemporaryFile(
-                            delete=False, suffix=os.path.splitext(f.name)[1]
-                        ) as temp_file:
-                            for chunk in f.chunks():
-                                temp_file.write(chunk)
-                            temp_file_path = temp_file.name
-                        # Detect parser if needed
-                        used_parser = parser_module
-                        if parser_module == "autodetect" or not parser_module:
-                            from dataextractai.parsers.detect import (
-                                detect_parser_for_file,
-                            )
-
-                            detected = detect_parser_for_file(temp_file_path)
-                            if detected:
-                                used_parser = detected
-                                result["parser"] = detected
-                            else:
-                                result["error"] = "No compatible parser found."
-                                results.append(result)
-                                os.unlink(temp_file_path)
-                                continue
-                        # Get parser class from registry
-                        parser_cls = registry.get_parser(used_parser)
-                        if not parser_cls:
-                            result["error"] = (
-                                f"Parser '{used_parser}' not found in registry."
-                            )
-                            results.append(result)
-                            os.unlink(temp_file_path)
-                            continue
-                        # Call main() and expect ParserOutput
-                        parser_mod = importlib.import_module(parser_cls.__module__)
-                        parser_main = getattr(parser_mod, "main")
-                        try:
-                            parser_output = parser_main(input_path=temp_file_path)
-                        except Exception as e:
-                            result["error"] = f"Parser error: {e}"
-                            results.append(result)
-                            os.unlink(temp_file_path)
-                            continue
-                        # Validate ParserOutput
-                        try:
-                            from dataextractai.parsers_core.models import ParserOutput
-
-                            if not isinstance(parser_output, ParserOutput):
-                                result["error"] = (
-                                    f"Parser did not return ParserOutput. Got: {type(parser_output)}"
-                                )
-                                results.append(result)
-                                os.unlink(temp_file_path)
-                                continue
-                        except Exception as e:
-                            result["error"] = f"ParserOutput validation error: {e}"
-                            results.append(result)
-                            os.unlink(temp_file_path)
-                            continue
-                        # Extract metadata and transactions
-                        metadata = (
-                            parser_output.metadata.dict()
-                            if parser_output.metadata
-                            else {}
-                        )
-                        transactions = (
-                            [t.dict() for t in parser_output.transactions]
-                            if parser_output.transactions
-                            else []
-                        )
-                        result["normalized"] = True
-                        result["metadata"] = metadata
-                        result["transaction_count"] = len(transactions)
-                        if parser_output.errors:
-                            result["errors"] = parser_output.errors
-                        if parser_output.warnings:
-                            result["warnings"] = parser_output.warnings
-                        # Create StatementFile
-                        try:
-                            statement_file = StatementFile.objects.create(
-                                client=client,
-                                file=f,
-                                file_type=file_type,
-                                account_number=metadata.get(
-                                    "account_number", account_number
-                                ),
-                                original_filename=f.name,
-                                uploaded_by=uploaded_by,
-                                status="uploaded",
-                                bank=metadata.get("bank_name"),
-                                year=metadata.get("year"),
-                                month=metadata.get("month"),
-                                parser_module=used_parser,
-                                account_holder_name=metadata.get("account_holder_name"),
-                                address=metadata.get("address"),
-                                account_type=metadata.get("account_type"),
-                                statement_period_start=metadata.get(
-                                    "statement_period_start"
-                                ),
-                                statement_period_end=metadata.get(
-                                    "statement_period_end"
-                                ),
-                                statement_date=metadata.get("statement_date"),
-                                parsed_metadata=metadata,
-                            )
-                            result["statement_file"] = statement_file.id
-                        except Exception as e:
-                            result["error"] = f"StatementFile creation failed: {e}"
-                            results.append(result)
-                            os.unlink(temp_file_path)
-                            continue
-                        # Create transactions immediately after parsing
-                        transactions_created = 0
-                        transaction_errors = []
-                        from profiles.models import Transaction
-
-                        for idx, tx in enumerate(transactions):
-                            try:
-                                Transaction.objects.create(
-                                    client=client,
-                                    statement_file=statement_file,
-                                    transaction_date=tx.get("transaction_date"),
-                                    amount=tx.get("amount"),
-                                    description=tx.get("description"),
-                                    category=tx.get("category", ""),
-                                    file_path=statement_file.file.name,
-                                    source=tx.get("source", "batch_upload"),
-                                    transaction_type=tx.get("transaction_type", ""),
-                                    normalized_amount=tx.get("normalized_amount"),
-                                    parser_name=used_parser,
-                                    classification_method=tx.get(
-                                        "classification_method", "None"
-                                    ),
-                                    payee_extraction_method=tx.get(
-                                        "payee_extraction_method", "None"
-                                    ),
-                                )
-                                transactions_created += 1
-                            except Exception as e:
-                                transaction_errors.append(
-                                    {"index": idx, "error": str(e)}
-                                )
-                        result["transactions_created"] = transactions_created
-                        result["transaction_errors"] = transaction_errors
-                        # Optionally create ParsingRun (for audit, not for deferred processing)
-                        if auto_parse and used_parser:
-                            try:
-                                ParsingRun.objects.create(
-                                    statement_file=statement_file,
-                                    parser_module=used_parser,
-                                    status="completed",
-                                )
-                                result["parsing_run"] = "created"
-                            except Exception as e:
-                                result["parsing_run_error"] = str(e)
-                        result["success"] = True
-                        os.unlink(temp_file_path)
-                    except Exception as e:
-                        result["error"] = str(e)
-                        if temp_file_path and os.path.exists(temp_file_path):
-                            os.unlink(temp_file_path)
-                    results.append(result)
-                from django.urls import reverse
-                from django.contrib import messages
-
+                duplicates = job.files.filter(status="duplicate").count()
                 messages.success(
-                    request, f"Processed {len(files)} files. See results below."
-                )
-                context = {
-                    "form": form,
-                    "results": results,
-                    "title": "Batch Upload Statement Files",
-                }
-                context.update(self.admin_site.each_context(request))
-                return render(
-                    request, "admin/batch_upload_statement_files.html", context
+                    request,
+                    f"Queued {len(files) - duplicates} files for import. Their progress is shown below.",
                 )
+                if duplicates:
+                    messages.info(
+                        request,
+                        f"Skipped {duplicates} files that were already uploaded.",
+                    )
+                return redirect("admin:profiles_ingestionjob_change", job.job_id)
             else:
                 context = {
                     "form": form,
@@ -1980,6 +1904,110 @@ class StatementFileAdmin(admin.ModelAdmin):
         return custom_urls + urls  # CUSTOM URLS FIRST
 
 
+class IngestionJobFileInline(admin.TabularInline):
+    model = IngestionJobFile
+    fields = (
+        "index",
+        "original_filename",
+        "status",
+        "statement_file",
+        "transactions_created",
+        "duplicates",
+        "error",
+    )
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+    show_change_link = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def transactions_created(self, obj):
+        return obj.result.get("transactions_created")
+
+    transactions_created.short_description = "Transactions created"
+
+    def duplicates(self, obj):
+        """Duplicate rows skipped while importing the file (see ingest_transactions)."""
+        return len(obj.result.get("duplicate_transactions", []))
+
+    duplicates.short_description = "Duplicate rows"
+
+
+@admin.register(IngestionJob)
+class IngestionJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "job_id",
+        "client",
+        "status",
+        "progress",
+        "uploaded_by",
+        "created_at",
+    )
+    list_filter = ("status", "client")
+    readonly_fields = (
+        "job_id",
+        "client",
+        "uploaded_by",
+        "status",
+        "file_type",
+        "parser_module",
+        "account_number",
+        "auto_parse",
+        "file_count",
+        "processed_count",
+        "error",
+        "worker_id",
+        "attempts",
+        "started_at",
+        "created_at",
+        "updated_at",
+    )
+    inlines = [IngestionJobFileInline]
+
+    def has_add_permission(self, request):
+        return False
+
+    def progress(self, obj):
+        return f"{obj.processed_count} / {obj.file_count}"
+
+    progress.short_description = "Files done"
+
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path(
+                "<uuid:job_id>/progress/",
+                self.admin_site.admin_view(self.progress_view),
+                name="profiles_ingestionjob_progress",
+            ),
+        ]
+        return custom_urls + urls
+
+    def progress_view(self, request, job_id):
+        """JSON status of the job and each of its files, polled by the change page."""
+        from django.http import Http404, JsonResponse
+
+        from .ingestion_queue import job_progress
+
+        progress = job_progress(job_id)
+        if progress is None:
+            raise Http404("Ingestion job not found")
+        return JsonResponse(progress)
+
+    def change_view(self, request, object_id, form_url="", extra_context=None):
+        extra_context = extra_context or {}
+        job = self.get_object(request, object_id)
+        if job is not None and job.status in ("pending", "processing"):
+            extra_context["progress_url"] = reverse(
+                "admin:profiles_ingestionjob_progress", args=[job.job_id]
+            )
+        return super().change_view(
+            request, object_id, form_url, extra_context=extra_context
+        )
+
+
 @admin.register(ParsingRun)
 class ParsingRunAdmin(admin.ModelAdmin):
     list_display = (
@@ -0,0 +1,186 @@
+"""
+Process-wide registry of compiled agent definitions and pooled OpenAI clients.
+
+call_agent runs once per transaction, so everything that only depends on the
+Agent/Tool/LLMConfig rows (prompt template, model, tool schemas and the
+imported tool callables) is resolved once and reused until one of those rows
+changes. OpenAI clients are shared so their HTTP connection pool (and TLS
+session) survives across calls; the client is thread-safe.
+
+Save/delete signals clear the local registry and bump a version stamp in the
+shared cache, which other processes (task workers) check every few seconds.
+"""
+
+import hashlib
+import importlib
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+from django.core.cache import cache
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from openai import OpenAI
+
+from .models import Agent, LLMConfig, Tool
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = "agent_registry:version"
+VERSION_CHECK_INTERVAL = 5  # seconds
+
+_lock = threading.Lock()
+_agents: Dict[str, "CompiledAgent"] = {}
+_clients: Dict[tuple, OpenAI] = {}
+_version = {"seen": None, "checked_at": 0.0}
+
+
+@dataclass
+class CompiledAgent:
+    id: int
+    name: str
+    purpose: str
+    prompt: str
+    model: Optional[str]
+    base_url: Optional[str]
+    requests_per_minute: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
+    tool_definitions: List[dict] = field(default_factory=list)
+    tool_functions: Dict[str, Optional[Callable]] = field(default_factory=dict)
+
+    @property
+    def prompt_hash(self):
+        return hashlib.sha256((self.prompt or "").encode("utf-8")).hexdigest()
+
+    @property
+    def is_classification(self):
+        return (
+            "classification" in (self.purpose or "").lower()
+            or "classification" in (self.name or "").lower()
+        )
+
+
+def _build_tool_definition(tool):
+    return {
+        "name": tool.name,
+        "type": "function",
+        "function": {
+            "name": tool.name,
+            "description": tool.description,
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "query": {
+                        "type": "string",
+                        "description": "The search query to look up",
+                    }
+                },
+                "required": ["query"],
+            },
+        },
+    }
+
+
+def _resolve_tool_function(tool):
+    """Import a tool's module and return its callable, or None if it can't be loaded."""
+    try:
+        module = importlib.import_module(tool.module_path)
+        return getattr(module, tool.name)
+    except Exception as e:
+        logger.error(f"Could not load tool {tool.name} from {tool.module_path}: {e}")
+        return None
+
+
+def _compile_agent(name):
+    agent = Agent.objects.select_related("llm").prefetch_related("tools").get(name=name)
+    tools = list(agent.tools.all())
+    return CompiledAgent(
+        id=agent.id,
+        name=agent.name,
+        purpose=agent.purpose,
+        prompt=agent.prompt,
+        model=agent.llm.model if agent.llm else None,
+        base_url=agent.llm.url if agent.llm else None,
+        requests_per_minute=agent.llm.requests_per_minute if agent.llm else None,
+        tokens_per_minute=agent.llm.tokens_per_minute if agent.llm else None,
+        tool_definitions=[_build_tool_definition(tool) for tool in tools],
+        tool_functions={tool.name: _resolve_tool_function(tool) for tool in tools},
+    )
+
+
+def _shared_version():
+    try:
+        return cache.get(VERSION_KEY, 0)
+    except Exception as e:
+        logger.debug(f"Could not read agent registry version: {e}")
+        return _version["seen"]
+
+
+def _check_version():
+    """Drop compiled agents if another process changed an Agent/Tool/LLMConfig."""
+    now = time.monotonic()
+    if now - _version["checked_at"] < VERSION_CHECK_INTERVAL:
+        return
+    current = _shared_version()
+    with _lock:
+        if _version["seen"] is not None and current != _version["seen"]:
+            _agents.clear()
+        _version["seen"] = current
+        _version["checked_at"] = now
+
+
+def get_compiled_agent(name):
+    """Return the CompiledAgent for an agent name; raises Agent.DoesNotExist."""
+    _check_version()
+    compiled = _agents.get(name)
+    if compiled is None:
+        compiled = _compile_agent(name)
+        with _lock:
+            _agents[name] = compiled
+    return compiled
+
+
+def get_openai_client(base_url=None, api_key=None):
+    """Return a shared OpenAI client for (api_key, base_url)."""
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    key = (api_key, base_url)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                if base_url:
+                    client = OpenAI(api_key=api_key, base_url=base_url)
+                else:
+                    client = OpenAI(api_key=api_key)
+                _clients[key] = client
+    return client
+
+
+def invalidate_agents():
+    """Drop every compiled agent here and tell other processes to do the same."""
+    with _lock:
+        _agents.clear()
+    try:
+        cache.add(VERSION_KEY, 0, timeout=None)
+        cache.incr(VERSION_KEY)
+    except Exception as e:
+        logger.warning(f"Could not bump agent registry version: {e}")
+
+
+@receiver(post_save, sender=Agent)
+@receiver(post_delete, sender=Agent)
+@receiver(post_save, sender=Tool)
+@receiver(post_delete, sender=Tool)
+@receiver(post_save, sender=LLMConfig)
+@receiver(post_delete, sender=LLMConfig)
+def _invalidate_on_change(sender, **kwargs):
+    invalidate_agents()
+
+
+@receiver(m2m_changed, sender=Agent.tools.through)
+def _invalidate_on_tools_changed(sender, **kwargs):
+    invalidate_agents()
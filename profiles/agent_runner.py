@@ -0,0 +1,132 @@
+"""
+Concurrent execution engine for agent calls.
+
+Every consumer of ``call_agent`` (task runners, management commands and admin
+actions) hands its batch of transactions to ``run_agent_concurrently``, which
+fans the LLM round-trips out over a bounded thread pool and yields results back
+to the caller as they complete. Database writes stay on the caller's thread.
+"""
+
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db import connection
+
+from . import llm_cache, telemetry
+from .learned_classifier import classify_locally
+from .utils import get_update_fields_from_response
+
+logger = logging.getLogger(__name__)
+
+# Used when neither AGENT_CONCURRENCY nor AGENT_MAX_CONCURRENCY is configured.
+DEFAULT_AGENT_CONCURRENCY = 4
+
+AgentResult = namedtuple("AgentResult", ["transaction", "update_fields", "error"])
+
+
+def get_agent_type(agent):
+    """Map an Agent to the agent_type expected by get_update_fields_from_response."""
+    purpose = (getattr(agent, "purpose", "") or "").lower()
+    name = (getattr(agent, "name", "") or "").lower()
+    if "payee" in purpose or "payee" in name:
+        return "payee"
+    return "classification"
+
+
+def get_agent_concurrency(agent_name):
+    """
+    Return the maximum number of in-flight calls for an agent.
+    settings.AGENT_CONCURRENCY may map agent names to per-agent limits;
+    settings.AGENT_MAX_CONCURRENCY is the default for every other agent.
+    """
+    overrides = getattr(settings, "AGENT_CONCURRENCY", {}) or {}
+    default = getattr(settings, "AGENT_MAX_CONCURRENCY", DEFAULT_AGENT_CONCURRENCY)
+    return max(1, int(overrides.get(agent_name, default)))
+
+
+def _call_agent(agent_name, transaction, close_connection):
+    # Imported lazily: profiles.admin imports this module for its actions.
+    from .admin import call_agent
+
+    try:
+        with telemetry.stage("agent_call"):
+            return call_agent(agent_name, transaction)
+    finally:
+        # Worker threads get their own DB connection; don't leak it.
+        if close_connection:
+            connection.close()
+
+
+def _build_result(agent, agent_type, transaction, response):
+    tool_usage = None
+    cached = False
+    if isinstance(response, dict):
+        tool_usage = response.pop("_tool_usage", None)
+        cached = response.pop(llm_cache.HIT_MARKER, False)
+    update_fields = get_update_fields_from_response(
+        agent, response, agent_type, tool_usage=tool_usage, cached=cached
+    )
+    return AgentResult(transaction, update_fields, None)
+
+
+def run_agent_concurrently(
+    agent, transactions, agent_type=None, max_workers=None, use_rules=True
+):
+    """
+    Call ``agent`` for every transaction with bounded parallelism.
+
+    Yields an AgentResult(transaction, update_fields, error) per transaction in
+    completion order. Exactly one of update_fields/error is set, so a failing
+    transaction never affects the others; the caller decides how to persist
+    update_fields and how to record errors.
+
+    For classification, transactions decided by profiles.rule_engine or the
+    learned classifier are answered first without an agent call (pass
+    use_rules=False if the caller already ran those stages).
+    """
+    agent_type = agent_type or get_agent_type(agent)
+    max_workers = max_workers or get_agent_concurrency(agent.name)
+    transactions = list(transactions)
+    if agent_type == "classification" and use_rules:
+        matched, transactions = classify_locally(transactions)
+        for transaction, update_fields, _ in matched:
+            yield AgentResult(transaction, update_fields, None)
+    if not transactions:
+        return
+
+    if max_workers == 1 or len(transactions) == 1:
+        # Run inline: no thread hop, and the caller's DB connection is reused.
+        for transaction in transactions:
+            try:
+                response = _call_agent(agent.name, transaction, False)
+                yield _build_result(agent, agent_type, transaction, response)
+            except Exception as e:
+                yield AgentResult(transaction, None, e)
+        return
+
+    workers = min(max_workers, len(transactions))
+    logger.info(
+        f"Running {agent.name} on {len(transactions)} transactions with {workers} workers"
+    )
+    executor = ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix=f"agent-{agent.pk}"
+    )
+    call = telemetry.propagate(_call_agent)
+    futures = {
+        executor.submit(call, agent.name, transaction, True): transaction
+        for transaction in transactions
+    }
+    try:
+        for future in as_completed(futures):
+            transaction = futures[future]
+            try:
+                yield _build_result(agent, agent_type, transaction, future.result())
+            except Exception as e:
+                yield AgentResult(transaction, None, e)
+    finally:
+        # If the caller stops early, don't start calls nobody will read.
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
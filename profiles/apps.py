@@ -8,6 +8,11 @@ class ProfilesConfig(AppConfig):
     name = "profiles"
 
     def ready(self):
+        # Register cache invalidation signals for compiled agents, rules and classifiers
+        from . import agent_registry  # noqa: F401
+        from . import learned_classifier  # noqa: F401
+        from . import rule_engine  # noqa: F401
+
         # Only run in main process, not migrations or shell_plus
         if os.environ.get("RUN_MAIN") == "true" or (
             len(sys.argv) > 1
@@ -0,0 +1,305 @@
+"""
+Offline bulk execution of ProcessingTasks through an OpenAI-style Batch API.
+
+For year-end backlogs latency doesn't matter, so a task whose
+task_metadata["execution_mode"] is "batch_api" is run by serializing one chat
+completion request per transaction into a JSONL file, submitting it as a
+batch, polling until the batch finishes and applying all results in bulk.
+
+Two backends share the same interface (``files.create/content`` and
+``batches.create/retrieve``): the real OpenAI client, and LocalBatchClient, a
+file-backed stand-in that lets the whole flow run offline. Batch requests
+can't run tool round-trips, so rows the batch can't answer (tool calls, bad
+JSON, per-request errors) fall back to the interactive call_agent path.
+"""
+
+import json
+import logging
+import time
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .agent_registry import get_compiled_agent, get_openai_client
+from .agent_runner import run_agent_concurrently
+from .result_writer import ResultWriter
+from .utils import get_update_fields_from_response
+
+logger = logging.getLogger(__name__)
+
+EXECUTION_MODE_BATCH_API = "batch_api"
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def get_batch_dir():
+    path = Path(
+        getattr(settings, "LLM_BATCH_DIR", Path(settings.BASE_DIR) / "data" / "batches")
+    )
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def chat_completion_responder(body):
+    """Default LocalBatchClient responder: run the request as a normal chat completion."""
+    response = get_openai_client().chat.completions.create(**body)
+    return response.model_dump()
+
+
+class LocalBatchClient:
+    """
+    File-backed stand-in for the OpenAI Files + Batches APIs.
+
+    Files and batch records are stored under ``root``. A batch is executed
+    the first time it is retrieved: every request line is passed to
+    ``responder(body) -> chat completion dict`` and the results are written
+    to an output file in the Batch API's output format.
+    """
+
+    def __init__(self, root=None, responder=None):
+        self.root = Path(root or get_batch_dir() / "local")
+        (self.root / "files").mkdir(parents=True, exist_ok=True)
+        (self.root / "batches").mkdir(parents=True, exist_ok=True)
+        if responder is None:
+            responder = import_string(
+                getattr(
+                    settings,
+                    "LLM_BATCH_LOCAL_RESPONDER",
+                    "profiles.batch_api.chat_completion_responder",
+                )
+            )
+        self.responder = responder
+        self.files = SimpleNamespace(create=self._create_file, content=self._content)
+        self.batches = SimpleNamespace(
+            create=self._create_batch, retrieve=self._retrieve_batch
+        )
+
+    def _file_path(self, file_id):
+        return self.root / "files" / f"{file_id}.jsonl"
+
+    def _batch_path(self, batch_id):
+        return self.root / "batches" / f"{batch_id}.json"
+
+    def _write_file(self, data):
+        file_id = f"file-{uuid.uuid4().hex}"
+        self._file_path(file_id).write_bytes(data)
+        return file_id
+
+    def _create_file(self, file, purpose="batch"):
+        data = file.read() if hasattr(file, "read") else Path(file).read_bytes()
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        return SimpleNamespace(id=self._write_file(data), purpose=purpose)
+
+    def _content(self, file_id):
+        return SimpleNamespace(text=self._file_path(file_id).read_text())
+
+    def _create_batch(self, input_file_id, endpoint, completion_window="24h", **kwargs):
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}",
+            "input_file_id": input_file_id,
+            "endpoint": endpoint,
+            "completion_window": completion_window,
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        self._batch_path(batch["id"]).write_text(json.dumps(batch))
+        return SimpleNamespace(**batch)
+
+    def _retrieve_batch(self, batch_id):
+        batch = json.loads(self._batch_path(batch_id).read_text())
+        if batch["status"] not in TERMINAL_STATUSES:
+            batch = self._execute(batch)
+        return SimpleNamespace(**batch)
+
+    def _execute(self, batch):
+        lines = self._file_path(batch["input_file_id"]).read_text().splitlines()
+        output, errors = [], []
+        for line in filter(None, lines):
+            request = json.loads(line)
+            try:
+                body = self.responder(request["body"])
+                output.append(
+                    {
+                        "id": f"batch_req_{uuid.uuid4().hex}",
+                        "custom_id": request["custom_id"],
+                        "response": {"status_code": 200, "body": body},
+                        "error": None,
+                    }
+                )
+            except Exception as e:
+                errors.append(
+                    {
+                        "id": f"batch_req_{uuid.uuid4().hex}",
+                        "custom_id": request["custom_id"],
+                        "response": None,
+                        "error": {"message": str(e)},
+                    }
+                )
+        batch["output_file_id"] = self._write_file(_to_jsonl(output).encode("utf-8"))
+        if errors:
+            batch["error_file_id"] = self._write_file(_to_jsonl(errors).encode("utf-8"))
+        batch["status"] = "completed"
+        batch["request_counts"] = {
+            "total": len(output) + len(errors),
+            "completed": len(output),
+            "failed": len(errors),
+        }
+        self._batch_path(batch["id"]).write_text(json.dumps(batch))
+        return batch
+
+
+def _to_jsonl(rows):
+    return "".join(json.dumps(row) + "\n" for row in rows)
+
+
+def get_batch_client():
+    """Return the configured batch backend: settings.LLM_BATCH_BACKEND is 'openai' or 'local'."""
+    if getattr(settings, "LLM_BATCH_BACKEND", "openai") == "local":
+        return LocalBatchClient()
+    return get_openai_client()
+
+
+def build_batch_requests(agent, transactions):
+    """One Batch API request line per transaction, keyed by custom_id = transaction id."""
+    # Imported lazily: profiles.admin imports modules that import this one.
+    from .admin import build_agent_prompts
+
+    compiled = get_compiled_agent(agent.name)
+    if not compiled.model:
+        raise ValueError(
+            f"Agent '{agent.name}' does not have an LLM model configured in the UI."
+        )
+    requests = []
+    for transaction in transactions:
+        system_prompt, user_prompt = build_agent_prompts(compiled, transaction)
+        requests.append(
+            {
+                "custom_id": str(transaction.id),
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {
+                    "model": compiled.model,
+                    "messages": [
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt},
+                    ],
+                    "response_format": {"type": "json_object"},
+                },
+            }
+        )
+    return requests
+
+
+def parse_batch_output(text):
+    """Map custom_id -> parsed JSON response for every usable output line."""
+    results = {}
+    for line in filter(None, (text or "").splitlines()):
+        row = json.loads(line)
+        response = row.get("response") or {}
+        if row.get("error") or response.get("status_code") != 200:
+            continue
+        try:
+            message = response["body"]["choices"][0]["message"]
+            content = json.loads(message.get("content") or "")
+        except (KeyError, IndexError, TypeError, ValueError):
+            continue
+        if isinstance(content, dict) and content:
+            results[row["custom_id"]] = content
+    return results
+
+
+def run_batch_api_task(
+    task, agent, agent_type, groups, progress, log=logger, client=None
+):
+    """
+    Run a task through the Batch API. ``groups`` is a list of transaction lists
+    that share one agent call (see task_runner.group_by_vendor); outcomes are
+    reported to ``progress`` (see task_runner.TaskProgress). Submission state
+    is kept in task_metadata["batch_api"], so a restarted runner resumes
+    polling the batch it already submitted instead of paying for a second one.
+    """
+    client = client or get_batch_client()
+    members_by_id = {str(members[0].id): members for members in groups}
+    state = task.task_metadata.setdefault("batch_api", {})
+
+    if not state.get("batch_id"):
+        requests = build_batch_requests(agent, [members[0] for members in groups])
+        input_path = get_batch_dir() / f"task_{task.task_id}.jsonl"
+        with open(input_path, "w") as f:
+            for request in requests:
+                f.write(json.dumps(request) + "\n")
+        with open(input_path, "rb") as f:
+            input_file = client.files.create(file=f, purpose="batch")
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h",
+        )
+        state.update(
+            {
+                "batch_id": batch.id,
+                "input_file_id": input_file.id,
+                "input_path": str(input_path),
+                "request_count": len(requests),
+                "submitted_at": timezone.now().isoformat(),
+            }
+        )
+        task.save(update_fields=["task_metadata", "updated_at"])
+        log.info(f"Submitted batch {batch.id} with {len(requests)} requests")
+
+    poll_interval = getattr(settings, "LLM_BATCH_POLL_INTERVAL", 30)
+    while True:
+        batch = client.batches.retrieve(state["batch_id"])
+        state["status"] = batch.status
+        if batch.status in TERMINAL_STATUSES:
+            break
+        # A paused task resumes polling the same batch later
+        progress.check_control()
+        log.info(
+            f"Batch {batch.id} is {batch.status}; polling again in {poll_interval}s"
+        )
+        time.sleep(poll_interval)
+    state["completed_at"] = timezone.now().isoformat()
+
+    results = {}
+    if batch.status == "completed" and batch.output_file_id:
+        results = parse_batch_output(client.files.content(batch.output_file_id).text)
+    log.info(f"Batch {batch.id} {batch.status}: {len(results)} usable results")
+
+    with ResultWriter(progress) as writer:
+        for custom_id, response in results.items():
+            members = members_by_id.get(custom_id)
+            if members:
+                writer.add(
+                    members,
+                    get_update_fields_from_response(agent, response, agent_type),
+                )
+
+    # Anything the batch couldn't answer goes through the interactive path
+    unanswered = [
+        members[0]
+        for custom_id, members in members_by_id.items()
+        if custom_id not in results
+    ]
+    state["fallback_count"] = len(unanswered)
+    if unanswered:
+        log.info(f"{len(unanswered)} requests fall back to interactive calls")
+    with ResultWriter(progress) as writer:
+        for result in run_agent_concurrently(
+            agent, unanswered, agent_type=agent_type, use_rules=False
+        ):
+            progress.check_control()
+            members = members_by_id[str(result.transaction.id)]
+            if result.error is None:
+                writer.add(members, result.update_fields)
+            else:
+                progress.record(
+                    [], {transaction.id: result.error for transaction in members}
+                )
@@ -0,0 +1,259 @@
+"""
+Batched prompting mode for the Classification Agent.
+
+Instead of one chat completion per transaction, a client's transactions are
+packed N at a time into a single request that carries the system prompt
+(Agent.prompt, rendered as call_agent renders it), business profile and
+allowed categories once. The model answers with one JSON entry per
+transaction id; entries that are missing or fail validation fall back to the
+regular single-transaction call_agent path.
+"""
+
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+from . import telemetry
+from .admin import build_allowed_categories
+from .agent_registry import get_compiled_agent, get_openai_client
+from .agent_runner import AgentResult, get_agent_concurrency, run_agent_concurrently
+from .prompt_utils import get_batch_classification_prompts, render_agent_prompt
+from .rate_limit import estimate_tokens, get_llm_rate_limiter, usage_total_tokens
+from .utils import get_update_fields_from_response
+
+logger = logging.getLogger(__name__)
+
+VALID_CLASSIFICATION_TYPES = ("business", "personal")
+VALID_CONFIDENCE = ("high", "medium", "low")
+
+
+def get_classification_batch_size(task=None):
+    """Batch size for a task: task_metadata override, else settings (0 disables)."""
+    if task is not None and task.task_metadata.get("classification_batch_size"):
+        return int(task.task_metadata["classification_batch_size"])
+    return int(getattr(settings, "CLASSIFICATION_BATCH_SIZE", 0) or 0)
+
+
+def allowed_category_ids(allowed_categories):
+    """The category_id values (IRS-<n>, BIZ-<id>, ...) of an allowed-categories list."""
+    return {
+        line.split(":", 1)[0].strip()
+        for line in (allowed_categories or "").splitlines()
+        if ":" in line
+    }
+
+
+def validate_batch_item(item, allowed_ids=None):
+    """
+    Return an error string if a batch result entry is unusable, else None.
+    With ``allowed_ids``, category_id must be one of the client's categories.
+    """
+    if not isinstance(item, dict):
+        return "result is not an object"
+    if str(item.get("classification_type", "")).lower() not in (
+        VALID_CLASSIFICATION_TYPES
+    ):
+        return f"invalid classification_type {item.get('classification_type')!r}"
+    if not item.get("worksheet"):
+        return "missing worksheet"
+    if not (item.get("category_id") or item.get("category_name")):
+        return "missing category"
+    if allowed_ids is not None and item.get("category_id") not in allowed_ids:
+        return f"unknown category_id {item.get('category_id')!r}"
+    if str(item.get("confidence", "")).lower() not in VALID_CONFIDENCE:
+        return f"invalid confidence {item.get('confidence')!r}"
+    try:
+        int(item.get("business_percentage", 100))
+    except (TypeError, ValueError):
+        return f"invalid business_percentage {item.get('business_percentage')!r}"
+    return None
+
+
+def build_batch_prompts(agent, transactions, allowed_categories):
+    """
+    Return (system_prompt, user_prompt) for one batch of a single client's
+    transactions. The system prompt is the agent's Agent.prompt rendered
+    with call_agent's context (for the batch's first transaction, so only the
+    part before ---USER--- is used); the built-in instructions are the
+    fallback. The business profile and allowed categories are appended either
+    way, and the user prompt lists the batch in the batched response format.
+    """
+    business_profile = transactions[0].client
+    system_prompt = None
+    if agent.prompt:
+        context = {
+            "transaction": transactions[0],
+            "transactions": transactions,
+            "allowed_categories": allowed_categories,
+            "business_profile": business_profile,
+            "payee_reasoning": transactions[0].payee_reasoning,
+        }
+        try:
+            system_prompt, _ = render_agent_prompt(agent.id, agent.prompt, context)
+        except Exception as e:
+            logger.warning(
+                f"[PROMPT] Failed to render Agent.prompt for agent '{agent.name}': {e}. Falling back."
+            )
+    return get_batch_classification_prompts(
+        transactions, allowed_categories, business_profile, system_prompt
+    )
+
+
+def _request_batch(compiled, system_prompt, user_prompt):
+    client = get_openai_client()
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt},
+    ]
+    response = get_llm_rate_limiter(compiled).call(
+        lambda: telemetry.timed(
+            "llm_call",
+            lambda: client.with_options(max_retries=0).chat.completions.create(
+                model=compiled.model,
+                messages=messages,
+                response_format={"type": "json_object"},
+            ),
+        ),
+        estimated_tokens=estimate_tokens(messages),
+        usage_tokens=usage_total_tokens,
+    )
+    usage = getattr(response, "usage", None)
+    telemetry.record_usage(usage)
+    content = response.choices[0].message.content or "{}"
+    return json.loads(content), usage
+
+
+def _parse_batch_results(payload):
+    """Map str(transaction_id) -> result entry from a batch response."""
+    items = payload.get("results") if isinstance(payload, dict) else payload
+    results = {}
+    for item in items or []:
+        if isinstance(item, dict) and item.get("transaction_id") is not None:
+            results[str(item["transaction_id"])] = item
+    return results
+
+
+def _collected_tokens():
+    """Tokens recorded so far by the current telemetry collector, if any."""
+    collector = telemetry.current()
+    if collector is None:
+        return None
+    return sum(collector.raw()["tokens"].values())
+
+
+def run_classification_batches(agent, transactions, batch_size, metrics=None):
+    """
+    Classify transactions ``batch_size`` at a time and yield an AgentResult per
+    transaction, like agent_runner.run_agent_concurrently. ``metrics`` (a dict)
+    is updated with batch counts, fallbacks and token usage; the single calls
+    of fallback rows are counted from the task's telemetry collector.
+    """
+    metrics = metrics if metrics is not None else {}
+    metrics.setdefault("batch_size", batch_size)
+    for key in (
+        "batches",
+        "batched_transactions",
+        "fallback_transactions",
+        "prompt_tokens",
+        "completion_tokens",
+        "fallback_tokens",
+    ):
+        metrics.setdefault(key, 0)
+
+    transactions = list(transactions)
+    if not transactions:
+        return
+    compiled = get_compiled_agent(agent.name)
+    if not compiled.model:
+        raise ValueError(
+            f"Agent '{agent.name}' does not have an LLM model configured in the UI."
+        )
+
+    # A batch shares one business profile and category list, so it never
+    # mixes clients.
+    by_client = {}
+    for transaction in transactions:
+        by_client.setdefault(transaction.client_id, []).append(transaction)
+    chunks = [
+        rows[i : i + batch_size]
+        for rows in by_client.values()
+        for i in range(0, len(rows), batch_size)
+    ]
+    # Prompts are built up front on this thread: worker threads only talk to the LLM.
+    with telemetry.stage("prompt_build"):
+        allowed_categories = {
+            client_id: build_allowed_categories(rows[0])
+            for client_id, rows in by_client.items()
+        }
+        prompts = [
+            build_batch_prompts(compiled, chunk, allowed_categories[chunk[0].client_id])
+            for chunk in chunks
+        ]
+        allowed_ids = {
+            client_id: allowed_category_ids(text)
+            for client_id, text in allowed_categories.items()
+        }
+
+    def request(prompt):
+        try:
+            return _request_batch(compiled, *prompt), None
+        except Exception as e:
+            return (None, None), e
+
+    fallback = []
+    workers = min(get_agent_concurrency(agent.name), len(chunks))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk, ((payload, usage), error) in zip(
+            chunks, executor.map(telemetry.propagate(request), prompts)
+        ):
+            metrics["batches"] += 1
+            if usage is not None:
+                metrics["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+                metrics["completion_tokens"] += (
+                    getattr(usage, "completion_tokens", 0) or 0
+                )
+            if error is not None:
+                logger.warning(
+                    f"Batch of {len(chunk)} transactions failed, falling back: {error}"
+                )
+                fallback.extend(chunk)
+                continue
+            items = _parse_batch_results(payload)
+            for transaction in chunk:
+                item = items.get(str(transaction.id))
+                problem = (
+                    "missing from batch response"
+                    if item is None
+                    else validate_batch_item(item, allowed_ids[transaction.client_id])
+                )
+                if problem:
+                    logger.info(
+                        f"Transaction {transaction.id} falls back to a single call: {problem}"
+                    )
+                    fallback.append(transaction)
+                    continue
+                item = dict(item)
+                item.pop("transaction_id", None)
+                metrics["batched_transactions"] += 1
+                yield AgentResult(
+                    transaction,
+                    get_update_fields_from_response(agent, item, "classification"),
+                    None,
+                )
+
+    metrics["fallback_transactions"] += len(fallback)
+    tokens_before = _collected_tokens()
+    yield from run_agent_concurrently(
+        agent, fallback, agent_type="classification", use_rules=False
+    )
+    if tokens_before is not None:
+        metrics["fallback_tokens"] += _collected_tokens() - tokens_before
+    # Per submitted row, including failed batches and the fallback calls
+    total_tokens = (
+        metrics["prompt_tokens"]
+        + metrics["completion_tokens"]
+        + metrics["fallback_tokens"]
+    )
+    metrics["tokens_per_transaction"] = round(total_tokens / len(transactions), 1)
@@ -0,0 +1,293 @@
+"""
+Bulk insertion of parsed statement rows.
+
+Creating transactions one by one costs an INSERT (and a SHA-256 in
+Transaction.save) per row. ``ingest_transactions`` instead computes every
+row's transaction_hash up front, looks up which hashes the database already
+has in one query per INGEST_BATCH_SIZE rows, and writes the rest with
+``bulk_create(ignore_conflicts=True)``, so a statement imports in a couple
+of round-trips. Rows are hashed exactly as Transaction.save would hash them,
+so duplicates are detected against rows created either way.
+
+``save_parsed_statement`` writes everything one parsed upload produces
+(StatementFile, transactions, ParsingRun). Uploads are stored through
+HashingFile, which computes the statement hash from the same chunks that
+are written, so a file is normally not read again just to hash it.
+"""
+
+import hashlib
+import logging
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.files import File
+from django.db import models
+
+from .models import ParsingRun, StatementFile, Transaction
+
+logger = logging.getLogger(__name__)
+
+# Fields whose values the database would reject unless they convert cleanly
+_CONVERTED_FIELDS = (
+    models.DateField,
+    models.DecimalField,
+    models.IntegerField,
+    models.BooleanField,
+)
+
+
+@dataclass
+class IngestReport:
+    created: int = 0
+    # [{"index", "transaction_hash", "reason"}]; reason is "existing" (already
+    # in the database) or "repeated" (same row earlier in this upload)
+    duplicates: list = field(default_factory=list)
+    errors: list = field(default_factory=list)  # [{"index", "error"}]
+
+
+class HashingFile(File):
+    """
+    Wraps an upload so that storing it (Storage.save reads ``chunks()``)
+    also computes its SHA256, available afterwards from ``hexdigest()``.
+
+    Backends that read the file object directly (e.g. S3's upload_fileobj)
+    bypass ``chunks()``; when the digest did not cover ``size`` bytes,
+    ``hexdigest()`` rehashes the file in an explicit read pass.
+    """
+
+    def __init__(self, file, name=None):
+        super().__init__(file, name or file.name)
+        self.digest = hashlib.sha256()
+        self.hashed_bytes = 0
+
+    def chunks(self, chunk_size=None):
+        self.digest = hashlib.sha256()
+        self.hashed_bytes = 0
+        for chunk in super().chunks(chunk_size):
+            self.digest.update(chunk)
+            self.hashed_bytes += len(chunk)
+            yield chunk
+
+    def hexdigest(self):
+        if self.hashed_bytes != self.size:
+            logger.debug(
+                f"{self.name}: storage did not read through chunks() "
+                f"({self.hashed_bytes} of {self.size} bytes hashed); rehashing"
+            )
+            # Drain chunks() so the digest covers the whole file
+            for _ in self.chunks():
+                pass
+            self.seek(0)
+        return self.digest.hexdigest()
+
+
+def get_ingest_batch_size():
+    return getattr(settings, "INGEST_BATCH_SIZE", 1000)
+
+
+def transaction_hash_for(client, row):
+    return Transaction.compute_transaction_hash(
+        client.pk,
+        row.get("transaction_date"),
+        row.get("amount"),
+        row.get("description"),
+        row.get("category"),
+    )
+
+
+def prepare_row(row):
+    """
+    Return ``row`` with values converted to what the fields store, raising
+    ValidationError for a value the insert would fail on (one bad row must
+    not abort the whole bulk insert).
+    """
+    prepared = {}
+    for name, value in row.items():
+        model_field = Transaction._meta.get_field(name)
+        if value is None:
+            if not model_field.null:
+                raise ValidationError(f"{name} is required")
+        elif isinstance(model_field, _CONVERTED_FIELDS):
+            try:
+                value = model_field.to_python(value)
+            except ValidationError as e:
+                raise ValidationError(f"{name}: {'; '.join(e.messages)}")
+        elif model_field.max_length and len(str(value)) > model_field.max_length:
+            raise ValidationError(
+                f"{name} is longer than {model_field.max_length} characters"
+            )
+        prepared[name] = value
+    return prepared
+
+
+def ingest_transactions(client, rows, batch_size=None):
+    """
+    Insert ``rows`` (dicts of Transaction field values, without client) for
+    ``client``. Returns an IngestReport with per-row duplicates and errors,
+    indexed by position in ``rows``. A row inserted by someone else between
+    the duplicate lookup and the insert is skipped by the database rather
+    than reported.
+    """
+    batch_size = batch_size or get_ingest_batch_size()
+    report = IngestReport()
+    seen = set()
+    for start in range(0, len(rows), batch_size):
+        candidates = []
+        for index, row in enumerate(rows[start : start + batch_size], start):
+            transaction_hash = transaction_hash_for(client, row)
+            if transaction_hash in seen:
+                report.duplicates.append(
+                    {
+                        "index": index,
+                        "transaction_hash": transaction_hash,
+                        "reason": "repeated",
+                    }
+                )
+                continue
+            seen.add(transaction_hash)
+            try:
+                candidates.append((index, transaction_hash, prepare_row(row)))
+            except ValidationError as e:
+                report.errors.append({"index": index, "error": "; ".join(e.messages)})
+            except FieldDoesNotExist as e:
+                report.errors.append({"index": index, "error": str(e)})
+
+        existing = set(
+            Transaction.objects.filter(
+                transaction_hash__in=[h for _, h, _ in candidates]
+            ).values_list("transaction_hash", flat=True)
+        )
+        objs = []
+        for index, transaction_hash, values in candidates:
+            if transaction_hash in existing:
+                report.duplicates.append(
+                    {
+                        "index": index,
+                        "transaction_hash": transaction_hash,
+                        "reason": "existing",
+                    }
+                )
+                continue
+            objs.append(
+                Transaction(client=client, transaction_hash=transaction_hash, **values)
+            )
+        Transaction.objects.bulk_create(
+            objs, batch_size=batch_size, ignore_conflicts=True
+        )
+        report.created += len(objs)
+    logger.info(
+        f"Ingested {report.created} transactions for {client.client_id} "
+        f"({len(report.duplicates)} duplicates, {len(report.errors)} errors)"
+    )
+    return report
+
+
+def save_parsed_statement(
+    f,
+    parse_result,
+    client,
+    file_type,
+    account_number,
+    auto_parse,
+    uploaded_by,
+    statement_hash=None,
+):
+    """
+    Write one parsed upload's StatementFile, transactions and ParsingRun.
+    ``f`` is the uploaded file and ``parse_result`` its
+    statement_parsing.ParseResult; a known ``statement_hash`` saves
+    StatementFile from reading the file again. Returns the batch uploader's
+    result dict.
+    """
+    result = {"file": f.name}
+    if parse_result.detected:
+        result["parser"] = parse_result.parser
+    if parse_result.error:
+        result["error"] = parse_result.error
+        return result
+    used_parser = parse_result.parser
+    parser_output = parse_result.output
+    try:
+        # Extract metadata and transactions
+        metadata = parser_output.metadata.dict() if parser_output.metadata else {}
+        transactions = (
+            [t.dict() for t in parser_output.transactions]
+            if parser_output.transactions
+            else []
+        )
+        result["normalized"] = True
+        result["metadata"] = metadata
+        result["transaction_count"] = len(transactions)
+        if parser_output.errors:
+            result["errors"] = parser_output.errors
+        if parser_output.warnings:
+            result["warnings"] = parser_output.warnings
+        # Create StatementFile
+        try:
+            statement_file = StatementFile.objects.create(
+                client=client,
+                file=f,
+                file_type=file_type,
+                account_number=metadata.get("account_number", account_number),
+                original_filename=f.name,
+                uploaded_by=uploaded_by,
+                status="uploaded",
+                bank=metadata.get("bank_name"),
+                year=metadata.get("year"),
+                month=metadata.get("month"),
+                parser_module=used_parser,
+                account_holder_name=metadata.get("account_holder_name"),
+                address=metadata.get("address"),
+                account_type=metadata.get("account_type"),
+                statement_period_start=metadata.get("statement_period_start"),
+                statement_period_end=metadata.get("statement_period_end"),
+                statement_date=metadata.get("statement_date"),
+                parsed_metadata=metadata,
+                statement_hash=statement_hash or None,
+            )
+            result["statement_file"] = statement_file.id
+        except Exception as e:
+            result["error"] = f"StatementFile creation failed: {e}"
+            return result
+        # Create transactions immediately after parsing
+        report = ingest_transactions(
+            client,
+            [
+                {
+                    "statement_file": statement_file,
+                    "transaction_date": tx.get("transaction_date"),
+                    "amount": tx.get("amount"),
+                    "description": tx.get("description"),
+                    "category": tx.get("category", ""),
+                    "file_path": statement_file.file.name,
+                    "source": tx.get("source", "batch_upload"),
+                    "transaction_type": tx.get("transaction_type", ""),
+                    "normalized_amount": tx.get("normalized_amount"),
+                    "parser_name": used_parser,
+                    "classification_method": tx.get("classification_method", "None"),
+                    "payee_extraction_method": tx.get(
+                        "payee_extraction_method", "None"
+                    ),
+                }
+                for tx in transactions
+            ],
+        )
+        result["transactions_created"] = report.created
+        result["transaction_errors"] = report.errors
+        result["duplicate_transactions"] = report.duplicates
+        # Optionally create ParsingRun (for audit, not for deferred processing)
+        if auto_parse and used_parser:
+            try:
+                ParsingRun.objects.create(
+                    statement_file=statement_file,
+                    parser_module=used_parser,
+                    status="completed",
+                )
+                result["parsing_run"] = "created"
+            except Exception as e:
+                result["parsing_run_error"] = str(e)
+        result["success"] = True
+    except Exception as e:
+        result["error"] = str(e)
+    return result
@@ -0,0 +1,312 @@
+"""
+Background processing of batch statement uploads (IngestionJobs).
+
+The upload view only stores the files and creates the job, so request time
+no longer grows with the batch. Workers claim jobs with the same
+compare-and-set and heartbeat scheme as ProcessingTasks (profiles.task_queue):
+``run_workers`` workers take pending jobs before tasks. With TASK_BACKEND =
+"celery" each job is also sent to Celery (profiles.tasks); with
+"subprocess" a ``process_ingestion_job`` process is started for it, so an
+upload is processed even where no ``run_workers`` service is deployed.
+A job's files are parsed in parallel (profiles.statement_parsing) and written
+one at a time; each IngestionJobFile's status and result are saved as soon
+as it is done, so the admin can show the batch's progress.
+
+Files are hashed while they are stored, and files the client already has
+are marked as duplicates before any parsing (skip_known_files), so
+re-uploading a folder of known statements costs one query.
+"""
+
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .ingestion import HashingFile, save_parsed_statement
+from .models import IngestionJob, IngestionJobFile, StatementFile
+from .statement_parsing import parse_statement_files
+from .task_queue import Heartbeat, get_heartbeat_timeout
+
+logger = logging.getLogger(__name__)
+
+
+def create_ingestion_job(
+    client,
+    files,
+    file_type,
+    parser_module="",
+    account_number=None,
+    auto_parse=False,
+    uploaded_by=None,
+):
+    """Store uploaded ``files`` as a pending IngestionJob and queue it."""
+    with db_transaction.atomic():
+        job = IngestionJob.objects.create(
+            client=client,
+            uploaded_by=uploaded_by,
+            file_type=file_type,
+            parser_module=parser_module or "",
+            account_number=account_number,
+            auto_parse=auto_parse,
+            file_count=len(files),
+        )
+        job_files = []
+        for index, f in enumerate(files):
+            job_file = IngestionJobFile(job=job, index=index, original_filename=f.name)
+            # Hashed while it is written to storage: the upload is read once
+            upload = HashingFile(f)
+            job_file.file.save(f.name, upload, save=False)
+            job_file.statement_hash = upload.hexdigest()
+            job_file.save()
+            job_files.append(job_file)
+        if not skip_known_files(job, job_files):
+            # Nothing new: no worker needed
+            IngestionJob.objects.filter(job_id=job.job_id).update(status="completed")
+            job.refresh_from_db()
+        elif settings.TASK_BACKEND == "celery":
+            from .tasks import enqueue_ingestion_job
+
+            db_transaction.on_commit(lambda: enqueue_ingestion_job(job))
+        elif getattr(settings, "INGESTION_START_WORKER", True):
+            db_transaction.on_commit(lambda: start_ingestion_worker(job))
+    logger.info(f"Queued ingestion job {job.job_id} with {len(files)} files")
+    return job
+
+
+def start_ingestion_worker(job):
+    """Run ``job`` in a detached ``manage.py process_ingestion_job`` process."""
+    cmd = [
+        sys.executable,
+        os.path.join(settings.BASE_DIR, "manage.py"),
+        "process_ingestion_job",
+        str(job.job_id),
+    ]
+    process = subprocess.Popen(
+        cmd,
+        cwd=str(settings.BASE_DIR),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,
+    )
+    logger.info(f"Started ingestion job {job.job_id} with PID {process.pid}")
+    return process
+
+
+def skip_known_files(job, job_files):
+    """
+    Mark files the client already has (same statement_hash), or that repeat
+    an earlier file of the batch, as duplicates before anything parses them;
+    one query for the whole batch. Returns the files left to parse.
+    """
+    known = dict(
+        StatementFile.objects.filter(
+            client_id=job.client_id,
+            statement_hash__in={
+                f.statement_hash for f in job_files if f.statement_hash
+            },
+        ).values_list("statement_hash", "id")
+    )
+    remaining, duplicates, seen = [], [], {}
+    for job_file in job_files:
+        statement_hash = job_file.statement_hash
+        if statement_hash in known:
+            job_file.statement_file_id = known[statement_hash]
+            message = "This statement file has already been uploaded for this client."
+        elif statement_hash in seen:
+            message = f"Same file as {seen[statement_hash]} in this upload."
+        else:
+            if statement_hash:
+                seen[statement_hash] = job_file.original_filename
+            remaining.append(job_file)
+            continue
+        job_file.status = "duplicate"
+        job_file.result = {"file": job_file.original_filename, "duplicate": message}
+        job_file.updated_at = timezone.now()
+        job_file.file.delete(save=False)
+        duplicates.append(job_file)
+    if duplicates:
+        IngestionJobFile.objects.bulk_update(
+            duplicates, ["status", "result", "statement_file", "file", "updated_at"]
+        )
+        IngestionJob.objects.filter(job_id=job.job_id).update(
+            processed_count=F("processed_count") + len(duplicates)
+        )
+        logger.info(
+            f"Ingestion job {job.job_id}: skipped {len(duplicates)} duplicate files"
+        )
+    return remaining
+
+
+def claim_job(job_id, worker_id):
+    """Atomically move a pending job to processing; None if already taken."""
+    now = timezone.now()
+    claimed = IngestionJob.objects.filter(job_id=job_id, status="pending").update(
+        status="processing",
+        worker_id=worker_id,
+        started_at=now,
+        heartbeat_at=now,
+        attempts=F("attempts") + 1,
+    )
+    if not claimed:
+        return None
+    return IngestionJob.objects.get(job_id=job_id)
+
+
+def claim_next_job(worker_id):
+    """Claim the oldest pending job, or return None."""
+    pending = IngestionJob.objects.filter(status="pending").order_by("created_at")
+    for job_id in pending.values_list("job_id", flat=True)[:20]:
+        job = claim_job(job_id, worker_id)
+        if job is not None:
+            return job
+    return None
+
+
+def reclaim_stale_jobs(timeout=None):
+    """Requeue (or fail, after TASK_MAX_ATTEMPTS) jobs whose worker died."""
+    timeout = timeout or get_heartbeat_timeout()
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    stale = IngestionJob.objects.filter(
+        status="processing", worker_id__isnull=False, heartbeat_at__lt=cutoff
+    )
+    max_attempts = getattr(settings, "TASK_MAX_ATTEMPTS", 3)
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status="failed", worker_id=None, error="Worker stopped responding"
+    )
+    reclaimed = stale.filter(attempts__lt=max_attempts).update(
+        status="pending", worker_id=None, heartbeat_at=None
+    )
+    if failed or reclaimed:
+        logger.warning(f"Reclaimed {reclaimed} stale ingestion jobs; failed {failed}")
+    return reclaimed
+
+
+def stage_locally(job_file):
+    """
+    Local path of a staged upload for the parsers, and whether it is a
+    temporary copy (storages without local paths).
+    """
+    try:
+        return job_file.file.path, False
+    except NotImplementedError:
+        pass
+    suffix = os.path.splitext(job_file.original_filename)[1]
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        with job_file.file.open("rb") as staged:
+            for chunk in staged.chunks():
+                temp_file.write(chunk)
+    return temp_file.name, True
+
+
+def save_job_file(job, job_file, parse_result):
+    """Write one parsed file and record its outcome on the IngestionJobFile."""
+    with job_file.file.open("rb") as staged:
+        result = save_parsed_statement(
+            File(staged, name=job_file.original_filename),
+            parse_result,
+            client=job.client,
+            file_type=job.file_type,
+            account_number=job.account_number,
+            auto_parse=job.auto_parse,
+            uploaded_by=job.uploaded_by,
+            statement_hash=job_file.statement_hash,
+        )
+    job_file.result = result
+    job_file.error = result.get("error", "")
+    job_file.status = "failed" if job_file.error else "completed"
+    job_file.statement_file_id = result.get("statement_file")
+    if job_file.status == "completed":
+        # The StatementFile has its own copy now
+        job_file.file.delete(save=False)
+    job_file.save()
+    IngestionJob.objects.filter(job_id=job.job_id).update(
+        processed_count=F("processed_count") + 1
+    )
+
+
+def run_ingestion_job(job, worker_id, log=logger):
+    """Parse and write every unfinished file of a job claimed by ``worker_id``."""
+    log.info(f"[{worker_id}] Ingesting job {job.job_id} ({job.file_count} files)")
+    # "parsing" files were interrupted by a dead worker. Files imported since
+    # the upload (e.g. by another job) are skipped before parsing.
+    files = skip_known_files(
+        job, list(job.files.filter(status__in=("pending", "parsing")))
+    )
+    temp_paths = []
+    heartbeat = Heartbeat(
+        IngestionJob.objects.filter(job_id=job.job_id, worker_id=worker_id)
+    )
+    with heartbeat:
+        try:
+            paths = []
+            for job_file in files:
+                path, is_temp = stage_locally(job_file)
+                paths.append(path)
+                if is_temp:
+                    temp_paths.append(path)
+            IngestionJobFile.objects.filter(id__in=[f.id for f in files]).update(
+                status="parsing"
+            )
+            parsed = parse_statement_files(paths, job.parser_module)
+            for job_file, parse_result in zip(files, parsed):
+                save_job_file(job, job_file, parse_result)
+            IngestionJob.objects.filter(job_id=job.job_id).update(
+                status="completed", worker_id=None
+            )
+            log.info(f"[{worker_id}] Ingestion job {job.job_id} completed")
+        except Exception as e:
+            log.error(f"[{worker_id}] Ingestion job {job.job_id} failed: {e}")
+            job.files.filter(status="parsing").update(status="failed", error=str(e))
+            IngestionJob.objects.filter(job_id=job.job_id).update(
+                status="failed", error=str(e)
+            )
+        finally:
+            for path in temp_paths:
+                if os.path.exists(path):
+                    os.unlink(path)
+
+
+def run_next_ingestion_job(worker_id, log=logger):
+    """Claim and run the oldest pending job. Returns False if there was none."""
+    job = claim_next_job(worker_id)
+    if job is None:
+        return False
+    run_ingestion_job(job, worker_id, log=log)
+    return True
+
+
+def job_progress(job_id):
+    """Status of a job and its files, for the admin to poll."""
+    job = (
+        IngestionJob.objects.filter(job_id=job_id)
+        .values("status", "file_count", "processed_count", "error")
+        .first()
+    )
+    if job is None:
+        return None
+    files = [
+        {
+            "index": index,
+            "status": status,
+            "error": error,
+            "transactions_created": result.get("transactions_created"),
+            "duplicates": len(result.get("duplicate_transactions", [])),
+        }
+        for index, status, error, result in IngestionJobFile.objects.filter(
+            job_id=job_id
+        ).values_list("index", "status", "error", "result")
+    ]
+    return {
+        **job,
+        "job_id": str(job_id),
+        "active": job["status"] in ("pending", "processing"),
+        "files": files,
+    }
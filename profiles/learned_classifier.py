@@ -0,0 +1,378 @@
+"""
+Per-client classifier learned from human-reviewed labels.
+
+Labels come from transactions a bookkeeper classified in the admin
+(classification_method "Human"), active TransactionClassification rows not
+written by an agent, and active ClassificationOverrides (highest precedence).
+Each labelled transaction becomes a bag of terms: canonical description
+words, payee words (``p:`` prefix) and an amount bucket (``amt:`` prefix).
+
+The model is a TF-IDF nearest-centroid classifier kept as raw counts (document
+frequencies and per-class term sums) in ClassifierModel.state, so retraining
+is incremental: only new or relabelled transactions are added or subtracted.
+Prediction is a cosine similarity against each class centroid over the few
+terms of one transaction, i.e. microseconds per row in pure Python.
+
+Predictions above LEARNED_CLASSIFIER_MIN_SIMILARITY (and clear of the runner-up
+by LEARNED_CLASSIFIER_MIN_MARGIN) are applied with classification_method "ML";
+everything else is escalated to the Classification Agent.
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import (
+    Agent,
+    ClassificationOverride,
+    ClassifierModel,
+    Transaction,
+    TransactionClassification,
+)
+from .normalization import amount_bucket, canonicalize_description
+from .rule_engine import split_by_rules
+
+logger = logging.getLogger(__name__)
+
+ML_METHOD = "ML"
+STATE_VERSION = 1
+
+
+def label_key(classification_type, worksheet, category):
+    return f"{classification_type}|{worksheet}|{category or ''}"
+
+
+def extract_terms(description, payee, amount):
+    """Return the term counts used as features for one transaction."""
+    terms = Counter(
+        word for word in canonicalize_description(description).split() if len(word) > 1
+    )
+    if payee:
+        terms.update(
+            f"p:{word}"
+            for word in canonicalize_description(payee).split()
+            if len(word) > 1
+        )
+    terms[f"amt:{amount_bucket(amount)}"] += 1
+    return terms
+
+
+def collect_labels(client):
+    """
+    Map transaction id -> (classification_type, worksheet, category) for every
+    human-reviewed transaction of ``client``.
+    """
+    labels = {}
+    agent_names = list(Agent.objects.values_list("name", flat=True))
+    for row in (
+        TransactionClassification.objects.filter(
+            transaction__client=client, is_active=True
+        )
+        .exclude(created_by__in=agent_names)
+        .values("transaction_id", "classification_type", "worksheet", "category")
+    ):
+        labels[row["transaction_id"]] = (
+            row["classification_type"],
+            row["worksheet"],
+            row["category"],
+        )
+    for row in Transaction.objects.filter(
+        client=client, classification_method="Human"
+    ).values("id", "classification_type", "worksheet", "category"):
+        labels[row["id"]] = (
+            row["classification_type"],
+            row["worksheet"],
+            row["category"],
+        )
+    for row in (
+        ClassificationOverride.objects.filter(
+            transaction__client=client, is_active=True
+        )
+        .order_by("created_at")
+        .values(
+            "transaction_id",
+            "new_classification_type",
+            "new_worksheet",
+            "transaction__classification_type",
+            "transaction__worksheet",
+            "transaction__category",
+        )
+    ):
+        labels[row["transaction_id"]] = (
+            row["new_classification_type"] or row["transaction__classification_type"],
+            row["new_worksheet"] or row["transaction__worksheet"],
+            row["transaction__category"],
+        )
+    return {
+        transaction_id: label
+        for transaction_id, label in labels.items()
+        if label[0] and label[1]
+    }
+
+
+def iter_examples(client, labels):
+    """Yield (transaction_id, label, terms) for the labelled transactions."""
+    for row in (
+        Transaction.objects.filter(client=client)
+        .values("id", "description", "payee", "amount")
+        .iterator(chunk_size=2000)
+    ):
+        label = labels.get(row["id"])
+        if label is not None:
+            yield row["id"], label, extract_terms(
+                row["description"], row["payee"], row["amount"]
+            )
+
+
+def empty_state():
+    return {
+        "version": STATE_VERSION,
+        "doc_count": 0,
+        "df": {},
+        "classes": {},
+        "examples": {},
+    }
+
+
+def _apply_example(state, key, label, terms, sign):
+    """Add (sign=1) or remove (sign=-1) one example's counts."""
+    classes = state["classes"]
+    entry = classes.setdefault(
+        key,
+        {
+            "classification_type": label[0],
+            "worksheet": label[1],
+            "category": label[2],
+            "count": 0,
+            "terms": {},
+        },
+    )
+    entry["count"] += sign
+    state["doc_count"] += sign
+    for term, count in terms.items():
+        entry["terms"][term] = entry["terms"].get(term, 0) + sign * count
+        if entry["terms"][term] <= 0:
+            del entry["terms"][term]
+        state["df"][term] = state["df"].get(term, 0) + sign
+        if state["df"][term] <= 0:
+            del state["df"][term]
+    if entry["count"] <= 0:
+        del classes[key]
+
+
+def update_state(state, examples):
+    """
+    Bring ``state`` in line with ``examples`` [(transaction_id, label, terms)].
+    Only new and relabelled transactions are touched (a relabelled row's terms
+    are assumed unchanged; retrain with full=True after bulk text edits). If a
+    previously seen label was withdrawn the state is rebuilt, since its terms
+    are no longer known. Returns (added, removed).
+    """
+    examples = {
+        str(transaction_id): (label, terms) for transaction_id, label, terms in examples
+    }
+    seen = state["examples"]
+    withdrawn = [tid for tid in seen if tid not in examples]
+    if withdrawn:
+        # Label withdrawn (override deactivated, transaction deleted, ...)
+        state.clear()
+        state.update(empty_state())
+        seen = state["examples"]
+    added = 0
+    removed = len(withdrawn)
+    for tid, (label, terms) in examples.items():
+        key = label_key(*label)
+        if seen.get(tid) == key:
+            continue
+        if tid in seen:
+            old_key = seen[tid]
+            _apply_example(state, old_key, tuple(old_key.split("|", 2)), terms, -1)
+            removed += 1
+        _apply_example(state, key, label, terms, 1)
+        seen[tid] = key
+        added += 1
+    return added, removed
+
+
+class CompiledClassifier:
+    """Precomputed idf weights and centroid norms for fast prediction."""
+
+    def __init__(self, state):
+        doc_count = state.get("doc_count", 0)
+        self.idf = {
+            term: math.log((1 + doc_count) / (1 + df)) + 1.0
+            for term, df in state.get("df", {}).items()
+        }
+        self.classes = []
+        for key, entry in state.get("classes", {}).items():
+            count = entry["count"]
+            weights = {
+                term: value / count * self.idf.get(term, 1.0)
+                for term, value in entry["terms"].items()
+            }
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            self.classes.append((key, entry, weights, norm))
+
+    def predict(self, terms):
+        """Return (entry, similarity, margin) for the best class, or None."""
+        query = {
+            term: count * self.idf[term]
+            for term, count in terms.items()
+            if term in self.idf
+        }
+        if not query or not self.classes:
+            return None
+        query_norm = math.sqrt(sum(w * w for w in query.values()))
+        scored = []
+        for key, entry, weights, norm in self.classes:
+            dot = sum(w * weights.get(term, 0.0) for term, w in query.items())
+            scored.append((dot / (query_norm * norm), entry))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        best, entry = scored[0]
+        runner_up = scored[1][0] if len(scored) > 1 else 0.0
+        return entry, best, best - runner_up
+
+
+def is_confident(entry, similarity, margin):
+    return (
+        similarity >= getattr(settings, "LEARNED_CLASSIFIER_MIN_SIMILARITY", 0.6)
+        and margin >= getattr(settings, "LEARNED_CLASSIFIER_MIN_MARGIN", 0.1)
+        and entry["count"] >= getattr(settings, "LEARNED_CLASSIFIER_MIN_SUPPORT", 3)
+    )
+
+
+def evaluate(examples, holdout_every=5):
+    """
+    Hold out every ``holdout_every``-th labelled transaction, train on the
+    rest and report precision of the confident predictions per worksheet.
+    """
+    train, test = [], []
+    for example in examples:
+        (test if example[0] % holdout_every == 0 else train).append(example)
+    state = empty_state()
+    update_state(state, train)
+    classifier = CompiledClassifier(state)
+    per_worksheet = defaultdict(lambda: {"predicted": 0, "correct": 0})
+    applied = 0
+    for _, label, terms in test:
+        prediction = classifier.predict(terms)
+        if prediction is None or not is_confident(*prediction):
+            continue
+        entry = prediction[0]
+        applied += 1
+        stats = per_worksheet[entry["worksheet"]]
+        stats["predicted"] += 1
+        if label_key(*label) == label_key(
+            entry["classification_type"], entry["worksheet"], entry["category"]
+        ):
+            stats["correct"] += 1
+    for stats in per_worksheet.values():
+        stats["precision"] = round(stats["correct"] / stats["predicted"], 3)
+    return {
+        "train_examples": len(train),
+        "test_examples": len(test),
+        "applied": applied,
+        "coverage": round(applied / len(test), 3) if test else 0.0,
+        "worksheets": dict(per_worksheet),
+    }
+
+
+def train_client(client, full=False):
+    """Incrementally (or with ``full``, from scratch) retrain ``client``'s model."""
+    model, _ = ClassifierModel.objects.get_or_create(client=client)
+    state = model.state
+    if full or state.get("version") != STATE_VERSION:
+        state = empty_state()
+    added, removed = update_state(state, iter_examples(client, collect_labels(client)))
+    model.state = state
+    model.example_count = state["doc_count"]
+    model.class_count = len(state["classes"])
+    model.save()
+    return model, added, removed
+
+
+_lock = threading.Lock()
+_classifiers = {}
+
+
+def get_client_classifier(client_id):
+    """Return the cached CompiledClassifier for a client, or None if untrained."""
+    now = time.monotonic()
+    cached = _classifiers.get(client_id)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    with _lock:
+        model = ClassifierModel.objects.filter(client_id=client_id).first()
+        classifier = CompiledClassifier(model.state) if model else None
+        ttl = getattr(settings, "LEARNED_CLASSIFIER_CACHE_TTL", 300)
+        _classifiers[client_id] = (now + ttl, classifier)
+        return classifier
+
+
+def is_enabled():
+    return getattr(settings, "LEARNED_CLASSIFIER_ENABLED", True)
+
+
+def split_by_classifier(transactions):
+    """
+    Split transactions into (matched, unmatched) like rule_engine.split_by_rules;
+    ``matched`` holds the confident predictions as (transaction, update_fields, "ML").
+    """
+    if not is_enabled():
+        return [], list(transactions)
+    matched, unmatched = [], []
+    for transaction in transactions:
+        classifier = get_client_classifier(transaction.client_id)
+        prediction = None
+        if classifier is not None:
+            prediction = classifier.predict(
+                extract_terms(
+                    transaction.description, transaction.payee, transaction.amount
+                )
+            )
+        if prediction is None or not is_confident(*prediction):
+            unmatched.append(transaction)
+            continue
+        entry, similarity, margin = prediction
+        update_fields = {
+            "classification_type": entry["classification_type"],
+            "worksheet": entry["worksheet"],
+            "category": entry["category"],
+            "business_percentage": (
+                100 if entry["classification_type"] == "business" else 0
+            ),
+            "confidence": "high",
+            "reasoning": (
+                f"Learned from {entry['count']} reviewed transactions "
+                f"(similarity {similarity:.2f}, margin {margin:.2f})"
+            ),
+            "classification_method": ML_METHOD,
+        }
+        matched.append((transaction, update_fields, ML_METHOD))
+    return matched, unmatched
+
+
+def classify_locally(transactions):
+    """
+    Run the local stages ahead of the LLM: deterministic rules, then the
+    learned classifier. Returns (matched, unmatched) as split_by_rules does.
+    """
+    matched, unmatched = split_by_rules(transactions)
+    predicted, unmatched = split_by_classifier(unmatched)
+    if predicted:
+        logger.info(
+            f"[ML] Applied {len(predicted)} learned predictions; {len(unmatched)} escalated"
+        )
+    return matched + predicted, unmatched
+
+
+@receiver(post_save, sender=ClassifierModel)
+@receiver(post_delete, sender=ClassifierModel)
+def _invalidate_classifier(sender, instance, **kwargs):
+    _classifiers.pop(instance.client_id, None)
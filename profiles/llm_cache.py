@@ -0,0 +1,226 @@
+"""
+Content-addressed cache for agent responses.
+
+Bank statements repeat the same merchant strings constantly, so call_agent
+looks up a response keyed on the agent, its prompt template, the model and
+the transaction's canonical description / amount bucket / client before
+rendering any prompt. Hits skip the LLM and tool calls entirely, so a hit
+carries no ``_tool_usage`` and is marked with ``_cache_hit`` instead; the
+transaction's method field then reads "AI (Cached)".
+
+Entries live in the Django cache (Redis in production, see settings.CACHES)
+with a TTL, fronted by a small in-process LRU so hot vendors don't even pay a
+Redis round-trip. Hit/miss counters are counted in process and added to the
+shared cache in batches (see _StatsBuffer), so a lookup costs no extra
+round-trips for them.
+"""
+
+import atexit
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .normalization import amount_bucket, canonicalize_description
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "llm_response"
+STATS_HITS_KEY = f"{KEY_PREFIX}:stats:hits"
+STATS_MISSES_KEY = f"{KEY_PREFIX}:stats:misses"
+# Set on responses returned by lookup()
+HIT_MARKER = "_cache_hit"
+# Per-call bookkeeping (e.g. call_agent's _tool_usage) that must not be replayed
+PRIVATE_PREFIX = "_"
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def is_enabled():
+    return _setting("LLM_RESPONSE_CACHE_ENABLED", True)
+
+
+def _backend():
+    return caches[_setting("LLM_RESPONSE_CACHE_ALIAS", "default")]
+
+
+class _LocalLRU:
+    """Thread-safe bounded LRU used in front of the shared cache."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local = _LocalLRU(_setting("LLM_RESPONSE_CACHE_LOCAL_MAX_ENTRIES", 2048))
+
+
+def build_cache_key(agent, model, transaction):
+    """
+    Key a response on everything that can change it: agent id and prompt
+    template, model, tools, canonical description, amount bucket and client.
+    Classification agents also see the payee lookup result, so it is included.
+    ``agent`` is a profiles.agent_registry.CompiledAgent.
+    """
+    parts = {
+        "agent": agent.id,
+        "prompt": agent.prompt_hash,
+        "model": model,
+        "tools": sorted(agent.tool_functions),
+        "description": canonicalize_description(transaction.description),
+        "amount": amount_bucket(transaction.amount),
+        "client": getattr(transaction, "client_id", None),
+    }
+    if agent.is_classification:
+        parts["payee"] = (transaction.payee or "").strip().lower()
+    digest = hashlib.sha256(
+        json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+    return f"{KEY_PREFIX}:{digest}"
+
+
+class _StatsBuffer:
+    """
+    Hit/miss counts of this process, added to the shared counters every
+    LLM_RESPONSE_CACHE_STATS_FLUSH_COUNT lookups or
+    LLM_RESPONSE_CACHE_STATS_FLUSH_SECONDS seconds.
+    """
+
+    def __init__(self):
+        self._pending = {STATS_HITS_KEY: 0, STATS_MISSES_KEY: 0}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+
+    def count(self, key):
+        flush_count = _setting("LLM_RESPONSE_CACHE_STATS_FLUSH_COUNT", 100)
+        flush_seconds = _setting("LLM_RESPONSE_CACHE_STATS_FLUSH_SECONDS", 10.0)
+        with self._lock:
+            self._pending[key] += 1
+            due = (
+                sum(self._pending.values()) >= flush_count
+                or time.monotonic() - self._last_flush >= flush_seconds
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending = {key: n for key, n in self._pending.items() if n}
+            self._pending = {STATS_HITS_KEY: 0, STATS_MISSES_KEY: 0}
+            self._last_flush = time.monotonic()
+        for key, n in pending.items():
+            _incr(key, n)
+
+
+def _incr(key, delta):
+    backend = _backend()
+    try:
+        try:
+            backend.incr(key, delta)
+        except ValueError:
+            # First count of this key: create it, unless another process won
+            if not backend.add(key, delta, timeout=None):
+                backend.incr(key, delta)
+    except Exception as e:
+        logger.debug(f"[LLM CACHE] Could not update counter {key}: {e}")
+
+
+_stats = _StatsBuffer()
+
+
+def flush_stats():
+    """Add this process's pending hit/miss counts to the shared counters."""
+    _stats.flush()
+
+
+atexit.register(flush_stats)
+
+
+def lookup(key):
+    """
+    Return a copy of the cached response for key, marked with HIT_MARKER, or
+    None on a miss.
+    """
+    value = _local.get(key)
+    if value is None:
+        try:
+            value = _backend().get(key)
+        except Exception as e:
+            logger.warning(f"[LLM CACHE] Lookup failed, treating as miss: {e}")
+            value = None
+        if value is not None:
+            _local.set(key, value)
+    _stats.count(STATS_HITS_KEY if value is not None else STATS_MISSES_KEY)
+    if value is None:
+        return None
+    response = copy.deepcopy(value)
+    response[HIT_MARKER] = True
+    return response
+
+
+def store(key, response):
+    """
+    Store a successful (non-empty) agent response, without its private keys
+    (tool usage of the call that produced it).
+    """
+    if not response:
+        return
+    value = copy.deepcopy(
+        {k: v for k, v in response.items() if not k.startswith(PRIVATE_PREFIX)}
+    )
+    _local.set(key, value)
+    try:
+        _backend().set(
+            key, value, timeout=_setting("LLM_RESPONSE_CACHE_TTL", 60 * 60 * 24 * 30)
+        )
+    except Exception as e:
+        logger.warning(f"[LLM CACHE] Store failed: {e}")
+
+
+def get_stats():
+    """
+    Return hit/miss counters and hit rate across all processes (counts other
+    processes have not flushed yet are not included).
+    """
+    flush_stats()
+    backend = _backend()
+    hits = backend.get(STATS_HITS_KEY) or 0
+    misses = backend.get(STATS_MISSES_KEY) or 0
+    total = hits + misses
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / total, 4) if total else 0.0,
+    }
+
+
+def clear_local():
+    """Drop the in-process LRU (the shared cache expires by TTL)."""
+    _local.clear()
@@ -0,0 +1,98 @@
+import time
+from datetime import date
+from decimal import Decimal
+from types import SimpleNamespace
+
+import jinja2
+from django.core.management.base import BaseCommand
+
+from profiles.admin import build_allowed_categories
+from profiles.models import Agent, Transaction
+from profiles.prompt_utils import get_agent_template
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark per-transaction prompt build time: a fresh Jinja2 Environment "
+        "per call (old behaviour) versus the shared compiled template cache"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--agent",
+            type=str,
+            default="Classification Agent",
+            help="Name of the agent whose prompt is rendered",
+        )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=1000,
+            help="Number of renders per strategy",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            agent = Agent.objects.get(name=options["agent"])
+        except Agent.DoesNotExist:
+            self.stderr.write(self.style.ERROR(f'Agent "{options["agent"]}" not found'))
+            return
+        if not agent.prompt:
+            self.stderr.write(self.style.ERROR(f"Agent {agent.name} has no prompt"))
+            return
+        iterations = options["iterations"]
+
+        transaction = Transaction.objects.select_related("client").first()
+        if transaction is None:
+            # No data yet: render against a stand-in transaction
+            transaction = SimpleNamespace(
+                id=0,
+                description="POS PURCHASE TERMINAL 001 LOWE'S #1636 ALBUQUERQ NM",
+                amount=Decimal("-42.17"),
+                transaction_date=date.today(),
+                payee="Lowe's",
+                payee_reasoning="Home improvement retailer.",
+                client=None,
+            )
+            allowed_categories = ""
+        else:
+            allowed_categories = build_allowed_categories(transaction)
+        context = {
+            "transaction": transaction,
+            "allowed_categories": allowed_categories,
+            "business_profile": getattr(transaction, "client", None),
+            "payee_reasoning": getattr(transaction, "payee_reasoning", None),
+        }
+
+        def render_uncached():
+            env = jinja2.Environment(undefined=jinja2.StrictUndefined)
+            return env.from_string(agent.prompt).render(**context)
+
+        def render_cached():
+            return get_agent_template(agent.id, agent.prompt).render(**context)
+
+        try:
+            render_uncached()
+        except jinja2.TemplateError as e:
+            self.stderr.write(self.style.ERROR(f"Prompt does not render: {e}"))
+            return
+
+        results = {}
+        for label, render in (("uncached", render_uncached), ("cached", render_cached)):
+            render()  # warm-up (first cached render compiles the template)
+            start = time.perf_counter()
+            for _ in range(iterations):
+                render()
+            elapsed = time.perf_counter() - start
+            results[label] = elapsed / iterations * 1000
+            self.stdout.write(
+                f"{label:>9}: {results[label]:.3f} ms/transaction "
+                f"({iterations} renders in {elapsed:.2f}s)"
+            )
+
+        if results["cached"]:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Speedup: {results['uncached'] / results['cached']:.1f}x"
+                )
+            )
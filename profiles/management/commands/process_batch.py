@@ -1,18 +1,103 @@
-from django.core.management.base import BaseCommand
+from django.core.exceptions import FieldDoesNotExist
+from django.core.management.base import BaseCommand, CommandError
 from django.db.models import Q
 from profiles.models import Transaction, Agent
-from profiles.admin import call_agent
+from profiles.agent_runner import run_agent_concurrently
+from profiles.result_writer import ResultWriter
 import logging
 from datetime import datetime
 import json
 import os
-from django.conf import settings
 import time
-from django.db import transaction
-from profiles.utils import get_update_fields_from_response
 
 logger = logging.getLogger(__name__)
 
+# Only the most recent errors are kept in the status file
+MAX_STATUS_ERRORS = 200
+
+
+def parse_filter_value(value):
+    """Convert a filter value string to the Python value it stands for."""
+    lowered = value.lower()
+    if lowered in ("null", "none"):
+        return None
+    if lowered == "true":
+        return True
+    if lowered == "false":
+        return False
+    return value
+
+
+def build_filter_query(expressions):
+    """
+    Build a Q from filter expressions, ANDed together. Each expression is
+    ``field=value`` or ``field!=value`` where ``field`` may carry a lookup
+    (``amount__lt=0``, ``description__icontains=amazon``,
+    ``category__isnull=true``); ``__in`` takes a comma-separated list.
+    """
+    query = Q()
+    for expression in expressions or []:
+        negate = "!=" in expression
+        field, sep, value = expression.partition("!=" if negate else "=")
+        field = field.strip()
+        if not sep or not field:
+            raise CommandError(
+                f'Invalid filter "{expression}"; expected field=value or field!=value'
+            )
+        try:
+            Transaction._meta.get_field(field.split("__")[0])
+        except FieldDoesNotExist:
+            raise CommandError(f'Unknown Transaction field in filter "{expression}"')
+        value = value.strip()
+        if field.endswith("__in"):
+            value = [parse_filter_value(v.strip()) for v in value.split(",")]
+        else:
+            value = parse_filter_value(value)
+        condition = Q(**{field: value})
+        query &= ~condition if negate else condition
+    return query
+
+
+def iter_keyset_batches(queryset, batch_size, after_id=0):
+    """
+    Yield lists of up to ``batch_size`` rows ordered by id, fetching each
+    page with ``id > last id`` (keyset pagination) instead of OFFSET, so
+    pages stay cheap on big tables and rows whose fields change while the
+    run is going are neither skipped nor repeated.
+    """
+    last_id = after_id
+    while True:
+        page = queryset.filter(id__gt=last_id).order_by("id")[:batch_size]
+        batch = list(page.iterator(chunk_size=batch_size))
+        if not batch:
+            return
+        yield batch
+        last_id = batch[-1].id
+
+
+class StatusProgress:
+    """Progress sink (see task_runner.TaskProgress) that fills the status dict."""
+
+    def __init__(self, status):
+        self.status = status
+
+    def record(self, succeeded_ids, errors=None):
+        errors = errors or {}
+        self.status["successful"] += len(succeeded_ids)
+        self.status["failed"] += len(errors)
+        self.status["total_processed"] += len(succeeded_ids) + len(errors)
+        timestamp = datetime.now().isoformat()
+        for transaction_id, error in errors.items():
+            logger.error(f"Error processing transaction {transaction_id}: {error}")
+            self.status["errors"].append(
+                {
+                    "transaction_id": transaction_id,
+                    "error": str(error),
+                    "timestamp": timestamp,
+                }
+            )
+        del self.status["errors"][:-MAX_STATUS_ERRORS]
+
 
 class Command(BaseCommand):
     help = "Process transactions in batches with progress tracking"
@@ -34,95 +119,91 @@ class Command(BaseCommand):
             help="File to store progress",
         )
         parser.add_argument(
-            "--filter", type=str, help='Filter transactions (e.g., "client_id=123")'
+            "--status-interval",
+            type=float,
+            default=5.0,
+            help="Minimum seconds between status file writes",
+        )
+        parser.add_argument(
+            "--filter",
+            type=str,
+            action="append",
+            help=(
+                "Filter transactions; repeat to AND several "
+                '(e.g. "client_id=123", "amount__lt=0", "category!=Transfer", '
+                '"payee__isnull=true", "id__in=1,2,3")'
+            ),
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Continue after the last id checkpointed in the status file",
         )
 
     def handle(self, *args, **options):
         agent_name = options["agent"]
-        batch_size = options["batch_size"]
+        batch_size = max(1, options["batch_size"])
         status_file = options["status_file"]
-        filter_str = options["filter"]
+        self.status_interval = options["status_interval"]
+        self.last_status_write = 0.0
 
         try:
             agent = Agent.objects.get(name=agent_name)
         except Agent.DoesNotExist:
             self.stderr.write(self.style.ERROR(f'Agent "{agent_name}" not found'))
             return
-
-        # Initialize status
-        status = {
-            "start_time": datetime.now().isoformat(),
-            "agent": agent_name,
-            "total_processed": 0,
-            "successful": 0,
-            "failed": 0,
-            "current_batch": 0,
-            "status": "running",
-            "last_update": datetime.now().isoformat(),
-            "errors": [],
-        }
-
-        # Save initial status
-        self._save_status(status_file, status)
+        query = build_filter_query(options["filter"])
+
+        status = None
+        if options["resume"]:
+            status = self._load_status(status_file)
+            if status is None:
+                raise CommandError(f"No status file to resume from at {status_file}")
+            if status.get("filters", []) != (options["filter"] or []):
+                raise CommandError(
+                    f"Filters differ from the run being resumed: {status.get('filters')}"
+                )
+            status["status"] = "running"
+            self.stdout.write(f"Resuming after transaction {status['last_id']}")
+        if status is None:
+            status = {
+                "start_time": datetime.now().isoformat(),
+                "agent": agent_name,
+                "filters": options["filter"] or [],
+                "total_processed": 0,
+                "successful": 0,
+                "failed": 0,
+                "current_batch": 0,
+                "last_id": 0,
+                "status": "running",
+                "last_update": datetime.now().isoformat(),
+                "errors": [],
+            }
+        progress = StatusProgress(status)
 
         try:
-            # Build query
-            query = Q()
-            if filter_str:
-                # Simple filter parsing (can be enhanced)
-                field, value = filter_str.split("=")
-                query = Q(**{field: value})
-
-            # Get total count
-            total_transactions = Transaction.objects.filter(query).count()
-            status["total_transactions"] = total_transactions
-            self._save_status(status_file, status)
-
-            # Process in batches
-            for i in range(0, total_transactions, batch_size):
-                batch = Transaction.objects.filter(query)[i : i + batch_size]
-                status["current_batch"] = i // batch_size + 1
-                status["last_update"] = datetime.now().isoformat()
-
-                for tx in batch:
-                    try:
-                        with transaction.atomic():
-                            response = call_agent(agent.name, tx)
-
-                            # Use shared field mapping logic
-                            agent_type = (
-                                "payee"
-                                if "payee" in agent.name.lower()
-                                else "classification"
-                            )
-                            update_fields = get_update_fields_from_response(
-                                agent,
-                                response,
-                                agent_type,
-                            )
-
-                            Transaction.objects.filter(id=tx.id).update(**update_fields)
-                            status["successful"] += 1
-                    except Exception as e:
-                        status["failed"] += 1
-                        status["errors"].append(
-                            {
-                                "transaction_id": tx.id,
-                                "error": str(e),
-                                "timestamp": datetime.now().isoformat(),
-                            }
-                        )
-                        logger.error(f"Error processing transaction {tx.id}: {str(e)}")
-
-                    status["total_processed"] += 1
-                    self._save_status(status_file, status)
-
-                # Add a small delay between batches to prevent overwhelming the system
-                time.sleep(1)
+            queryset = Transaction.objects.filter(query)
+            status["total_transactions"] = status["total_processed"] + (
+                queryset.filter(id__gt=status["last_id"]).count()
+            )
+            self._save_status(status_file, status, force=True)
+
+            for batch in iter_keyset_batches(queryset, batch_size, status["last_id"]):
+                status["current_batch"] += 1
+                with ResultWriter(progress) as writer:
+                    for result in run_agent_concurrently(agent, batch):
+                        if result.error is None:
+                            writer.add([result.transaction], result.update_fields)
+                        else:
+                            progress.record([], {result.transaction.id: result.error})
+                        self._save_status(status_file, status)
+                # The checkpoint only moves once the whole batch is written
+                status["last_id"] = batch[-1].id
+                self._save_status(status_file, status)
 
             status["status"] = "completed"
             status["end_time"] = datetime.now().isoformat()
-            self._save_status(status_file, status)
+            self._save_status(status_file, status, force=True)
 
             self.stdout.write(
                 self.style.SUCCESS(
@@ -133,12 +214,29 @@ class Command(BaseCommand):
         except Exception as e:
             status["status"] = "error"
             status["error"] = str(e)
-            self._save_status(status_file, status)
+            self._save_status(status_file, status, force=True)
             self.stderr.write(
-                self.style.ERROR(f"Error during batch processing: {str(e)}")
+                self.style.ERROR(
+                    f"Error during batch processing: {str(e)} "
+                    f"(rerun with --resume to continue after {status['last_id']})"
+                )
             )
 
-    def _save_status(self, status_file, status):
-        """Save status to file"""
-        with open(status_file, "w") as f:
+    def _load_status(self, status_file):
+        if not os.path.exists(status_file):
+            return None
+        with open(status_file) as f:
+            return json.load(f)
+
+    def _save_status(self, status_file, status, force=False):
+        """Save status to file, at most once every --status-interval seconds"""
+        now = time.monotonic()
+        if not force and now - self.last_status_write < self.status_interval:
+            return
+        self.last_status_write = now
+        status["last_update"] = datetime.now().isoformat()
+        # Write then rename so readers never see a half-written file
+        tmp_file = f"{status_file}.tmp"
+        with open(tmp_file, "w") as f:
             json.dump(status, f, indent=2)
+        os.replace(tmp_file, status_file)
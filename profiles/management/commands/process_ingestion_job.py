@@ -0,0 +1,33 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from profiles.ingestion_queue import claim_job, run_ingestion_job
+from profiles.task_queue import make_worker_id
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        "Claim and run one pending IngestionJob (batch statement upload). "
+        "Started by the upload view when TASK_BACKEND is 'subprocess'"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("job_id", type=str, help="The ingestion job ID")
+
+    def handle(self, *args, **options):
+        job_id = options["job_id"]
+        worker_id = make_worker_id("ingest")
+        job = claim_job(job_id, worker_id)
+        if job is None:
+            # A run_workers worker (or an earlier run) already has it
+            self.stdout.write(f"Ingestion job {job_id} is not pending; nothing to do")
+            return
+        run_ingestion_job(job, worker_id)
+        job.refresh_from_db()
+        self.stdout.write(
+            f"Ingestion job {job_id} {job.status}: "
+            f"{job.processed_count}/{job.file_count} files"
+        )
@@ -5,10 +5,9 @@ import django
 import time
 from django.core.management.base import BaseCommand
 from django.conf import settings
-from profiles.models import ProcessingTask, Transaction, Agent
-from profiles.admin import call_agent
-from django.db import transaction
-from profiles.utils import get_update_fields_from_response
+from profiles.models import ProcessingTask
+from profiles.task_queue import task_heartbeat
+from profiles.task_runner import run_processing_task
 
 logger = logging.getLogger(__name__)
 
@@ -77,61 +76,9 @@ class Command(BaseCommand):
         try:
             logger.info(f"STARTING TASK {task_id}")
 
-            # Get the appropriate agent
-            if task.task_type == "payee_lookup":
-                agent = Agent.objects.get(name="Payee Lookup Agent")
-            else:  # classification
-                agent = Agent.objects.get(name="Classification Agent")
-
-            if not agent:
-                raise ValueError(f"No agent found for task type {task.task_type}")
-
-            # Process each transaction
-            # Use the M2M field for robust, future-proof processing
-            transactions = task.transactions.all()
-            total = transactions.count()
-            success_count = 0
-            error_count = 0
-            error_details = {}
-
-            for idx, transaction in enumerate(transactions, 1):
-                try:
-                    # Call the agent
-                    response = call_agent(agent.name, transaction)
-
-                    # Use shared field mapping logic
-                    agent_type = (
-                        "payee"
-                        if task.task_type == "payee_lookup"
-                        else "classification"
-                    )
-                    update_fields = get_update_fields_from_response(
-                        agent, response, agent_type
-                    )
-
-                    # Update the transaction
-                    Transaction.objects.filter(id=transaction.id).update(
-                        **update_fields
-                    )
-                    success_count += 1
-                    logger.info(f"Processed transaction {transaction.id} successfully")
-
-                except Exception as e:
-                    error_count += 1
-                    error_details[str(transaction.id)] = str(e)
-                    logger.error(
-                        f"Error processing transaction {transaction.id}: {str(e)}"
-                    )
-
-                # Update task progress
-                task.processed_count = idx
-                task.error_count = error_count
-                task.error_details = error_details
-                task.save()
-
-            # Update final task status
-            task.status = "completed" if error_count == 0 else "failed"
-            task.save()
+            # Keep the claim alive so run_workers doesn't reclaim the task
+            with task_heartbeat(task, task.worker_id):
+                success_count, error_count = run_processing_task(task, log=logger)
 
             logger.info(
                 f"Task completed: {success_count} successful, {error_count} failed"
@@ -0,0 +1,35 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from profiles.scheduler import queue_stats
+
+
+class Command(BaseCommand):
+    help = "Show ProcessingTask queue depth and wait times per client"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--json", action="store_true", help="Print the stats as JSON"
+        )
+
+    def handle(self, *args, **options):
+        stats = queue_stats()
+        if options["json"]:
+            self.stdout.write(json.dumps(stats, indent=2))
+            return
+        if not stats:
+            self.stdout.write(self.style.SUCCESS("Queue is empty"))
+            return
+        self.stdout.write(
+            f"{'client':<20} {'pending':>8} {'txns':>8} {'running':>8} "
+            f"{'oldest wait':>12} {'avg wait (24h)':>15}"
+        )
+        for client_id, entry in stats.items():
+            avg_wait = entry["avg_wait_seconds"]
+            self.stdout.write(
+                f"{client_id:<20} {entry['pending_tasks']:>8} "
+                f"{entry['pending_transactions']:>8} {entry['processing_tasks']:>8} "
+                f"{entry['oldest_wait_seconds']:>11.0f}s "
+                f"{'-' if avg_wait is None else f'{avg_wait:.0f}s':>15}"
+            )
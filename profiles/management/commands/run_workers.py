@@ -0,0 +1,80 @@
+import logging
+import multiprocessing
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+logger = logging.getLogger(__name__)
+
+
+def _worker_process(index, stop_event, poll_interval):
+    # Spawned children start from a fresh interpreter: set Django up once here
+    import django
+
+    django.setup()
+    from profiles.task_queue import make_worker_id, run_worker
+
+    # The parent handles Ctrl-C and tells us to stop via stop_event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda *args: stop_event.set())
+    run_worker(make_worker_id(index), stop_event, poll_interval)
+
+
+class Command(BaseCommand):
+    help = (
+        "Start long-lived worker processes that claim pending ProcessingTasks "
+        "(SELECT ... FOR UPDATE SKIP LOCKED), heartbeat while running and "
+        "reclaim tasks from dead workers"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=getattr(settings, "TASK_WORKERS", 2),
+            help="Number of worker processes",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=getattr(settings, "TASK_POLL_INTERVAL", 2),
+            help="Seconds an idle worker waits before polling again",
+        )
+
+    def handle(self, *args, **options):
+        workers = max(1, options["workers"])
+        context = multiprocessing.get_context("spawn")
+        stop_event = context.Event()
+
+        def start(index):
+            process = context.Process(
+                target=_worker_process,
+                args=(index, stop_event, options["poll_interval"]),
+                name=f"ledgerflow-worker-{index}",
+            )
+            process.start()
+            return process
+
+        processes = [start(index) for index in range(workers)]
+        self.stdout.write(f"Started {workers} workers; Ctrl-C to stop")
+
+        def shutdown(*args):
+            if not stop_event.is_set():
+                self.stdout.write("Stopping workers after their current task...")
+                stop_event.set()
+
+        signal.signal(signal.SIGINT, shutdown)
+        signal.signal(signal.SIGTERM, shutdown)
+        while not stop_event.is_set():
+            for index, process in enumerate(processes):
+                if not process.is_alive() and not stop_event.is_set():
+                    # Its task is reclaimed once the heartbeat goes stale
+                    logger.warning(
+                        f"Worker {index} exited with code {process.exitcode}; restarting"
+                    )
+                    processes[index] = start(index)
+            stop_event.wait(5)
+        for process in processes:
+            process.join()
+        self.stdout.write(self.style.SUCCESS("All workers stopped"))
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+
+from profiles.learned_classifier import (
+    iter_examples,
+    collect_labels,
+    evaluate,
+    train_client,
+)
+from profiles.models import BusinessProfile
+
+
+class Command(BaseCommand):
+    help = (
+        "Retrain the per-client learned classifier from human-reviewed labels "
+        "(incremental by default) and optionally report precision per worksheet"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--client",
+            type=str,
+            help="client_id to train (default: every client)",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            help="Rebuild the model from scratch instead of updating it",
+        )
+        parser.add_argument(
+            "--eval",
+            action="store_true",
+            help="Hold out 20%% of the labels and report precision per worksheet",
+        )
+
+    def handle(self, *args, **options):
+        clients = BusinessProfile.objects.order_by("client_id")
+        if options["client"]:
+            clients = clients.filter(client_id=options["client"])
+            if not clients.exists():
+                self.stderr.write(
+                    self.style.ERROR(f'Client "{options["client"]}" not found')
+                )
+                return
+
+        for client in clients:
+            model, added, removed = train_client(client, full=options["full"])
+            self.stdout.write(
+                f"{client.client_id}: {model.example_count} examples, "
+                f"{model.class_count} classes (+{added}/-{removed})"
+            )
+            if not options["eval"]:
+                continue
+            report = evaluate(list(iter_examples(client, collect_labels(client))))
+            model.metrics = report
+            model.save(update_fields=["metrics"])
+            self.stdout.write(
+                f"  held out {report['test_examples']}, auto-applied "
+                f"{report['applied']} (coverage {report['coverage']:.1%})"
+            )
+            for worksheet, stats in sorted(report["worksheets"].items()):
+                self.stdout.write(
+                    f"  {worksheet:<12} precision {stats['precision']:.1%} "
+                    f"({stats['correct']}/{stats['predicted']})"
+                )
+
+        self.stdout.write(self.style.SUCCESS("Classifier training complete"))
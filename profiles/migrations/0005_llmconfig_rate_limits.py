@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("profiles", "0004_processingtask_transactions"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="llmconfig",
+            name="requests_per_minute",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Provider request limit for this model (blank uses the settings default).",
+                null=True,
+            ),
+        ),
+        migrations.AddField(
+            model_name="llmconfig",
+            name="tokens_per_minute",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Provider token limit for this model (blank uses the settings default).",
+                null=True,
+            ),
+        ),
+    ]
@@ -0,0 +1,50 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("profiles", "0005_llmconfig_rate_limits"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ClassifierModel",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "state",
+                    models.JSONField(
+                        default=dict,
+                        help_text="Document frequencies and per-class term counts",
+                    ),
+                ),
+                ("example_count", models.IntegerField(default=0)),
+                ("class_count", models.IntegerField(default=0)),
+                (
+                    "metrics",
+                    models.JSONField(
+                        blank=True, default=dict, help_text="Latest evaluation report"
+                    ),
+                ),
+                ("trained_at", models.DateTimeField(auto_now=True)),
+                (
+                    "client",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="classifier_model",
+                        to="profiles.businessprofile",
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("profiles", "0006_classifiermodel"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="processingtask",
+            name="worker_id",
+            field=models.CharField(blank=True, max_length=128, null=True),
+        ),
+        migrations.AddField(
+            model_name="processingtask",
+            name="started_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="processingtask",
+            name="heartbeat_at",
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="processingtask",
+            name="attempts",
+            field=models.IntegerField(default=0),
+        ),
+    ]
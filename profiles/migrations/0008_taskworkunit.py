@@ -0,0 +1,67 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("profiles", "0007_processingtask_worker_fields"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TaskWorkUnit",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("index", models.IntegerField()),
+                ("transaction_ids", models.JSONField(default=list)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("processing", "Processing"),
+                            ("completed", "Completed"),
+                            ("failed", "Failed"),
+                        ],
+                        db_index=True,
+                        default="pending",
+                        max_length=20,
+                    ),
+                ),
+                ("worker_id", models.CharField(blank=True, max_length=128, null=True)),
+                ("heartbeat_at", models.DateTimeField(blank=True, null=True)),
+                ("attempts", models.IntegerField(default=0)),
+                ("processed_count", models.IntegerField(default=0)),
+                ("error_count", models.IntegerField(default=0)),
+                ("error_details", models.JSONField(default=dict)),
+                ("metrics", models.JSONField(default=dict)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "task",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="work_units",
+                        to="profiles.processingtask",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["task", "index"],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("task", "index"), name="unique_task_work_unit"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("profiles", "0008_taskworkunit"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="processingtask",
+            name="priority",
+            field=models.IntegerField(
+                choices=[(-10, "Backfill"), (0, "Normal"), (10, "Urgent")],
+                db_index=True,
+                default=0,
+            ),
+        ),
+    ]
@@ -0,0 +1,52 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("profiles", "0009_processingtask_priority"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="processingtask",
+            name="control",
+            field=models.CharField(
+                blank=True,
+                choices=[("", "None"), ("pause", "Pause"), ("cancel", "Cancel")],
+                default="",
+                max_length=10,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="processingtask",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("processing", "Processing"),
+                    ("paused", "Paused"),
+                    ("completed", "Completed"),
+                    ("failed", "Failed"),
+                ],
+                default="pending",
+                max_length=20,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="taskworkunit",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("processing", "Processing"),
+                    ("paused", "Paused"),
+                    ("completed", "Completed"),
+                    ("failed", "Failed"),
+                ],
+                db_index=True,
+                default="pending",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("profiles", "0012_ingestionjob_ingestionjobfile"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ingestionjobfile",
+            name="statement_hash",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+    ]
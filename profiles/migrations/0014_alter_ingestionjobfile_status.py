@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("profiles", "0013_ingestionjobfile_statement_hash"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="ingestionjobfile",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Pending"),
+                    ("parsing", "Parsing"),
+                    ("completed", "Completed"),
+                    ("duplicate", "Duplicate"),
+                    ("failed", "Failed"),
+                ],
+                default="pending",
+                max_length=20,
+            ),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.db.models import JSONField
+from django.core.serializers.json import DjangoJSONEncoder
 import uuid
 import importlib.util
 import os
@@ -308,6 +309,16 @@ class LLMConfig(models.Model):
     provider = models.CharField(max_length=255)
     model = models.CharField(max_length=255, unique=True)
     url = models.URLField(blank=True, null=True)
+    requests_per_minute = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text="Provider request limit for this model (blank uses the settings default).",
+    )
+    tokens_per_minute = models.PositiveIntegerField(
+        blank=True,
+        null=True,
+        help_text="Provider token limit for this model (blank uses the settings default).",
+    )
 
     def __str__(self):
         return self.model
@@ -453,23 +464,59 @@ class ClassificationOverride(models.Model):
         return f"Override for {self.transaction} by {self.created_by}"
 
 
+class ClassifierModel(models.Model):
+    """Per-client learned classifier state (see profiles.learned_classifier)."""
+
+    client = models.OneToOneField(
+        BusinessProfile, on_delete=models.CASCADE, related_name="classifier_model"
+    )
+    state = models.JSONField(
+        default=dict, help_text="Document frequencies and per-class term counts"
+    )
+    example_count = models.IntegerField(default=0)
+    class_count = models.IntegerField(default=0)
+    metrics = models.JSONField(
+        default=dict, blank=True, help_text="Latest evaluation report"
+    )
+    trained_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Classifier for {self.client.client_id} ({self.example_count} examples)"
+
+
 class ProcessingTask(models.Model):
     STATUS_CHOICES = [
         ("pending", "Pending"),
         ("processing", "Processing"),
+        ("paused", "Paused"),
         ("completed", "Completed"),
         ("failed", "Failed"),
     ]
 
+    # Requests to a running task's worker (see profiles.task_queue.pause_task)
+    CONTROL_CHOICES = [
+        ("", "None"),
+        ("pause", "Pause"),
+        ("cancel", "Cancel"),
+    ]
+
     TASK_TYPES = [
         ("payee_lookup", "Payee Lookup"),
         ("classification", "Classification"),
     ]
 
+    # Higher runs first (see profiles.scheduler)
+    PRIORITY_CHOICES = [
+        (-10, "Backfill"),
+        (0, "Normal"),
+        (10, "Urgent"),
+    ]
+
     task_id = models.UUIDField(primary_key=True, default=uuid.uuid4)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
     task_type = models.CharField(max_length=20, choices=TASK_TYPES)
     client = models.ForeignKey(BusinessProfile, on_delete=models.CASCADE)
+    priority = models.IntegerField(choices=PRIORITY_CHOICES, default=0, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     transaction_count = models.IntegerField()
@@ -480,11 +527,92 @@ class ProcessingTask(models.Model):
     transactions = models.ManyToManyField(
         "Transaction", related_name="processing_tasks", blank=True
     )
+    # Worker bookkeeping (see profiles.task_queue)
+    worker_id = models.CharField(max_length=128, blank=True, null=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    attempts = models.IntegerField(default=0)
+    control = models.CharField(
+        max_length=10, choices=CONTROL_CHOICES, blank=True, default=""
+    )
 
     def __str__(self):
         return f"{self.task_type} task for {self.client.client_id} ({self.status})"
 
 
+class TaskTransactionState(models.Model):
+    """
+    Outcome of one transaction within a ProcessingTask, so retries and
+    restarts only process rows that haven't succeeded yet.
+    """
+
+    STATUS_CHOICES = [
+        ("done", "Done"),
+        ("failed", "Failed"),
+    ]
+
+    task = models.ForeignKey(
+        ProcessingTask, on_delete=models.CASCADE, related_name="transaction_states"
+    )
+    transaction = models.ForeignKey(
+        "Transaction", on_delete=models.CASCADE, related_name="task_states"
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    error = models.TextField(blank=True, default="")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["task", "transaction"], name="unique_task_transaction_state"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["task", "status"], name="task_state_status_idx")
+        ]
+
+    def __str__(self):
+        return f"{self.transaction_id} in {self.task_id}: {self.status}"
+
+
+class TaskWorkUnit(models.Model):
+    """
+    A claimable chunk of a large ProcessingTask's transactions, so several
+    workers can share one task (see profiles.task_queue).
+    """
+
+    STATUS_CHOICES = ProcessingTask.STATUS_CHOICES
+
+    task = models.ForeignKey(
+        ProcessingTask, on_delete=models.CASCADE, related_name="work_units"
+    )
+    index = models.IntegerField()
+    transaction_ids = models.JSONField(default=list)
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default="pending", db_index=True
+    )
+    worker_id = models.CharField(max_length=128, blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    attempts = models.IntegerField(default=0)
+    processed_count = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    error_details = models.JSONField(default=dict)
+    metrics = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["task", "index"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["task", "index"], name="unique_task_work_unit"
+            )
+        ]
+
+    def __str__(self):
+        return f"Unit {self.index} of {self.task_id} ({self.status})"
+
+
 class SearchResult(models.Model):
     """Model to store search results from SearXNG."""
 
@@ -600,13 +728,14 @@ class StatementFile(models.Model):
         return f"{self.client.client_id} - {self.original_filename}"
 
     def compute_statement_hash(self):
-        """Compute SHA256 hash of the file contents."""
+        """Compute SHA256 hash of the file contents, one chunk at a time."""
         if not self.file:
             return None
+        digest = hashlib.sha256()
+        for chunk in self.file.chunks():
+            digest.update(chunk)
         self.file.seek(0)
-        file_bytes = self.file.read()
-        self.file.seek(0)
-        return hashlib.sha256(file_bytes).hexdigest()
+        return digest.hexdigest()
 
     def save(self, *args, **kwargs):
         if not self.statement_hash and self.file:
@@ -654,6 +783,103 @@ def delete_statementfile_file(sender, instance, **kwargs):
         instance.file.delete(save=False)
 
 
+def ingestion_upload_to(instance, filename):
+    ext = filename.split(".")[-1]
+    return f"ingestion/{instance.job_id}/{uuid.uuid4()}.{ext}"
+
+
+class IngestionJob(models.Model):
+    """
+    A batch statement upload processed in the background (see
+    profiles.ingestion_queue): the upload only stores the files, workers
+    detect, parse, dedup and insert them.
+    """
+
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("processing", "Processing"),
+        ("completed", "Completed"),
+        ("failed", "Failed"),
+    ]
+
+    job_id = models.UUIDField(primary_key=True, default=uuid.uuid4)
+    client = models.ForeignKey(
+        BusinessProfile, on_delete=models.CASCADE, related_name="ingestion_jobs"
+    )
+    uploaded_by = models.ForeignKey(
+        get_user_model(), on_delete=models.SET_NULL, null=True, blank=True
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
+    # Upload form options, applied to every file
+    file_type = models.CharField(max_length=10)
+    parser_module = models.CharField(max_length=100, blank=True, default="")
+    account_number = models.CharField(max_length=100, blank=True, null=True)
+    auto_parse = models.BooleanField(default=False)
+    file_count = models.IntegerField(default=0)
+    processed_count = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Worker bookkeeping (same scheme as ProcessingTask)
+    worker_id = models.CharField(max_length=128, blank=True, null=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    heartbeat_at = models.DateTimeField(blank=True, null=True, db_index=True)
+    attempts = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"Ingestion of {self.file_count} files for {self.client.client_id} ({self.status})"
+
+
+class IngestionJobFile(models.Model):
+    """One uploaded file of an IngestionJob and what became of it."""
+
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("parsing", "Parsing"),
+        ("completed", "Completed"),
+        ("duplicate", "Duplicate"),
+        ("failed", "Failed"),
+    ]
+
+    job = models.ForeignKey(
+        IngestionJob, on_delete=models.CASCADE, related_name="files"
+    )
+    index = models.IntegerField()
+    # Staged upload; removed once the file's StatementFile holds its own copy
+    file = models.FileField(upload_to=ingestion_upload_to, blank=True)
+    original_filename = models.CharField(max_length=255)
+    # SHA256 of the upload, computed while it was stored (StatementFile.statement_hash)
+    statement_hash = models.CharField(max_length=64, blank=True, default="")
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
+    statement_file = models.ForeignKey(
+        StatementFile, on_delete=models.SET_NULL, null=True, blank=True
+    )
+    # The batch uploader's per-file result (parser, counts, duplicates, errors)
+    result = models.JSONField(default=dict, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(blank=True, default="")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["job", "index"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["job", "index"], name="unique_ingestion_job_file"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.original_filename} ({self.status})"
+
+
+@receiver(post_delete, sender=IngestionJobFile)
+def delete_ingestionjobfile_file(sender, instance, **kwargs):
+    if instance.file:
+        instance.file.delete(save=False)
+
+
 class TaxChecklistItem(models.Model):
     STATUS_CHOICES = [
         ("not_started", "Not Started"),
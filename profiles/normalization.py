@@ -0,0 +1,67 @@
+"""
+Canonical forms of raw bank transaction descriptions.
+
+Statement lines for the same merchant differ only in noise: POS prefixes,
+store numbers, dates, card suffixes and reference ids. canonicalize_description
+strips that noise so repeat vendors map to one key (used by the LLM response
+cache and by per-batch vendor memoization).
+"""
+
+import re
+from decimal import Decimal, InvalidOperation
+
+# Leading processor / terminal prefixes, applied repeatedly
+# ("POS PURCHASE POS PURCHASE TERMINAL 001 LOWE'S" -> "LOWE'S").
+_PREFIX_RE = re.compile(
+    r"^(?:POS\s+(?:PURCHASE|DEBIT|WITHDRAWAL)|POS|PURCHASE(?:\s+AUTHORIZED\s+ON)?|"
+    r"DEBIT\s+CARD\s+PURCHASE|CHECKCARD|CHECK\s+CARD|DBT\s+CRD|RECURRING\s+PAYMENT|"
+    r"PREAUTHORIZED\s+DEBIT|ACH\s+(?:DEBIT|CREDIT|WITHDRAWAL)|TERMINAL\s+\d+|"
+    r"SQ\s*\*|TST\s*\*|SP\s*\*|PP\s*\*|PAYPAL\s*\*)\s*",
+    re.IGNORECASE,
+)
+_DATE_RE = re.compile(
+    r"\b\d{1,2}[/-]\d{1,2}(?:[/-]\d{2,4})?\b|\b\d{4}-\d{2}-\d{2}\b", re.IGNORECASE
+)
+_CARD_SUFFIX_RE = re.compile(
+    r"\b(?:CARD|ACCT|ACCOUNT)\s*(?:ENDING\s*(?:IN)?)?\s*[#:]?\s*[X*]*\d{4}\b|[X*]{2,}\d{2,4}\b",
+    re.IGNORECASE,
+)
+_STORE_NUMBER_RE = re.compile(
+    r"(?:#|\bNO\.?\s*|\bSTORE\s+)\s*\d+\b|\b\d{3,}\b", re.IGNORECASE
+)
+_PUNCT_RE = re.compile(r"[^A-Z0-9&' ]+")
+_SPACE_RE = re.compile(r"\s+")
+
+
+def canonicalize_description(description):
+    """
+    Return a canonical merchant key for a raw description, e.g.
+    "POS PURCHASE TERMINAL 001 LOWE'S #1636 ALBUQUERQ NM 06/14" -> "LOWE'S ALBUQUERQ NM".
+    Falls back to the upper-cased, whitespace-collapsed input if stripping
+    would leave nothing.
+    """
+    text = _SPACE_RE.sub(" ", (description or "").upper()).strip()
+    original = text
+    previous = None
+    while previous != text:
+        previous = text
+        text = _PREFIX_RE.sub("", text).strip()
+    text = _DATE_RE.sub(" ", text)
+    text = _CARD_SUFFIX_RE.sub(" ", text)
+    text = _STORE_NUMBER_RE.sub(" ", text)
+    text = _PUNCT_RE.sub(" ", text)
+    text = _SPACE_RE.sub(" ", text).strip()
+    return text or original
+
+
+def amount_bucket(amount):
+    """
+    Coarse bucket for an amount: sign plus order of magnitude of the whole
+    dollar value ("+2" for 10.00-99.99, "-3" for -100.00 to -999.99).
+    """
+    try:
+        value = Decimal(str(amount))
+    except (InvalidOperation, TypeError, ValueError):
+        return "?"
+    sign = "-" if value < 0 else "+"
+    return f"{sign}{len(str(int(abs(value))))}"
@@ -1,3 +1,78 @@
+import hashlib
+import threading
+
+import jinja2
+from django.conf import settings
+
+# Shared Environment for Agent.prompt templates. Templates are addressed by
+# agent id + prompt hash, so an edited prompt gets a new name; the agent's
+# previous source is dropped then and its stale compiled template ages out of
+# the Environment's LRU. Compiled bytecode is also persisted so new worker
+# processes skip compilation.
+_template_sources = {}  # template name -> prompt source
+_agent_template_names = {}  # agent id -> name of its current template
+_template_lock = threading.Lock()
+
+
+def _load_template_source(name):
+    source = _template_sources.get(name)
+    if source is None:
+        return None
+    # Names embed the prompt hash, so a loaded template is always up to date.
+    return source, None, lambda: True
+
+
+def _build_prompt_environment():
+    bytecode_dir = getattr(settings, "PROMPT_TEMPLATE_BYTECODE_DIR", None)
+    return jinja2.Environment(
+        loader=jinja2.FunctionLoader(_load_template_source),
+        undefined=jinja2.StrictUndefined,
+        cache_size=getattr(settings, "PROMPT_TEMPLATE_CACHE_SIZE", 400),
+        bytecode_cache=jinja2.FileSystemBytecodeCache(bytecode_dir),
+    )
+
+
+_prompt_environment = None
+
+
+def get_prompt_environment():
+    global _prompt_environment
+    if _prompt_environment is None:
+        with _template_lock:
+            if _prompt_environment is None:
+                _prompt_environment = _build_prompt_environment()
+    return _prompt_environment
+
+
+def get_agent_template(agent_id, prompt):
+    """Return the compiled Jinja2 template for an agent's prompt, compiling it once."""
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    name = f"agent-{agent_id}-{prompt_hash}"
+    environment = get_prompt_environment()
+    with _template_lock:
+        previous = _agent_template_names.get(agent_id)
+        if previous != name:
+            # Only the agent's current prompt is kept; sources never pile up
+            _template_sources.pop(previous, None)
+            _template_sources[name] = prompt
+            _agent_template_names[agent_id] = name
+        # Loaded under the lock, so a concurrent edit can't drop the source
+        # before it is compiled
+        return environment.get_template(name)
+
+
+def render_agent_prompt(agent_id, prompt, context):
+    """
+    Render an agent prompt and split it into (system_prompt, user_prompt) on
+    the ---USER--- delimiter; without a delimiter everything is system prompt.
+    """
+    rendered = get_agent_template(agent_id, prompt).render(**context)
+    if "---USER---" in rendered:
+        system_prompt, user_prompt = rendered.split("---USER---", 1)
+        return system_prompt, user_prompt
+    return rendered, ""
+
+
 def get_fallback_payee_prompt():
     """Return the fallback system prompt for payee agent as a plain string."""
     return """You are a transaction analysis assistant. Your task is to identify the payee/merchant from transaction descriptions, use search tools as needed, and synthesize a clear, normalized description. Return a final response in the exact JSON format specified.\n\nIMPORTANT RULES:\n1. Make as many search calls as needed to gather complete information\n2. Synthesize all information into a clear, normalized response\n3. NEVER use the raw transaction description in your final response\n4. Format the response exactly as specified.\n"""
@@ -84,3 +159,73 @@ Consider these factors:
     )
 
     return system_prompt, user_prompt
+
+
+def get_batch_classification_prompts(
+    transactions, allowed_categories=None, business_profile=None, system_prompt=None
+):
+    """
+    Return (system_prompt, user_prompt) classifying several transactions in one
+    request. The shared context (instructions, business profile, allowed
+    categories) is sent once; the model answers with
+    {"results": [{"transaction_id": ..., ...}, ...]}. A ``system_prompt``
+    (rendered from Agent.prompt) replaces the built-in instructions; the
+    business profile and allowed categories are always appended, since an
+    agent prompt may only place them after its ---USER--- marker.
+    """
+    if system_prompt is None:
+        system_prompt, _ = get_fallback_classification_prompts(
+            transactions[0], allowed_categories=None
+        )
+    if business_profile is not None:
+        system_prompt += (
+            "\nBusiness profile:\n"
+            f"- Company: {business_profile.company_name}\n"
+            f"- Type: {business_profile.business_type or ''}\n"
+            f"- Description: {business_profile.business_description or ''}\n"
+            f"- Common expenses: {business_profile.common_expenses or ''}\n"
+            f"- Category patterns: {business_profile.category_patterns or ''}\n"
+            f"- Business rules: {business_profile.business_rules or ''}\n"
+        )
+    if allowed_categories:
+        system_prompt += f"\nAllowed Categories (choose ONLY from this list):\n{allowed_categories}\n"
+    return system_prompt, get_batch_classification_user_prompt(transactions)
+
+
+def get_batch_classification_user_prompt(transactions):
+    """Return the user prompt listing a batch and its response format."""
+    lines = []
+    for transaction in transactions:
+        lines.append(
+            f"- transaction_id: {transaction.id}\n"
+            f"  Transaction: {transaction.description}\n"
+            f"  Amount: ${transaction.amount}\n"
+            f"  Date: {transaction.transaction_date}\n"
+            f"  Payee: {transaction.payee or ''}\n"
+            f"  Payee reasoning: {transaction.payee_reasoning or ''}"
+        )
+    return (
+        f"Classify each of the following {len(transactions)} transactions independently.\n"
+        "Return a JSON object of this exact form, with one entry per transaction_id:\n"
+        "{\n"
+        '    "results": [\n'
+        "        {\n"
+        '            "transaction_id": <the transaction_id given below>,\n'
+        '            "classification_type": "business" or "personal",\n'
+        '            "worksheet": "6A" or "Vehicle" or "HomeOffice" or "Personal",\n'
+        '            "category_id": "IRS-<id>" or "BIZ-<id>" or "Other" or "Personal" or "Review",\n'
+        '            "category_name": "Name of the selected category",\n'
+        '            "confidence": "high" or "medium" or "low",\n'
+        '            "reasoning": "Explanation of your decision",\n'
+        '            "business_percentage": "integer - 0 for personal, 100 for clear business, 50 for dual-purpose, etc.",\n'
+        '            "questions": "Any questions or uncertainties about this classification"\n'
+        "        }\n"
+        "    ]\n"
+        "}\n\n"
+        "Transactions:\n" + "\n".join(lines) + "\n"
+        "\nIMPORTANT RULES:"
+        "\n- You MUST use one of the allowed category_id values."
+        "\n- If the expense is not business-related, use 'Personal'."
+        "\n- Return exactly one result per transaction_id and do not merge transactions."
+        "\n\nIMPORTANT: Your response must be a valid JSON object.\n"
+    )
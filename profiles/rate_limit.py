@@ -0,0 +1,280 @@
+"""
+Shared rate limiting for outbound LLM and search calls.
+
+Every chat completion made by call_agent (and the batched classification
+path) and every tool call such as searxng_search goes through a
+RateLimiter. Each limiter combines:
+
+- requests/minute and tokens/minute budgets (LLM limits come from the
+  agent's LLMConfig, falling back to settings),
+- an AIMD concurrency window: +1 slot per window of successes, halved on
+  429/5xx responses,
+- retries with jittered exponential backoff that honour Retry-After.
+
+The per-minute budgets are counted in the shared Django cache
+(RATE_LIMIT_CACHE_ALIAS, Redis in production), so every worker process
+draws from the same budget and N workers together stay within the limits.
+The concurrency window bounds the in-flight calls of one process and is
+shared by all of its threads.
+"""
+
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+KEY_PREFIX = "rate_limit"
+
+
+class TokenBucket:
+    """
+    Allows ``rate_per_minute`` units per clock minute across every process
+    sharing the cache: units are counted under ``key`` plus the current
+    minute with atomic increments, and callers over the budget wait for the
+    next minute. If the cache is unreachable, calls are not held back.
+    """
+
+    def __init__(self, key, rate_per_minute):
+        self.key = key
+        self.rate = rate_per_minute
+
+    def _add(self, amount):
+        window = int(time.time() // 60)
+        key = f"{self.key}:{window}"
+        cache = caches[getattr(settings, "RATE_LIMIT_CACHE_ALIAS", "default")]
+        try:
+            cache.add(key, 0, timeout=120)
+            return cache.incr(key, amount)
+        except Exception as e:
+            logger.warning(f"[RATE LIMIT] Could not update {key}, not limiting: {e}")
+            return None
+
+    def try_acquire(self, amount=1):
+        """Take ``amount`` units if this minute's budget allows; never blocks."""
+        amount = min(amount, self.rate)
+        used = self._add(amount)
+        if used is None or used <= self.rate:
+            return True
+        # Over budget: give the units back for other callers
+        self._add(-amount)
+        return False
+
+    def acquire(self, amount=1):
+        """Block until ``amount`` units are available, then take them."""
+        while not self.try_acquire(amount):
+            # Wait for the next minute; jitter spreads the waiting processes
+            wait = 60 - time.time() % 60 + random.uniform(0, 1.0)
+            time.sleep(min(wait, 5.0))
+
+    def adjust(self, delta):
+        """Correct an estimate after the fact (positive delta consumes more)."""
+        if delta:
+            self._add(delta)
+
+
+class AdaptiveConcurrency:
+    """AIMD window of concurrent calls, paused entirely while cooling down."""
+
+    def __init__(self, initial, maximum, minimum=1):
+        self.limit = float(initial)
+        self.maximum = maximum
+        self.minimum = minimum
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                wait = self.cooldown_until - time.monotonic()
+                if wait <= 0 and self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                self.condition.wait(timeout=wait if wait > 0 else 1.0)
+
+    def release(self, overloaded=False, retry_after=None):
+        with self.condition:
+            self.in_flight -= 1
+            if overloaded:
+                self.limit = max(self.minimum, self.limit / 2)
+                if retry_after:
+                    self.cooldown_until = max(
+                        self.cooldown_until, time.monotonic() + retry_after
+                    )
+            else:
+                # Additive increase: about +1 slot per window of successes
+                self.limit = min(self.maximum, self.limit + 1.0 / max(self.limit, 1))
+            self.condition.notify_all()
+
+
+def get_status_code(error):
+    """Return the HTTP status of an OpenAI/requests error, following the exception chain."""
+    while error is not None:
+        status = getattr(error, "status_code", None)
+        if status is None:
+            status = getattr(getattr(error, "response", None), "status_code", None)
+        if status is not None:
+            return status
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def get_retry_after(error):
+    """Seconds from a Retry-After header on the error's response, if any."""
+    while error is not None:
+        headers = getattr(getattr(error, "response", None), "headers", None)
+        if headers:
+            value = headers.get("retry-after") or headers.get("Retry-After")
+            if value:
+                try:
+                    return float(value)
+                except ValueError:
+                    return None
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def is_retryable(error):
+    status = get_status_code(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS_CODES
+    # Connection errors and timeouts carry no status
+    name = type(error).__name__
+    return name in (
+        "APIConnectionError",
+        "APITimeoutError",
+        "ConnectionError",
+        "Timeout",
+    )
+
+
+class RateLimiter:
+    def __init__(
+        self, name, requests_per_minute=None, tokens_per_minute=None, max_concurrency=8
+    ):
+        self.name = name
+        self.requests = (
+            TokenBucket(f"{KEY_PREFIX}:{name}:requests", requests_per_minute)
+            if requests_per_minute
+            else None
+        )
+        self.tokens = (
+            TokenBucket(f"{KEY_PREFIX}:{name}:tokens", tokens_per_minute)
+            if tokens_per_minute
+            else None
+        )
+        self.concurrency = AdaptiveConcurrency(
+            initial=max(1, max_concurrency // 2), maximum=max_concurrency
+        )
+
+    def call(self, func, estimated_tokens=0, max_retries=2, usage_tokens=None):
+        """
+        Call ``func()`` within the limits, retrying retryable failures up to
+        ``max_retries`` times. ``usage_tokens(result)`` may return the actual
+        token count so the tokens/minute bucket can be corrected.
+        """
+        base = getattr(settings, "RATE_LIMIT_BACKOFF_BASE", 1.0)
+        cap = getattr(settings, "RATE_LIMIT_BACKOFF_MAX", 60.0)
+        attempt = 0
+        while True:
+            if self.requests:
+                self.requests.acquire()
+            if self.tokens and estimated_tokens:
+                self.tokens.acquire(estimated_tokens)
+            self.concurrency.acquire()
+            try:
+                result = func()
+            except Exception as e:
+                retryable = is_retryable(e)
+                retry_after = get_retry_after(e)
+                status = get_status_code(e)
+                self.concurrency.release(
+                    overloaded=status == 429 or (status or 0) >= 500,
+                    retry_after=retry_after,
+                )
+                if not retryable or attempt >= max_retries:
+                    raise
+                # Full jitter; never retry sooner than the server asked
+                delay = random.uniform(0, min(cap, base * 2**attempt))
+                if retry_after:
+                    delay = max(delay, retry_after)
+                attempt += 1
+                logger.warning(
+                    f"[RATE LIMIT] {self.name}: {type(e).__name__} (status {status}); "
+                    f"retry {attempt}/{max_retries} in {delay:.1f}s"
+                )
+                time.sleep(delay)
+                continue
+            self.concurrency.release()
+            if self.tokens and usage_tokens:
+                actual = usage_tokens(result)
+                if actual:
+                    self.tokens.adjust(actual - estimated_tokens)
+            return result
+
+
+_limiters = {}
+_lock = threading.Lock()
+
+
+def get_rate_limiter(
+    name, requests_per_minute=None, tokens_per_minute=None, max_concurrency=None
+):
+    """
+    Return this process's limiter for ``name``, creating it on first use.
+    Its per-minute budgets are shared with other processes through the cache.
+    """
+    limiter = _limiters.get(name)
+    if limiter is None:
+        with _lock:
+            limiter = _limiters.get(name)
+            if limiter is None:
+                limiter = RateLimiter(
+                    name,
+                    requests_per_minute=requests_per_minute,
+                    tokens_per_minute=tokens_per_minute,
+                    max_concurrency=max_concurrency
+                    or getattr(settings, "RATE_LIMIT_MAX_CONCURRENCY", 8),
+                )
+                _limiters[name] = limiter
+    return limiter
+
+
+def get_llm_rate_limiter(agent):
+    """Limiter for a CompiledAgent's model, using its LLMConfig limits."""
+    defaults = getattr(settings, "LLM_RATE_LIMIT_DEFAULTS", {})
+    rpm = agent.requests_per_minute or defaults.get("requests_per_minute")
+    tpm = agent.tokens_per_minute or defaults.get("tokens_per_minute")
+    # Limits are part of the key so editing an LLMConfig takes effect immediately
+    return get_rate_limiter(
+        f"llm:{agent.model}:{rpm}:{tpm}",
+        requests_per_minute=rpm,
+        tokens_per_minute=tpm,
+    )
+
+
+def get_tool_rate_limiter(tool_name):
+    """Limiter for a tool such as searxng_search (settings.TOOL_RATE_LIMITS)."""
+    config = getattr(settings, "TOOL_RATE_LIMITS", {}).get(tool_name, {})
+    return get_rate_limiter(
+        f"tool:{tool_name}",
+        requests_per_minute=config.get("requests_per_minute"),
+        max_concurrency=config.get("max_concurrency"),
+    )
+
+
+def estimate_tokens(messages, completion_allowance=500):
+    """Rough pre-call token estimate (~4 characters per token)."""
+    chars = sum(len(str(message.get("content") or "")) for message in messages)
+    return chars // 4 + completion_allowance
+
+
+def usage_total_tokens(response):
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None) if usage else None
@@ -0,0 +1,105 @@
+"""
+Buffered persistence of agent results.
+
+Instead of one ``Transaction.objects.filter(id=...).update(...)`` per result,
+runners hand results to a ResultWriter, which accumulates them and writes
+them with ``bulk_update`` every RESULT_FLUSH_ROWS rows or RESULT_FLUSH_SECONDS
+seconds. Rows only count as processed once their write has succeeded: each
+flush reports the written and failed transaction ids to the run's progress
+sink (see task_runner.TaskProgress).
+"""
+
+import logging
+import time
+
+from django.conf import settings
+
+from . import telemetry
+from .models import Transaction
+
+logger = logging.getLogger(__name__)
+
+
+def bulk_apply_update_fields(updates, batch_size=500):
+    """
+    Apply [(transactions, update_fields), ...] with one bulk_update per
+    distinct set of fields (so a row never gets another row's columns
+    rewritten with stale values). If a bulk write fails (e.g. one bad
+    value), fall back to per-group UPDATEs so one row can't sink the rest.
+    Returns {transaction_id: error} for failed rows.
+    """
+    by_fields = {}
+    for members, update_fields in updates:
+        by_fields.setdefault(frozenset(update_fields), []).append(
+            (members, update_fields)
+        )
+    errors = {}
+    for fields, group in by_fields.items():
+        if not fields:
+            continue
+        objs = []
+        for members, update_fields in group:
+            for transaction in members:
+                for field, value in update_fields.items():
+                    setattr(transaction, field, value)
+                objs.append(transaction)
+        try:
+            Transaction.objects.bulk_update(objs, sorted(fields), batch_size=batch_size)
+            continue
+        except Exception as e:
+            logger.warning(f"Bulk update failed, retrying row by row: {e}")
+        for members, update_fields in group:
+            ids = [transaction.id for transaction in members]
+            try:
+                Transaction.objects.filter(id__in=ids).update(**update_fields)
+            except Exception as e:
+                errors.update({transaction_id: e for transaction_id in ids})
+    return errors
+
+
+class ResultWriter:
+    """Buffers (transactions, update_fields) results and flushes them in bulk."""
+
+    def __init__(self, progress, flush_rows=None, flush_seconds=None):
+        self.progress = progress
+        self.flush_rows = flush_rows or getattr(settings, "RESULT_FLUSH_ROWS", 100)
+        self.flush_seconds = (
+            flush_seconds
+            if flush_seconds is not None
+            else getattr(settings, "RESULT_FLUSH_SECONDS", 2.0)
+        )
+        self.buffer = []
+        self.rows = 0
+        self.last_flush = time.monotonic()
+
+    def add(self, transactions, update_fields):
+        """Queue ``update_fields`` for every transaction in ``transactions``."""
+        self.buffer.append((list(transactions), update_fields))
+        self.rows += len(transactions)
+        if (
+            self.rows >= self.flush_rows
+            or time.monotonic() - self.last_flush >= self.flush_seconds
+        ):
+            self.flush()
+
+    def flush(self):
+        buffer, self.buffer, self.rows = self.buffer, [], 0
+        self.last_flush = time.monotonic()
+        if not buffer:
+            return
+        with telemetry.stage("db_write"):
+            errors = bulk_apply_update_fields(buffer)
+        succeeded = [
+            transaction.id
+            for members, _ in buffer
+            for transaction in members
+            if transaction.id not in errors
+        ]
+        self.progress.record(succeeded, errors)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        # Results already received are written even if the run is failing
+        self.flush()
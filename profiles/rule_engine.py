@@ -0,0 +1,291 @@
+"""
+Deterministic classification rules evaluated before any LLM call.
+
+Transfers, card payments, interest credits and payroll deposits are matched
+by built-in patterns and classified as "Personal" (not a business expense),
+the same vocabulary the Classification Agent answers with; known vendors come from each client's
+BusinessProfile.category_patterns and business_rules. Those text fields hold
+entries like::
+
+    Home Depot: Supplies
+    Shell | Chevron -> Car and Truck Expenses
+    Supplies: Lowe's, Ace Hardware
+    /^AMZN MKTP/ => Office Expense
+
+(keywords on either side of ``:``, ``->`` or ``=>``, alternatives separated by
+``|`` or commas, ``/.../`` for a raw regex). An entry is only used when one
+side names a category the client can actually use (IRS 6A, the client's
+business categories, ClientExpenseCategory or "Personal"), so free-text prose
+in those fields is ignored and left for the LLM prompt.
+
+Client keywords are canonicalized and compiled into a single alternation per
+client (longest keyword first), so matching a transaction is one regex search
+regardless of the number of rules. Compiled rule sets are cached per process
+and refreshed after RULE_ENGINE_CACHE_TTL seconds or when the profile is saved.
+"""
+
+import logging
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import (
+    BusinessExpenseCategory,
+    BusinessProfile,
+    ClientExpenseCategory,
+    IRSExpenseCategory,
+)
+from .normalization import canonicalize_description
+
+logger = logging.getLogger(__name__)
+
+RULE_METHOD = "Rule"
+# (category, worksheet, classification_type) of non-business transactions, as
+# in the allowed categories given to the Classification Agent
+PERSONAL = ("Personal", "Personal", "personal")
+
+
+@dataclass
+class Rule:
+    name: str
+    category: str
+    worksheet: str
+    classification_type: str
+    business_percentage: int
+    pattern: Optional[re.Pattern] = None
+    # "credit" or "debit" restricts the rule to one side of the ledger
+    direction: Optional[str] = None
+
+    def applies_to(self, transaction):
+        if self.direction == "credit" and transaction.amount <= 0:
+            return False
+        if self.direction == "debit" and transaction.amount >= 0:
+            return False
+        return True
+
+    def update_fields(self, transaction):
+        return {
+            "classification_type": self.classification_type,
+            "worksheet": self.worksheet,
+            "category": self.category,
+            "business_percentage": self.business_percentage,
+            "confidence": "high",
+            "reasoning": f"Matched rule '{self.name}' for '{transaction.description}'",
+            "classification_method": RULE_METHOD,
+        }
+
+
+def _builtin(name, pattern, direction=None):
+    category, worksheet, classification_type = PERSONAL
+    return Rule(
+        name=name,
+        category=category,
+        worksheet=worksheet,
+        classification_type=classification_type,
+        business_percentage=0,
+        pattern=re.compile(pattern, re.IGNORECASE),
+        direction=direction,
+    )
+
+
+# Money movements that are never deductible expenses
+BUILTIN_RULES = [
+    _builtin(
+        "credit_card_payment",
+        r"\b(?:PAYMENT\s*-?\s*THANK\s*YOU|AUTOMATIC\s+PAYMENT\s*-?\s*THANK|"
+        r"CRCARDPMT|CREDIT\s+CARD\s+(?:PAYMENT|PMT)|CARD\s+SERVICES\s+PAYMENT)\b",
+    ),
+    _builtin(
+        "transfer",
+        r"\b(?:(?:ONLINE|MOBILE|INTERNAL|FUNDS)\s+)?TRANSFER\s+(?:TO|FROM)\b|\bXFER\b",
+    ),
+    _builtin(
+        "interest_credit",
+        r"\bINTEREST\s+(?:PAID|PAYMENT|CREDIT|EARNED)\b|\bINT\s+PD\b",
+        direction="credit",
+    ),
+    _builtin(
+        "payroll",
+        r"\b(?:PAYROLL|DIR(?:ECT)?\s+DEP(?:OSIT)?|SALARY)\b",
+        direction="credit",
+    ),
+]
+
+_ENTRY_SPLIT_RE = re.compile(r"[\n;]+")
+# A comma only starts a new entry when another "keyword:" follows
+_PAIR_SPLIT_RE = re.compile(r",\s*(?=[^,:]+(?::|->|=>))")
+_PAIR_RE = re.compile(r"^\s*(?P<lhs>.+?)\s*(?:=>|->|:)\s*(?P<rhs>.+?)\s*$")
+_ALTERNATIVES_RE = re.compile(r"\s*[|,]\s*")
+
+
+@dataclass
+class ClientRuleSet:
+    client_id: int
+    keyword_re: Optional[re.Pattern] = None
+    keyword_rules: Dict[str, Rule] = field(default_factory=dict)
+    regex_rules: List[Rule] = field(default_factory=list)
+
+    def match(self, transaction):
+        """Return the first Rule matching ``transaction``, or None."""
+        description = (transaction.description or "").upper()
+        for rule in BUILTIN_RULES:
+            if rule.pattern.search(description) and rule.applies_to(transaction):
+                return rule
+        for rule in self.regex_rules:
+            if rule.pattern.search(description):
+                return rule
+        if self.keyword_re is not None:
+            for text in (description, transaction.payee or ""):
+                found = self.keyword_re.search(f" {canonicalize_description(text)} ")
+                if found:
+                    return self.keyword_rules[found.group(1)]
+        return None
+
+
+def _category_lookup(client):
+    """Map lower-cased category name -> (category, worksheet, classification_type)."""
+    categories = {"personal": PERSONAL}
+    for name, worksheet in IRSExpenseCategory.objects.filter(
+        worksheet__name="6A", is_active=True
+    ).values_list("name", "worksheet__name"):
+        categories[name.lower()] = (name, worksheet, "business")
+    for name, worksheet in BusinessExpenseCategory.objects.filter(
+        business=client, is_active=True
+    ).values_list("category_name", "worksheet__name"):
+        categories[name.lower()] = (name, worksheet, "business")
+    for name, worksheet in ClientExpenseCategory.objects.filter(
+        client=client, is_active=True
+    ).values_list("category_name", "worksheet"):
+        kind = "personal" if worksheet == "Personal" else "business"
+        categories[name.lower()] = (name, worksheet, kind)
+    return categories
+
+
+def parse_rule_entries(text):
+    """Yield (left, right) string pairs from a category_patterns/business_rules field."""
+    for line in _ENTRY_SPLIT_RE.split(text or ""):
+        for entry in _PAIR_SPLIT_RE.split(line.strip(" -*\t")):
+            pair = _PAIR_RE.match(entry)
+            if pair:
+                yield pair.group("lhs"), pair.group("rhs")
+
+
+def _is_regex(keyword):
+    return len(keyword) > 2 and keyword.startswith("/") and keyword.endswith("/")
+
+
+def compile_client_rules(client):
+    """Build the ClientRuleSet for a BusinessProfile."""
+    categories = _category_lookup(client)
+    rule_set = ClientRuleSet(client_id=client.id)
+    texts = (client.category_patterns, client.business_rules)
+    for lhs, rhs in (pair for text in texts for pair in parse_rule_entries(text)):
+        if rhs.strip().lower() in categories:
+            keywords, target = lhs, categories[rhs.strip().lower()]
+        elif lhs.strip().lower() in categories:
+            keywords, target = rhs, categories[lhs.strip().lower()]
+        else:
+            continue
+        category, worksheet, kind = target
+        keywords = keywords.strip()
+        if _is_regex(keywords):
+            alternatives = [keywords]
+        else:
+            alternatives = filter(None, _ALTERNATIVES_RE.split(keywords))
+        for keyword in alternatives:
+            rule = Rule(
+                name=keyword,
+                category=category,
+                worksheet=worksheet,
+                classification_type=kind,
+                business_percentage=100 if kind == "business" else 0,
+            )
+            if _is_regex(keyword):
+                try:
+                    rule.pattern = re.compile(keyword[1:-1], re.IGNORECASE)
+                except re.error as e:
+                    logger.warning(
+                        f"[RULES] Ignoring invalid pattern {keyword!r} for client {client.client_id}: {e}"
+                    )
+                    continue
+                rule_set.regex_rules.append(rule)
+            else:
+                key = canonicalize_description(keyword)
+                if len(key) >= 3:
+                    rule_set.keyword_rules.setdefault(key, rule)
+    if rule_set.keyword_rules:
+        alternation = "|".join(
+            re.escape(key)
+            for key in sorted(rule_set.keyword_rules, key=len, reverse=True)
+        )
+        rule_set.keyword_re = re.compile(f" ({alternation}) ")
+    logger.info(
+        f"[RULES] Compiled {len(rule_set.keyword_rules)} keyword and "
+        f"{len(rule_set.regex_rules)} regex rules for client {client.client_id}"
+    )
+    return rule_set
+
+
+_lock = threading.Lock()
+_rule_sets: Dict[int, tuple] = {}
+
+
+def get_client_rules(client_id):
+    """Return the cached ClientRuleSet for a BusinessProfile id."""
+    now = time.monotonic()
+    cached = _rule_sets.get(client_id)
+    if cached is not None and cached[0] > now:
+        return cached[1]
+    with _lock:
+        cached = _rule_sets.get(client_id)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        client = BusinessProfile.objects.get(id=client_id)
+        rule_set = compile_client_rules(client)
+        ttl = getattr(settings, "RULE_ENGINE_CACHE_TTL", 300)
+        _rule_sets[client_id] = (now + ttl, rule_set)
+        return rule_set
+
+
+def is_enabled():
+    return getattr(settings, "RULE_ENGINE_ENABLED", True)
+
+
+def split_by_rules(transactions):
+    """
+    Split transactions into (matched, unmatched). ``matched`` is a list of
+    (transaction, update_fields, rule_name); only ``unmatched`` need an LLM call.
+    """
+    if not is_enabled():
+        return [], list(transactions)
+    matched, unmatched = [], []
+    for transaction in transactions:
+        rule = get_client_rules(transaction.client_id).match(transaction)
+        if rule is None:
+            unmatched.append(transaction)
+        else:
+            matched.append((transaction, rule.update_fields(transaction), rule.name))
+    if matched:
+        logger.info(
+            f"[RULES] {len(matched)} of {len(matched) + len(unmatched)} transactions matched rules"
+        )
+    return matched, unmatched
+
+
+@receiver(post_save, sender=BusinessProfile)
+@receiver(post_save, sender=BusinessExpenseCategory)
+@receiver(post_save, sender=ClientExpenseCategory)
+def _invalidate_client_rules(sender, instance, **kwargs):
+    if sender is BusinessProfile:
+        client_id = instance.id
+    elif sender is BusinessExpenseCategory:
+        client_id = instance.business_id
+    else:
+        client_id = instance.client_id
+    _rule_sets.pop(client_id, None)
@@ -0,0 +1,182 @@
+"""
+Priority and per-client fair scheduling of ProcessingTasks.
+
+Workers ask the scheduler what to claim next instead of taking the oldest
+pending row, so one client's backfill can't starve everyone else. The
+candidates are every pending task plus the next pending work unit of each
+running (split) task. They are ranked by:
+
+1. Effective priority: the task's ``priority``, +1 for interactive tasks
+   (at most TASK_INTERACTIVE_MAX_TRANSACTIONS transactions), +1 for every
+   TASK_PRIORITY_AGING_SECONDS spent waiting, so large backfills still drain.
+2. The client's share of the workers: work units and tasks it has in flight
+   divided by its weight (TASK_CLIENT_WEIGHTS, default 1). Among equal
+   priorities the least-served client goes first (weighted fair queuing).
+3. Age.
+
+queue_stats() reports queue depth and wait times per client.
+"""
+
+import logging
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from .models import ProcessingTask, TaskWorkUnit
+
+logger = logging.getLogger(__name__)
+
+TASK = "task"
+UNIT = "unit"
+
+
+@dataclass
+class Candidate:
+    kind: str  # TASK or UNIT
+    id: object  # task_id or work unit id
+    client_id: str  # BusinessProfile.client_id
+    priority: int
+    transaction_count: int
+    created_at: datetime
+
+
+def get_client_weight(client_id):
+    weights = getattr(settings, "TASK_CLIENT_WEIGHTS", {})
+    return max(float(weights.get(client_id, 1)), 0.01)
+
+
+def effective_priority(candidate, now):
+    priority = candidate.priority
+    if candidate.transaction_count <= getattr(
+        settings, "TASK_INTERACTIVE_MAX_TRANSACTIONS", 50
+    ):
+        priority += 1
+    aging = getattr(settings, "TASK_PRIORITY_AGING_SECONDS", 600)
+    if aging:
+        priority += int((now - candidate.created_at).total_seconds() // aging)
+    return priority
+
+
+def in_flight_by_client():
+    """Number of tasks and work units currently being worked on, per client."""
+    counts = Counter(
+        ProcessingTask.objects.filter(
+            status="processing", worker_id__isnull=False
+        ).values_list("client__client_id", flat=True)
+    )
+    for row in (
+        TaskWorkUnit.objects.filter(status="processing")
+        .values("task__client__client_id")
+        .annotate(units=Count("id"))
+    ):
+        counts[row["task__client__client_id"]] += row["units"]
+    return counts
+
+
+def pending_candidates():
+    """Every pending task plus the next pending unit of each running task."""
+    window = getattr(settings, "TASK_SCHEDULER_WINDOW", 500)
+    candidates = [
+        Candidate(TASK, *row)
+        for row in ProcessingTask.objects.filter(status="pending")
+        .order_by("-priority", "created_at")
+        .values_list(
+            "task_id",
+            "client__client_id",
+            "priority",
+            "transaction_count",
+            "created_at",
+        )[:window]
+    ]
+    next_units = list(
+        TaskWorkUnit.objects.filter(status="pending", task__status="processing")
+        .values("task_id")
+        .annotate(unit_id=Min("id"), created_at=Min("created_at"))
+    )
+    tasks = {
+        row["task_id"]: row
+        for row in ProcessingTask.objects.filter(
+            task_id__in=[row["task_id"] for row in next_units]
+        ).values("task_id", "client__client_id", "priority", "transaction_count")
+    }
+    for row in next_units:
+        task = tasks[row["task_id"]]
+        candidates.append(
+            Candidate(
+                UNIT,
+                row["unit_id"],
+                task["client__client_id"],
+                task["priority"],
+                # The parent's size: a backfill's units aren't interactive
+                task["transaction_count"],
+                row["created_at"],
+            )
+        )
+    return candidates
+
+
+def rank(candidates, in_flight, now=None):
+    """Order candidates best first (see module docstring)."""
+    now = now or timezone.now()
+    return sorted(
+        candidates,
+        key=lambda c: (
+            -effective_priority(c, now),
+            in_flight.get(c.client_id, 0) / get_client_weight(c.client_id),
+            c.created_at,
+        ),
+    )
+
+
+def next_candidates():
+    """Pending work, best first. Claim down the list until a claim succeeds."""
+    return rank(pending_candidates(), in_flight_by_client())
+
+
+def queue_stats(now=None):
+    """
+    Per-client queue depth and wait times: pending and running tasks, pending
+    transactions, the oldest pending task's wait, and the average wait
+    (created_at -> started_at) of tasks started in the last
+    TASK_STATS_WINDOW_HOURS.
+    """
+    now = now or timezone.now()
+    stats = defaultdict(
+        lambda: {
+            "pending_tasks": 0,
+            "pending_transactions": 0,
+            "processing_tasks": 0,
+            "oldest_wait_seconds": 0.0,
+            "started_tasks": 0,
+            "avg_wait_seconds": None,
+        }
+    )
+    for client_id, created_at, count in ProcessingTask.objects.filter(
+        status="pending"
+    ).values_list("client__client_id", "created_at", "transaction_count"):
+        entry = stats[client_id]
+        entry["pending_tasks"] += 1
+        entry["pending_transactions"] += count
+        entry["oldest_wait_seconds"] = max(
+            entry["oldest_wait_seconds"], (now - created_at).total_seconds()
+        )
+    for client_id in ProcessingTask.objects.filter(status="processing").values_list(
+        "client__client_id", flat=True
+    ):
+        stats[client_id]["processing_tasks"] += 1
+    window = timedelta(hours=getattr(settings, "TASK_STATS_WINDOW_HOURS", 24))
+    waits = defaultdict(list)
+    for client_id, created_at, started_at in ProcessingTask.objects.filter(
+        started_at__gte=now - window
+    ).values_list("client__client_id", "created_at", "started_at"):
+        waits[client_id].append((started_at - created_at).total_seconds())
+    for client_id, values in waits.items():
+        stats[client_id]["started_tasks"] = len(values)
+        stats[client_id]["avg_wait_seconds"] = round(sum(values) / len(values), 1)
+    for entry in stats.values():
+        entry["oldest_wait_seconds"] = round(entry["oldest_wait_seconds"], 1)
+    return dict(sorted(stats.items()))
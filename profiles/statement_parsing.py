@@ -0,0 +1,138 @@
+"""
+Parsing of uploaded statement files, in parallel across processes.
+
+Parser detection and the parsers themselves (pdfplumber) are CPU-bound, so
+``parse_statement_files`` runs them in a process pool of
+STATEMENT_PARSE_WORKERS processes and hands the ParserOutputs back, in upload
+order, to the caller, which alone writes StatementFile, Transaction and
+ParsingRun rows. Nothing here touches the database, so worker processes
+never share the parent's connection. Workers are spawned, not forked: a fork
+would copy the parent's threads (e.g. the task Heartbeat) and open
+connections mid-use, which can deadlock the child.
+"""
+
+import importlib
+import logging
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_registry = None
+
+
+@dataclass
+class ParseResult:
+    parser: str = None  # parser module used
+    detected: bool = False  # parser was autodetected
+    output: object = None  # dataextractai ParserOutput
+    error: str = None
+
+
+def get_parsers_path():
+    return getattr(settings, "STATEMENT_PARSERS_PATH", "")
+
+
+def load_parser_registry(parsers_path=None):
+    """Import and autodiscover the statement parsers (once per process)."""
+    global _registry
+    if _registry is None:
+        parsers_path = parsers_path or get_parsers_path()
+        if parsers_path and parsers_path not in sys.path:
+            sys.path.append(parsers_path)
+        from dataextractai.parsers_core.autodiscover import autodiscover_parsers
+
+        autodiscover_parsers()
+        registry_mod = importlib.import_module("dataextractai.parsers_core.registry")
+        _registry = getattr(registry_mod, "ParserRegistry")
+    return _registry
+
+
+def parse_statement_file(path, parser_module=None):
+    """Detect the parser for ``path`` if needed and run it. Never raises."""
+    result = ParseResult(parser=parser_module)
+    try:
+        registry = load_parser_registry()
+        if parser_module == "autodetect" or not parser_module:
+            from dataextractai.parsers.detect import detect_parser_for_file
+
+            result.parser = detect_parser_for_file(path)
+            if not result.parser:
+                result.error = "No compatible parser found."
+                return result
+            result.detected = True
+        parser_cls = registry.get_parser(result.parser)
+        if not parser_cls:
+            result.error = f"Parser '{result.parser}' not found in registry."
+            return result
+        parser_main = getattr(importlib.import_module(parser_cls.__module__), "main")
+        try:
+            output = parser_main(input_path=path)
+        except Exception as e:
+            result.error = f"Parser error: {e}"
+            return result
+        from dataextractai.parsers_core.models import ParserOutput
+
+        if not isinstance(output, ParserOutput):
+            result.error = f"Parser did not return ParserOutput. Got: {type(output)}"
+            return result
+        result.output = output
+    except Exception as e:
+        result.error = str(e)
+    return result
+
+
+def init_parse_worker(parsers_path):
+    """
+    Process pool initializer. A spawned worker starts from a fresh
+    interpreter, so set up Django (results and callables pickled by name may
+    live in project modules) and load the parsers once, up front.
+    """
+    import django
+
+    django.setup()
+    try:
+        load_parser_registry(parsers_path)
+    except Exception as e:
+        # parse_statement_file retries and reports the error for each file
+        logger.error(f"Loading the statement parsers failed: {e}")
+
+
+def get_parse_workers():
+    return getattr(settings, "STATEMENT_PARSE_WORKERS", None) or os.cpu_count() or 1
+
+
+def parse_statement_files(paths, parser_module=None, workers=None):
+    """
+    Yield a ParseResult for each of ``paths``, in order, as soon as it and
+    the ones before it are parsed. One file runs in-process.
+    """
+    workers = min(workers or get_parse_workers(), len(paths))
+    if multiprocessing.current_process().daemon:
+        # Daemonic workers (e.g. Celery's prefork pool) can't start processes
+        workers = 1
+    if workers <= 1:
+        for path in paths:
+            yield parse_statement_file(path, parser_module)
+        return
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_parse_worker,
+        initargs=(get_parsers_path(),),
+    ) as pool:
+        futures = [
+            pool.submit(parse_statement_file, path, parser_module) for path in paths
+        ]
+        for path, future in zip(paths, futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                # The worker process died (e.g. out of memory)
+                logger.error(f"Parsing {path} failed in the worker pool: {e}")
+                yield ParseResult(parser=parser_module, error=f"Parser error: {e}")
@@ -0,0 +1,101 @@
+"""
+Live progress of ProcessingTasks for the admin.
+
+The task change page polls a small JSON endpoint (ProcessingTaskAdmin
+progress_view) instead of reloading the whole form. Counters come from the
+cache, refreshed from the database at most every TASK_PROGRESS_CACHE_SECONDS
+however many pages are open, and the task log is tailed by seeking: the
+first request reads only the last TASK_LOG_TAIL_BYTES, later ones only the
+bytes appended since the offset the page last saw.
+"""
+
+import logging
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import ProcessingTask
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_STATUSES = ("pending", "processing")
+
+
+def get_task_log_path(task_id):
+    return Path(settings.BASE_DIR) / "logs" / f"task_{task_id}.log"
+
+
+def tail_log(path, offset=None, max_bytes=None):
+    """
+    Return (text, next_offset) for the log at ``path``. Without ``offset``
+    (or if the file was truncated below it) this is the last ``max_bytes``
+    starting at a line boundary; with it, the bytes written since then
+    (at most ``max_bytes``). Returns ("", 0) if the file doesn't exist.
+    """
+    max_bytes = max_bytes or getattr(settings, "TASK_LOG_TAIL_BYTES", 64 * 1024)
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        return "", 0
+    if offset is None or offset > size:
+        start = max(0, size - max_bytes)
+    else:
+        start = offset
+    with open(path, "rb") as f:
+        f.seek(start)
+        data = f.read(max_bytes)
+    next_offset = start + len(data)
+    if start > 0 and start != offset:
+        # Drop the partial first line
+        newline = data.find(b"\n")
+        data = data[newline + 1 :] if newline != -1 else b""
+    return data.decode("utf-8", errors="replace"), next_offset
+
+
+def _cache_key(task_id):
+    return f"task_progress:{task_id}"
+
+
+def get_progress_snapshot(task_id):
+    """Counters and status of a task, served from the cache."""
+    key = _cache_key(task_id)
+    try:
+        snapshot = cache.get(key)
+    except Exception as e:
+        logger.debug(f"Could not read task progress from cache: {e}")
+        snapshot = None
+    if snapshot is not None:
+        return snapshot
+    row = (
+        ProcessingTask.objects.filter(task_id=task_id)
+        .values(
+            "status",
+            "control",
+            "transaction_count",
+            "processed_count",
+            "error_count",
+            "updated_at",
+        )
+        .first()
+    )
+    if row is None:
+        return None
+    total = row["transaction_count"] or 0
+    snapshot = {
+        "task_id": str(task_id),
+        "status": row["status"],
+        "control": row["control"],
+        "transaction_count": total,
+        "processed_count": row["processed_count"],
+        "error_count": row["error_count"],
+        "percent": round(100 * row["processed_count"] / total, 1) if total else 0.0,
+        "updated_at": row["updated_at"].isoformat(),
+        "active": row["status"] in ACTIVE_STATUSES,
+    }
+    try:
+        cache.set(key, snapshot, getattr(settings, "TASK_PROGRESS_CACHE_SECONDS", 2))
+    except Exception as e:
+        logger.debug(f"Could not cache task progress: {e}")
+    return snapshot
@@ -0,0 +1,613 @@
+"""
+Database-backed queue of ProcessingTasks for long-lived workers.
+
+Workers (``manage.py run_workers``) ask profiles.scheduler for the best
+pending work (priority, then per-client fair share) and walk the ranked
+candidates, locking each row with SELECT ... FOR UPDATE SKIP LOCKED: a row
+another worker is claiming is skipped without waiting, so workers spread
+over the best candidates instead of racing for the first one. The claim
+itself is a compare-and-set UPDATE in the same transaction, which also keeps
+claims safe on backends without SKIP LOCKED (SQLite). While a task
+runs, a heartbeat thread stamps heartbeat_at; any worker can reclaim tasks
+whose heartbeat is older than TASK_HEARTBEAT_TIMEOUT, i.e. whose worker died.
+
+Tasks with more than TASK_CHUNK_SIZE transactions are split into
+TaskWorkUnits when claimed. Units are scheduled like tasks, so every idle
+worker helps finish a large task; each unit adds its counts to the
+parent task with F() expressions and the worker finishing the last unit
+sets the task's final status.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import telemetry
+from .batch_api import EXECUTION_MODE_BATCH_API
+from .models import ProcessingTask, TaskWorkUnit, Transaction
+from .scheduler import TASK, UNIT, next_candidates
+from .task_runner import (
+    CONTROL_CANCEL,
+    CONTROL_PAUSE,
+    BufferedProgress,
+    TaskInterrupted,
+    done_states,
+    group_by_vendor,
+    process_task_transactions,
+    record_skipped,
+    run_processing_task,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_heartbeat_interval():
+    return getattr(settings, "TASK_HEARTBEAT_INTERVAL", 10)
+
+
+def get_heartbeat_timeout():
+    return getattr(settings, "TASK_HEARTBEAT_TIMEOUT", 60)
+
+
+def make_worker_id(index=0):
+    return f"{socket.gethostname()}:{os.getpid()}:{index}:{uuid.uuid4().hex[:6]}"
+
+
+def claim_task(task_id, worker_id):
+    """
+    Atomically move one pending task to processing for ``worker_id``.
+    Returns the claimed task, or None if someone else got it first.
+    """
+    now = timezone.now()
+    claimed = ProcessingTask.objects.filter(task_id=task_id, status="pending").update(
+        status="processing",
+        worker_id=worker_id,
+        started_at=now,
+        heartbeat_at=now,
+        attempts=F("attempts") + 1,
+    )
+    if not claimed:
+        return None
+    return ProcessingTask.objects.get(task_id=task_id)
+
+
+def claim_candidate(candidate, worker_id):
+    """
+    Claim a scheduler candidate unless another worker holds its row lock.
+    Returns the claimed task or unit, or None.
+    """
+    model = TaskWorkUnit if candidate.kind == UNIT else ProcessingTask
+    claim = claim_unit if candidate.kind == UNIT else claim_task
+    with db_transaction.atomic():
+        locked = (
+            model.objects.select_for_update(skip_locked=True)
+            .filter(pk=candidate.id, status="pending")
+            .values_list("pk", flat=True)
+            .first()
+        )
+        if locked is None:
+            return None
+        return claim(candidate.id, worker_id)
+
+
+def claim_next_task(worker_id):
+    """Claim the best pending task (see profiles.scheduler), or return None."""
+    for candidate in next_candidates():
+        if candidate.kind == TASK:
+            task = claim_candidate(candidate, worker_id)
+            if task is not None:
+                return task
+    return None
+
+
+def reclaim_stale_tasks(timeout=None):
+    """
+    Return tasks whose worker stopped heartbeating to the queue (or fail them
+    once they have used up TASK_MAX_ATTEMPTS). Returns the number reclaimed.
+    """
+    timeout = timeout or get_heartbeat_timeout()
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    stale = ProcessingTask.objects.filter(
+        status="processing", worker_id__isnull=False, heartbeat_at__lt=cutoff
+    )
+    max_attempts = getattr(settings, "TASK_MAX_ATTEMPTS", 3)
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status="failed", worker_id=None
+    )
+    reclaimed = stale.filter(attempts__lt=max_attempts).update(
+        status="pending", worker_id=None, heartbeat_at=None
+    )
+    if failed or reclaimed:
+        logger.warning(
+            f"Reclaimed {reclaimed} stale tasks; failed {failed} after {max_attempts} attempts"
+        )
+    return reclaimed
+
+
+class Heartbeat:
+    """
+    Context manager stamping heartbeat_at on ``rows`` (a queryset selecting
+    the claimed row) every interval from a side thread.
+    """
+
+    def __init__(self, rows, interval=None):
+        self.rows = rows
+        self.interval = interval or get_heartbeat_interval()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="heartbeat", daemon=True)
+
+    def _run(self):
+        try:
+            while not self._stop.wait(self.interval):
+                self.rows.update(heartbeat_at=timezone.now())
+        except Exception as e:
+            logger.error(f"Heartbeat stopped: {e}")
+        finally:
+            connection.close()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+def task_heartbeat(task, worker_id):
+    return Heartbeat(
+        ProcessingTask.objects.filter(task_id=task.task_id, worker_id=worker_id)
+    )
+
+
+def run_claimed_task(task, worker_id, log=logger):
+    """Run a task claimed by ``worker_id``, recording failure on the task."""
+    log.info(f"[{worker_id}] Processing task {task.task_id}")
+    with task_heartbeat(task, worker_id):
+        try:
+            success_count, error_count = run_processing_task(task, log=log)
+            log.info(
+                f"[{worker_id}] Task {task.task_id} completed: "
+                f"{success_count} successful, {error_count} failed"
+            )
+        except Exception as e:
+            log.error(f"[{worker_id}] Task {task.task_id} failed: {e}")
+            ProcessingTask.objects.filter(task_id=task.task_id).update(
+                status="failed", error_details={"error": str(e)}
+            )
+
+
+def get_chunk_size(task):
+    """Transactions per work unit (task_metadata["chunk_size"] or TASK_CHUNK_SIZE; 0 disables)."""
+    return int(
+        task.task_metadata.get("chunk_size") or getattr(settings, "TASK_CHUNK_SIZE", 0)
+    )
+
+
+def should_split(task):
+    chunk_size = get_chunk_size(task)
+    return (
+        chunk_size > 0
+        # One Batch API submission per task is the point of that mode
+        and task.task_metadata.get("execution_mode") != EXECUTION_MODE_BATCH_API
+        # A resumed task finishes the way it started
+        and not task.task_metadata.get("cursor")
+        and task.transactions.count() > chunk_size
+    )
+
+
+def split_task(task):
+    """
+    Replace a claimed task's work with TaskWorkUnits of about chunk_size
+    transactions (payee lookups keep each vendor in one unit, so vendor
+    memoization still applies) and release the task row to the units.
+    """
+    chunk_size = get_chunk_size(task)
+    # A retried task only re-splits the rows that haven't succeeded
+    done = done_states(task.task_id)
+    done_count = done.count()
+    transactions = list(
+        task.transactions.exclude(id__in=done.values("transaction_id"))
+        .only("id", "description")
+        .order_by("id")
+    )
+    if done_count:
+        record_skipped(task.task_metadata, done_count)
+    if task.task_type == "payee_lookup":
+        groups = group_by_vendor(transactions).values()
+    else:
+        groups = ([transaction] for transaction in transactions)
+    chunks, current = [], []
+    for members in groups:
+        if current and len(current) + len(members) > chunk_size:
+            chunks.append(current)
+            current = []
+        current.extend(transaction.id for transaction in members)
+    if current:
+        chunks.append(current)
+
+    task.task_metadata["work_units"] = {"count": len(chunks), "chunk_size": chunk_size}
+    with db_transaction.atomic():
+        # A retried task is re-split from scratch
+        TaskWorkUnit.objects.filter(task=task).delete()
+        TaskWorkUnit.objects.bulk_create(
+            TaskWorkUnit(task=task, index=index, transaction_ids=ids)
+            for index, ids in enumerate(chunks)
+        )
+        task.worker_id = None
+        task.heartbeat_at = None
+        task.processed_count = done_count
+        task.error_count = 0
+        task.error_details = {}
+        task.save(
+            update_fields=[
+                "worker_id",
+                "heartbeat_at",
+                "processed_count",
+                "error_count",
+                "error_details",
+                "task_metadata",
+                "updated_at",
+            ]
+        )
+    logger.info(f"Split task {task.task_id} into {len(chunks)} work units")
+    return len(chunks)
+
+
+def claim_unit(unit_id, worker_id):
+    """
+    Atomically move one pending work unit to processing for ``worker_id``.
+    Returns the claimed unit, or None if someone else got it first.
+    """
+    claimed = TaskWorkUnit.objects.filter(id=unit_id, status="pending").update(
+        status="processing",
+        worker_id=worker_id,
+        heartbeat_at=timezone.now(),
+        attempts=F("attempts") + 1,
+    )
+    if not claimed:
+        return None
+    return TaskWorkUnit.objects.select_related("task").get(id=unit_id)
+
+
+def claim_next_unit(worker_id):
+    """Claim the best pending work unit of a running task, or return None."""
+    for candidate in next_candidates():
+        if candidate.kind == UNIT:
+            unit = claim_candidate(candidate, worker_id)
+            if unit is not None:
+                return unit
+    return None
+
+
+class UnitProgress(BufferedProgress):
+    """
+    Progress sink for one work unit (see task_runner.TaskProgress): buffered
+    counts go onto the unit and, atomically via F(), onto the parent task.
+    """
+
+    def __init__(self, unit, **kwargs):
+        super().__init__(unit.metrics, **kwargs)
+        self.unit = unit
+        self.task_id = unit.task_id
+        self.error_details = unit.error_details
+
+    def _write(self, processed, errors):
+        now = timezone.now()
+        with db_transaction.atomic():
+            ProcessingTask.objects.filter(task_id=self.unit.task_id).update(
+                processed_count=F("processed_count") + processed,
+                error_count=F("error_count") + errors,
+                updated_at=now,
+            )
+            TaskWorkUnit.objects.filter(id=self.unit.id).update(
+                processed_count=F("processed_count") + processed,
+                error_count=F("error_count") + errors,
+                updated_at=now,
+            )
+
+    def finish(self):
+        self.flush()
+        self.unit.status = "failed" if self.unit.error_details else "completed"
+        self.unit.save(
+            update_fields=["status", "error_details", "metrics", "updated_at"]
+        )
+        finalize_task(self.unit.task_id)
+
+    def interrupt(self, control):
+        """
+        Stop after a pause or cancel. A paused unit keeps the rows it finished
+        and its undone rows move to a new pending unit, picked up once the
+        task is resumed.
+        """
+        self.flush()
+        unit = self.unit
+        remaining = [i for i in unit.transaction_ids if i not in self.done_ids]
+        update_fields = ["status", "error_details", "metrics", "updated_at"]
+        if control == CONTROL_PAUSE and remaining:
+            with db_transaction.atomic():
+                # Lock the task row so concurrent pauses pick distinct indexes
+                ProcessingTask.objects.select_for_update().get(task_id=unit.task_id)
+                next_index = (
+                    TaskWorkUnit.objects.filter(task_id=unit.task_id)
+                    .order_by("-index")
+                    .values_list("index", flat=True)
+                    .first()
+                    + 1
+                )
+                TaskWorkUnit.objects.create(
+                    task_id=unit.task_id, index=next_index, transaction_ids=remaining
+                )
+                unit.transaction_ids = [
+                    i for i in unit.transaction_ids if i in self.done_ids
+                ]
+                unit.status = "failed" if unit.error_details else "completed"
+                unit.save(update_fields=update_fields + ["transaction_ids"])
+            return
+        unit.status = "failed" if control == CONTROL_CANCEL else "completed"
+        unit.save(update_fields=update_fields)
+
+
+def _merge_metrics(target, source):
+    """Sum numeric leaves of ``source`` into ``target`` (nested dicts merged)."""
+    for key, value in source.items():
+        if isinstance(value, dict):
+            _merge_metrics(target.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            target[key] = target.get(key, 0) + value
+        else:
+            target.setdefault(key, value)
+    return target
+
+
+def finalize_task(task_id):
+    """Set the task's final status once all of its work units are done."""
+    with db_transaction.atomic():
+        task = ProcessingTask.objects.select_for_update().get(task_id=task_id)
+        units = task.work_units.all()
+        if (
+            task.status != "processing"
+            or units.exclude(status__in=("completed", "failed")).exists()
+        ):
+            return False
+        error_details, metrics = {}, {}
+        for unit_errors, unit_metrics in units.values_list("error_details", "metrics"):
+            error_details.update(unit_errors)
+            _merge_metrics(metrics, unit_metrics)
+        if "telemetry_raw" in metrics:
+            # Summed summaries are meaningless; rebuild from the merged counts
+            # over the task's wall time (units ran in parallel)
+            metrics["telemetry"] = telemetry.summarize(
+                metrics["telemetry_raw"],
+                wall_seconds=(
+                    (timezone.now() - task.started_at).total_seconds()
+                    if task.started_at
+                    else None
+                ),
+            )
+            task.task_metadata["telemetry"] = metrics["telemetry"]
+        task.refresh_from_db(fields=["processed_count"])
+        task.error_details = error_details
+        task.error_count = len(error_details)
+        task.task_metadata.setdefault("work_units", {})["metrics"] = metrics
+        task.status = "failed" if error_details else "completed"
+        task.save(
+            update_fields=[
+                "status",
+                "error_details",
+                "error_count",
+                "task_metadata",
+                "updated_at",
+            ]
+        )
+    logger.info(f"Task {task_id} finished across {units.count()} work units")
+    return True
+
+
+def run_work_unit(unit, worker_id, log=logger):
+    """Process one claimed work unit and report its counts to the parent task."""
+    log.info(f"[{worker_id}] Processing unit {unit.index} of task {unit.task_id}")
+    progress = UnitProgress(unit)
+    error = "Transaction no longer exists"
+    with Heartbeat(TaskWorkUnit.objects.filter(id=unit.id, worker_id=worker_id)):
+        try:
+            # Rows a previous attempt finished count again without an agent call
+            done_ids = set(
+                done_states(unit.task_id)
+                .filter(transaction_id__in=unit.transaction_ids)
+                .values_list("transaction_id", flat=True)
+            )
+            if done_ids:
+                progress.record(sorted(done_ids))
+                record_skipped(progress.metadata, len(done_ids))
+            transactions = list(
+                Transaction.objects.filter(id__in=unit.transaction_ids).exclude(
+                    id__in=done_ids
+                )
+            )
+            process_task_transactions(unit.task, transactions, progress, log=log)
+        except TaskInterrupted as interrupted:
+            log.info(f"[{worker_id}] Unit {unit.index} of task {unit.task_id} stopped")
+            progress.interrupt(interrupted.control)
+            return
+        except Exception as e:
+            log.error(
+                f"[{worker_id}] Unit {unit.index} of task {unit.task_id} failed: {e}"
+            )
+            error = e
+    missing = [i for i in unit.transaction_ids if i not in progress.done_ids]
+    if missing:
+        progress.record([], {i: error for i in missing})
+    progress.finish()
+
+
+def pause_task(task):
+    """
+    Pause a task. A pending task is parked right away; a running one is asked
+    to stop (ProcessingTask.control) and its worker parks it within one
+    check interval, saving a cursor so the resumed run skips finished rows.
+    Returns False if the task can't be paused.
+    """
+    if task.status == "pending":
+        return bool(
+            ProcessingTask.objects.filter(
+                task_id=task.task_id, status="pending"
+            ).update(status="paused")
+        )
+    if task.status != "processing":
+        return False
+    changes = {"control": CONTROL_PAUSE}
+    if task.work_units.exists():
+        # Split tasks: units stop claiming at once, running units stop soon
+        changes["status"] = "paused"
+    ProcessingTask.objects.filter(task_id=task.task_id).update(**changes)
+    return True
+
+
+def resume_task(task):
+    """
+    Resume a paused task: split tasks go back to their remaining work units,
+    others back to the queue (continuing from their cursor). Returns False if
+    the task isn't paused.
+    """
+    if task.status == "processing" and task.control == CONTROL_PAUSE:
+        # Pause requested but not reached yet
+        ProcessingTask.objects.filter(task_id=task.task_id).update(control="")
+        return True
+    if task.status != "paused":
+        return False
+    if task.work_units.exists():
+        ProcessingTask.objects.filter(task_id=task.task_id).update(
+            status="processing", control=""
+        )
+        # Every unit may have finished while the task was paused
+        finalize_task(task.task_id)
+    else:
+        ProcessingTask.objects.filter(task_id=task.task_id).update(
+            status="pending", control="", worker_id=None, attempts=0
+        )
+    return True
+
+
+def cancel_task(task):
+    """
+    Cancel a task: mark it failed and, if it's running, tell its workers to
+    stop before their next agent call. Returns False if it already finished.
+    """
+    if task.status not in ("pending", "processing", "paused"):
+        return False
+    ProcessingTask.objects.filter(task_id=task.task_id).update(
+        status="failed",
+        control=CONTROL_CANCEL if task.status == "processing" else "",
+        error_details={"cancelled": True, "cancelled_at": str(timezone.now())},
+    )
+    task.work_units.filter(status="pending").update(status="failed")
+    return True
+
+
+def reclaim_stale_units(timeout=None):
+    """
+    Return units whose worker stopped heartbeating to the queue, first
+    taking back the partial counts they added to their task. Units out of
+    attempts fail with every transaction marked as an error.
+    """
+    timeout = timeout or get_heartbeat_timeout()
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    max_attempts = getattr(settings, "TASK_MAX_ATTEMPTS", 3)
+    reclaimed, finished_tasks = 0, set()
+    with db_transaction.atomic():
+        stale = TaskWorkUnit.objects.select_for_update(skip_locked=True).filter(
+            status="processing", heartbeat_at__lt=cutoff
+        )
+        for unit in stale:
+            processed = errors = 0
+            unit.worker_id = None
+            unit.heartbeat_at = None
+            if unit.attempts >= max_attempts:
+                message = f"Work unit abandoned after {unit.attempts} attempts"
+                unit.error_details = {str(i): message for i in unit.transaction_ids}
+                unit.status = "failed"
+                processed = errors = len(unit.transaction_ids)
+                finished_tasks.add(unit.task_id)
+            else:
+                unit.error_details = {}
+                unit.status = "pending"
+                reclaimed += 1
+            ProcessingTask.objects.filter(task_id=unit.task_id).update(
+                processed_count=F("processed_count") - unit.processed_count + processed,
+                error_count=F("error_count") - unit.error_count + errors,
+            )
+            unit.processed_count = processed
+            unit.error_count = errors
+            unit.save()
+    for task_id in finished_tasks:
+        finalize_task(task_id)
+    if reclaimed or finished_tasks:
+        logger.warning(f"Reclaimed {reclaimed} stale work units")
+    return reclaimed
+
+
+def work_once(worker_id, log=logger):
+    """
+    Do one piece of work: a pending statement upload (IngestionJob), whose
+    transactions later tasks may need, or else the best pending task or work
+    unit according to profiles.scheduler (a newly claimed large task is
+    split into units). Returns False when the queue is empty.
+    """
+    from .ingestion_queue import run_next_ingestion_job
+
+    if run_next_ingestion_job(worker_id, log=log):
+        return True
+    for candidate in next_candidates():
+        claimed = claim_candidate(candidate, worker_id)
+        if claimed is None:
+            continue
+        if candidate.kind == UNIT:
+            run_work_unit(claimed, worker_id, log=log)
+            return True
+        task = claimed
+        if should_split(task):
+            split_task(task)
+        else:
+            run_claimed_task(task, worker_id, log=log)
+        return True
+    return False
+
+
+def run_worker(worker_id, stop_event=None, poll_interval=None, log=logger):
+    """
+    Claim and run work until ``stop_event`` is set. Work in progress is
+    finished before the worker exits.
+    """
+    stop_event = stop_event or threading.Event()
+    poll_interval = poll_interval or getattr(settings, "TASK_POLL_INTERVAL", 2)
+    reclaim_every = get_heartbeat_interval()
+    last_reclaim = 0.0
+    from .ingestion_queue import reclaim_stale_jobs
+
+    log.info(f"[{worker_id}] Worker started")
+    while not stop_event.is_set():
+        close_old_connections()
+        try:
+            if time.monotonic() - last_reclaim >= reclaim_every:
+                reclaim_stale_tasks()
+                reclaim_stale_units()
+                reclaim_stale_jobs()
+                last_reclaim = time.monotonic()
+            worked = work_once(worker_id, log=log)
+        except Exception as e:
+            log.error(f"[{worker_id}] Worker loop error: {e}")
+            worked = False
+        if not worked:
+            stop_event.wait(poll_interval)
+    log.info(f"[{worker_id}] Worker stopped")
@@ -0,0 +1,434 @@
+"""
+Shared ProcessingTask execution used by the task workers and the
+process_task and process_pending_tasks management commands.
+"""
+
+import logging
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+from . import telemetry
+from .agent_runner import run_agent_concurrently
+from .agents import CLASSIFICATION_AGENT, PAYEE_LOOKUP_AGENT
+from .batch_api import EXECUTION_MODE_BATCH_API, run_batch_api_task
+from .batch_prompting import get_classification_batch_size, run_classification_batches
+from .learned_classifier import ML_METHOD, classify_locally
+from .models import Agent, ProcessingTask, TaskTransactionState, Transaction
+from .normalization import canonicalize_description
+from .result_writer import ResultWriter
+
+logger = logging.getLogger(__name__)
+
+# ProcessingTask.control values, checked by running workers between results
+CONTROL_PAUSE = "pause"
+CONTROL_CANCEL = "cancel"
+
+
+def get_task_agent(task):
+    """Return the Agent that handles a task's task_type."""
+    if task.task_type == "payee_lookup":
+        return Agent.objects.get(name=PAYEE_LOOKUP_AGENT)
+    return Agent.objects.get(name=CLASSIFICATION_AGENT)
+
+
+def get_task_agent_type(task):
+    return "payee" if task.task_type == "payee_lookup" else "classification"
+
+
+def group_by_vendor(transactions):
+    """
+    Group transactions by canonical merchant key (store numbers, dates, card
+    suffixes and POS prefixes stripped). Returns an ordered
+    {vendor_key: [transaction, ...]} mapping.
+    """
+    groups = OrderedDict()
+    for transaction in transactions:
+        key = canonicalize_description(transaction.description)
+        groups.setdefault(key, []).append(transaction)
+    return groups
+
+
+class BufferedProgress:
+    """
+    Base progress sink. Outcomes are counted in memory and the counters are
+    written with F() increments at most every PROGRESS_FLUSH_SECONDS (or
+    PROGRESS_FLUSH_ROWS rows) instead of re-saving the task per transaction.
+    Subclasses implement ``_write(processed, errors)``.
+    """
+
+    task_id = None
+
+    def __init__(self, metadata, flush_rows=None, flush_seconds=None):
+        self.metadata = metadata
+        self.success_count = 0
+        self.error_details = {}
+        self.done_ids = set()
+        self._pending_states = {}
+        self._last_control_check = 0.0
+        self.flush_rows = flush_rows or getattr(settings, "PROGRESS_FLUSH_ROWS", 100)
+        self.flush_seconds = (
+            flush_seconds
+            if flush_seconds is not None
+            else getattr(settings, "PROGRESS_FLUSH_SECONDS", 2.0)
+        )
+        self._pending_processed = 0
+        self._pending_errors = 0
+        self._last_flush = time.monotonic()
+
+    def record(self, succeeded_ids, errors=None):
+        """Count ``succeeded_ids`` and ``errors`` ({transaction_id: error})."""
+        errors = errors or {}
+        telemetry.record_rows(len(succeeded_ids) + len(errors))
+        self.done_ids.update(succeeded_ids)
+        self.done_ids.update(errors)
+        self._pending_states.update((i, None) for i in succeeded_ids)
+        self._pending_states.update(errors)
+        self.success_count += len(succeeded_ids)
+        self.error_details.update({str(i): str(e) for i, e in errors.items()})
+        self._pending_processed += len(succeeded_ids) + len(errors)
+        self._pending_errors += len(errors)
+        if (
+            self._pending_processed >= self.flush_rows
+            or time.monotonic() - self._last_flush >= self.flush_seconds
+        ):
+            self.flush()
+
+    def flush(self):
+        self._last_flush = time.monotonic()
+        if not self._pending_processed:
+            return
+        processed, errors = self._pending_processed, self._pending_errors
+        self._pending_processed = self._pending_errors = 0
+        states, self._pending_states = self._pending_states, {}
+        if self.task_id is not None:
+            save_transaction_states(self.task_id, states)
+        self._write(processed, errors)
+
+    def _write(self, processed, errors):
+        raise NotImplementedError
+
+    def check_control(self):
+        """
+        Raise TaskInterrupted if a pause or cancel was requested for the task
+        (ProcessingTask.control). Cheap to call per result: the row is read at
+        most every TASK_CONTROL_CHECK_SECONDS.
+        """
+        now = time.monotonic()
+        interval = getattr(settings, "TASK_CONTROL_CHECK_SECONDS", 2.0)
+        if self.task_id is None or now - self._last_control_check < interval:
+            return
+        self._last_control_check = now
+        control = (
+            ProcessingTask.objects.filter(task_id=self.task_id)
+            .values_list("control", flat=True)
+            .first()
+        )
+        if control:
+            self.flush()
+            raise TaskInterrupted(control)
+
+
+def save_transaction_states(task_id, states):
+    """
+    Upsert TaskTransactionState rows from {transaction_id: error or None}
+    (None meaning the row succeeded).
+    """
+    # Rows deleted mid-run are reported as errors but have nothing to point at
+    existing = set(
+        Transaction.objects.filter(id__in=list(states)).values_list("id", flat=True)
+    )
+    TaskTransactionState.objects.bulk_create(
+        [
+            TaskTransactionState(
+                task_id=task_id,
+                transaction_id=transaction_id,
+                status="done" if error is None else "failed",
+                error="" if error is None else str(error),
+            )
+            for transaction_id, error in states.items()
+            if transaction_id in existing
+        ],
+        update_conflicts=True,
+        unique_fields=["task", "transaction"],
+        update_fields=["status", "error", "updated_at"],
+    )
+
+
+def done_states(task_id):
+    """TaskTransactionState rows of the task's transactions that already succeeded."""
+    return TaskTransactionState.objects.filter(task_id=task_id, status="done")
+
+
+class TaskInterrupted(Exception):
+    """Raised between results when ProcessingTask.control asks to stop."""
+
+    def __init__(self, control):
+        super().__init__(f"Task {control} requested")
+        self.control = control
+
+
+def make_cursor(transaction_ids, done_ids):
+    """
+    Resumable position over a task's transactions: every id up to
+    ``after_id`` is done, plus the (few, since results arrive out of order)
+    ``done_ids`` above it.
+    """
+    after_id = 0
+    above = []
+    for transaction_id in sorted(transaction_ids):
+        if transaction_id not in done_ids:
+            above = sorted(i for i in done_ids if i > after_id)
+            break
+        after_id = transaction_id
+    return {"after_id": after_id, "done_ids": above}
+
+
+def remaining_transactions(queryset, cursor):
+    """The rows of ``queryset`` a task paused at ``cursor`` still has to do."""
+    if not cursor:
+        return queryset
+    return queryset.filter(id__gt=cursor["after_id"]).exclude(id__in=cursor["done_ids"])
+
+
+class TaskProgress(BufferedProgress):
+    """
+    Progress sink for a task run by a single process. error_details is only
+    written once, when the run finishes.
+    """
+
+    def __init__(self, task, resume=False, done_count=0, **kwargs):
+        super().__init__(task.task_metadata, **kwargs)
+        self.task = task
+        self.task_id = task.task_id
+        if resume:
+            # Continue the counts of the run that was paused
+            self.success_count = task.processed_count - task.error_count
+            self.error_details = dict(task.error_details)
+            return
+        # A retry starts from the rows that already succeeded
+        self.success_count = done_count
+        task.processed_count = done_count
+        task.error_count = 0
+        task.error_details = {}
+        task.save(
+            update_fields=[
+                "processed_count",
+                "error_count",
+                "error_details",
+                "updated_at",
+            ]
+        )
+
+    def _write(self, processed, errors):
+        ProcessingTask.objects.filter(task_id=self.task.task_id).update(
+            processed_count=F("processed_count") + processed,
+            error_count=F("error_count") + errors,
+            updated_at=timezone.now(),
+        )
+        self.task.processed_count += processed
+        self.task.error_count += errors
+
+    def finish(self):
+        """
+        Save the final status, unless a cancel arrived after the last control
+        check: cancel_task has already marked the task failed, so keep that.
+        """
+        self.flush()
+        self.task.task_metadata.pop("cursor", None)
+        rows = ProcessingTask.objects.filter(task_id=self.task_id)
+        finished = rows.exclude(control=CONTROL_CANCEL).update(
+            status="completed" if not self.error_details else "failed",
+            control="",
+            error_details=self.error_details,
+            task_metadata=self.task.task_metadata,
+            updated_at=timezone.now(),
+        )
+        if not finished:
+            rows.update(
+                control="",
+                task_metadata=self.task.task_metadata,
+                updated_at=timezone.now(),
+            )
+        self.task.refresh_from_db(
+            fields=["status", "control", "error_details", "updated_at"]
+        )
+        return self.success_count, len(self.error_details)
+
+    def interrupt(self, control):
+        """
+        Stop after a pause (save a cursor and park the task as "paused") or a
+        cancel (the admin action has already marked the task failed).
+        """
+        self.flush()
+        rows = ProcessingTask.objects.filter(task_id=self.task_id)
+        if control == CONTROL_PAUSE:
+            previous = self.task.task_metadata.get("cursor") or {
+                "after_id": 0,
+                "done_ids": [],
+            }
+            transaction_ids = list(self.task.transactions.values_list("id", flat=True))
+            done = self.done_ids.union(
+                previous["done_ids"],
+                (i for i in transaction_ids if i <= previous["after_id"]),
+            )
+            self.task.task_metadata["cursor"] = make_cursor(transaction_ids, done)
+            rows.update(
+                status="paused",
+                control="",
+                worker_id=None,
+                error_details=self.error_details,
+                task_metadata=self.task.task_metadata,
+                updated_at=timezone.now(),
+            )
+        else:
+            rows.update(control="", worker_id=None, updated_at=timezone.now())
+        return self.success_count, len(self.error_details)
+
+
+def run_processing_task(task, log=logger):
+    """
+    Run the task's agent over every transaction in the task's M2M set and
+    record progress on the task. Returns (success_count, error_count).
+    """
+    # Use the M2M field for robust, future-proof processing
+    cursor = task.task_metadata.get("cursor")
+    done = done_states(task.task_id)
+    done_count = done.count()
+    transactions = list(
+        remaining_transactions(task.transactions.all(), cursor).exclude(
+            id__in=done.values("transaction_id")
+        )
+    )
+    if cursor:
+        log.info(f"Resuming task {task.task_id}: {len(transactions)} transactions left")
+    elif done_count:
+        record_skipped(task.task_metadata, done_count)
+        log.info(
+            f"Retrying task {task.task_id}: skipping {done_count} transactions "
+            f"that already succeeded"
+        )
+    progress = TaskProgress(task, resume=bool(cursor), done_count=done_count)
+    try:
+        process_task_transactions(task, transactions, progress, log=log)
+    except TaskInterrupted as interrupted:
+        log.info(f"Task {task.task_id} stopped: {interrupted}")
+        return progress.interrupt(interrupted.control)
+    except Exception:
+        # Keep the counts of rows already written
+        progress.flush()
+        raise
+    return progress.finish()
+
+
+def record_skipped(metadata, count):
+    """
+    Note in task metadata how many already-done rows a retry skipped, i.e.
+    agent calls saved (one per row; payee lookups memoized by vendor would
+    have made somewhat fewer).
+    """
+    retry = metadata.setdefault("retry", {})
+    retry["skipped_transactions"] = retry.get("skipped_transactions", 0) + count
+    retry["agent_calls_saved"] = retry.get("agent_calls_saved", 0) + count
+
+
+def process_task_transactions(task, transactions, progress, log=logger):
+    """
+    Run the task's agent over ``transactions`` (all of the task or one work
+    unit of it), writing results to the transactions and outcomes to
+    ``progress`` (see TaskProgress).
+
+    Payee lookups are memoized per vendor: the agent is called once for each
+    distinct merchant and the result is fanned out to every transaction in
+    that group. Results are written in bulk through a ResultWriter.
+    Classification tasks can pack several transactions into one request (see
+    profiles.batch_prompting), and tasks with execution_mode "batch_api" are
+    submitted offline (profiles.batch_api).
+    Classification tasks first run profiles.rule_engine and the learned
+    classifier, so rows they can decide never reach the LLM in any mode.
+    Raises TaskInterrupted (after writing the results received so far) when
+    the task is paused or cancelled. Stage timings, tokens and throughput are
+    added to the run's metadata["telemetry"] (see profiles.telemetry).
+    """
+    with telemetry.collect() as collector:
+        try:
+            _process_task_transactions(task, transactions, progress, log)
+        finally:
+            telemetry.store(progress.metadata, collector, task.task_type)
+
+
+def _process_task_transactions(task, transactions, progress, log):
+    agent = get_task_agent(task)
+    agent_type = get_task_agent_type(task)
+    metadata = progress.metadata
+    progress.check_control()
+
+    if task.task_type == "classification":
+        # Deterministic rules and the learned classifier first; only rows
+        # neither can decide reach the LLM
+        with telemetry.stage("local_classify"):
+            matched, transactions = classify_locally(transactions)
+        with ResultWriter(progress) as writer:
+            for transaction, update_fields, _ in matched:
+                writer.add([transaction], update_fields)
+        rule_names = Counter(name for _, _, name in matched if name != ML_METHOD)
+        metadata["rule_engine"] = {
+            "matched": sum(rule_names.values()),
+            "rules": dict(rule_names),
+        }
+        metadata["learned_classifier"] = {
+            "applied": len(matched) - sum(rule_names.values()),
+            "escalated": len(transactions),
+        }
+        log.info(
+            f"Classified {len(matched)} transactions locally; {len(transactions)} go to the agent"
+        )
+    if task.task_type == "payee_lookup":
+        groups = list(group_by_vendor(transactions).values())
+        metadata["vendor_dedup"] = {
+            "transactions": len(transactions),
+            "distinct_vendors": len(groups),
+            "dedup_ratio": (
+                round(len(transactions) / len(groups), 2) if groups else 0.0
+            ),
+            "agent_calls_saved": len(transactions) - len(groups),
+        }
+        log.info(
+            f"Payee lookup: {len(transactions)} transactions across {len(groups)} distinct vendors"
+        )
+    else:
+        groups = [[transaction] for transaction in transactions]
+    if task.task_metadata.get("execution_mode") == EXECUTION_MODE_BATCH_API:
+        run_batch_api_task(task, agent, agent_type, groups, progress, log=log)
+        return
+    members_by_representative = {members[0].id: members for members in groups}
+
+    representatives = [members[0] for members in groups]
+    batch_size = get_classification_batch_size(task)
+    if task.task_type == "classification" and batch_size > 1:
+        # Pack several transactions per request; metrics fill in as batches complete
+        batching_metrics = {}
+        metadata.setdefault("metrics", {})["classification_batching"] = batching_metrics
+        results = run_classification_batches(
+            agent, representatives, batch_size, metrics=batching_metrics
+        )
+    else:
+        results = run_agent_concurrently(
+            agent, representatives, agent_type=agent_type, use_rules=False
+        )
+    with ResultWriter(progress) as writer:
+        for result in results:
+            progress.check_control()
+            members = members_by_representative[result.transaction.id]
+            if result.error is None:
+                writer.add(members, result.update_fields)
+                continue
+            member_ids = [transaction.id for transaction in members]
+            for transaction_id in member_ids:
+                log.error(
+                    f"Error processing transaction {transaction_id}: {str(result.error)}"
+                )
+            progress.record([], {i: result.error for i in member_ids})
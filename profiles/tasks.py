@@ -0,0 +1,159 @@
+"""
+Celery execution path for ProcessingTasks (TASK_BACKEND = "celery").
+
+enqueue_processing_task() sends a task to the Celery queue for its task_type
+(CELERY_TASK_TYPE_QUEUES), so payee lookups and classifications can be
+served by separately sized worker pools. The Celery task claims the
+ProcessingTask with the same compare-and-set as the run_workers queue
+(profiles.task_queue), so both execution paths can share one database.
+Large tasks are split into TaskWorkUnits and every unit becomes its own
+Celery task; the last unit to finish aggregates counts, errors and metrics
+back into the ProcessingTask (task_queue.finalize_task). Batch statement
+uploads (IngestionJobs) go to the "ingestion" queue the same way.
+"""
+
+import logging
+
+from celery import shared_task
+from django.conf import settings
+
+from .ingestion_queue import claim_job, reclaim_stale_jobs, run_ingestion_job
+from .models import IngestionJob, ProcessingTask, TaskWorkUnit
+from .task_queue import (
+    claim_task,
+    claim_unit,
+    reclaim_stale_tasks,
+    reclaim_stale_units,
+    run_claimed_task,
+    run_work_unit,
+    should_split,
+    split_task,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def get_queue_name(task_type):
+    """Celery queue for a ProcessingTask.task_type."""
+    queues = getattr(settings, "CELERY_TASK_TYPE_QUEUES", {})
+    return queues.get(
+        task_type, getattr(settings, "CELERY_TASK_DEFAULT_QUEUE", "celery")
+    )
+
+
+def celery_worker_id(request):
+    return f"celery:{request.hostname}:{request.id}"
+
+
+def enqueue_processing_task(task):
+    """Send a pending ProcessingTask to its Celery queue."""
+    queue = get_queue_name(task.task_type)
+    result = process_processing_task.apply_async(args=[str(task.task_id)], queue=queue)
+    logger.info(f"Enqueued task {task.task_id} on {queue} as {result.id}")
+    return result
+
+
+def enqueue_work_units(task):
+    """Send every pending work unit of ``task`` to its Celery queue."""
+    queue = get_queue_name(task.task_type)
+    unit_ids = list(
+        task.work_units.filter(status="pending")
+        .order_by("index")
+        .values_list("id", flat=True)
+    )
+    for unit_id in unit_ids:
+        process_work_unit.apply_async(args=[unit_id], queue=queue)
+    return len(unit_ids)
+
+
+def enqueue_ingestion_job(job):
+    """Send a pending IngestionJob to Celery (queue "ingestion" in CELERY_TASK_TYPE_QUEUES)."""
+    queue = get_queue_name("ingestion")
+    result = process_ingestion_job.apply_async(args=[str(job.job_id)], queue=queue)
+    logger.info(f"Enqueued ingestion job {job.job_id} on {queue} as {result.id}")
+    return result
+
+
+def task_summary(task_id):
+    return ProcessingTask.objects.filter(task_id=task_id).values(
+        "status", "processed_count", "error_count"
+    )[0]
+
+
+@shared_task(bind=True, name="profiles.process_processing_task")
+def process_processing_task(self, task_id):
+    """
+    Claim and run one ProcessingTask, or split it and fan its work units
+    out. Returns the task's counts (or {"claimed": False} if another worker
+    already had it).
+    """
+    worker_id = celery_worker_id(self.request)
+    task = claim_task(task_id, worker_id)
+    if task is None:
+        logger.info(f"Task {task_id} was already claimed; skipping")
+        return {"task_id": task_id, "claimed": False}
+    if should_split(task):
+        split_task(task)
+        return {"task_id": task_id, "work_units": enqueue_work_units(task)}
+    run_claimed_task(task, worker_id)
+    return {"task_id": task_id, **task_summary(task_id)}
+
+
+@shared_task(bind=True, name="profiles.process_work_unit")
+def process_work_unit(self, unit_id):
+    """Claim and run one TaskWorkUnit; returns the unit's counts."""
+    worker_id = celery_worker_id(self.request)
+    unit = claim_unit(unit_id, worker_id)
+    if unit is None:
+        return {"unit_id": unit_id, "claimed": False}
+    run_work_unit(unit, worker_id)
+    summary = TaskWorkUnit.objects.filter(id=unit_id).values(
+        "status", "processed_count", "error_count"
+    )[0]
+    return {"unit_id": unit_id, "task_id": str(unit.task_id), **summary}
+
+
+@shared_task(bind=True, name="profiles.process_ingestion_job")
+def process_ingestion_job(self, job_id):
+    """Claim and run one IngestionJob (batch statement upload)."""
+    worker_id = celery_worker_id(self.request)
+    job = claim_job(job_id, worker_id)
+    if job is None:
+        return {"job_id": job_id, "claimed": False}
+    run_ingestion_job(job, worker_id)
+    summary = IngestionJob.objects.filter(job_id=job_id).values(
+        "status", "file_count", "processed_count"
+    )[0]
+    return {"job_id": job_id, **summary}
+
+
+@shared_task(name="profiles.requeue_stale_work")
+def requeue_stale_work():
+    """
+    Periodic (CELERY_BEAT_SCHEDULE): put work whose worker died back on the
+    queue. Messages are acked late, but a killed task whose row is still
+    "processing" can only be picked up again once its heartbeat is stale.
+    """
+    reclaimed_tasks = reclaim_stale_tasks()
+    reclaimed_units = reclaim_stale_units()
+    reclaimed_jobs = reclaim_stale_jobs()
+    if reclaimed_tasks:
+        for task in ProcessingTask.objects.filter(
+            status="pending", attempts__gt=0, worker_id__isnull=True
+        ):
+            enqueue_processing_task(task)
+    if reclaimed_units:
+        for task in ProcessingTask.objects.filter(
+            status="processing", work_units__status="pending"
+        ).distinct():
+            enqueue_work_units(task)
+    if reclaimed_jobs:
+        for job in IngestionJob.objects.filter(
+            status="pending", attempts__gt=0, worker_id__isnull=True
+        ):
+            enqueue_ingestion_job(job)
+    return {
+        "tasks": reclaimed_tasks,
+        "units": reclaimed_units,
+        "jobs": reclaimed_jobs,
+    }
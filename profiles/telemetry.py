@@ -0,0 +1,367 @@
+"""
+Per-stage execution telemetry for ProcessingTasks.
+
+The agent pipeline times its stages with ``stage(name)`` / ``timed(name, fn)``:
+
+- local_classify: rule engine and learned classifier
+- prompt_build: rendering an agent's prompts
+- llm_call: one chat completion (rate limiter waits excluded)
+- tool_call: one tool invocation
+- agent_call: one transaction end to end through call_agent
+- db_write: one bulk write of results
+
+Observations go to the Telemetry collector of the task being run (a context
+variable, carried into worker threads with ``propagate``). Each stage keeps a
+log-scaled latency histogram (buckets 25% wide), so collectors of work units
+merge by adding counts and p50/p95/p99 are derived afterwards. When a run
+finishes its summary lands in task_metadata["telemetry"] and its counts are
+added to shared counters in the cache, which ``render_metrics`` exposes in the
+Prometheus text format on /metrics.
+"""
+
+import contextvars
+import logging
+import math
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+STAGES = (
+    "local_classify",
+    "prompt_build",
+    "llm_call",
+    "tool_call",
+    "agent_call",
+    "db_write",
+)
+# Prometheus histogram buckets (seconds)
+EXPORT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BUCKET_GROWTH = 1.25
+METRICS_PREFIX = "metrics"
+
+_current = contextvars.ContextVar("task_telemetry", default=None)
+
+
+def bucket_index(seconds):
+    """Index of the log-scaled bucket holding ``seconds`` (bucket 0: <= 1ms)."""
+    ms = seconds * 1000
+    if ms <= 1:
+        return 0
+    return math.ceil(math.log(ms, BUCKET_GROWTH))
+
+
+def bucket_upper_seconds(index):
+    return BUCKET_GROWTH**index / 1000
+
+
+class Telemetry:
+    """Thread-safe collector of one run's stage timings and counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.stages = {}
+        self.tokens = Counter()
+        self.tool_calls = Counter()
+        self.rows = 0
+
+    def observe(self, stage_name, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(
+                stage_name, {"count": 0, "total_ms": 0, "hist": Counter()}
+            )
+            entry["count"] += 1
+            entry["total_ms"] += round(seconds * 1000)
+            entry["hist"][str(bucket_index(seconds))] += 1
+
+    def add_tokens(self, prompt=0, completion=0):
+        with self._lock:
+            self.tokens["prompt"] += prompt or 0
+            self.tokens["completion"] += completion or 0
+
+    def count_tool(self, name):
+        with self._lock:
+            self.tool_calls[name] += 1
+
+    def add_rows(self, count):
+        with self._lock:
+            self.rows += count
+
+    def raw(self):
+        """Mergeable counts (everything is a sum; see merge_raw)."""
+        with self._lock:
+            return {
+                "stages": {
+                    name: {
+                        "count": entry["count"],
+                        "total_ms": entry["total_ms"],
+                        "hist": dict(entry["hist"]),
+                    }
+                    for name, entry in self.stages.items()
+                },
+                "tokens": dict(self.tokens),
+                "tool_calls": dict(self.tool_calls),
+                "rows": self.rows,
+                "elapsed_seconds": round(time.monotonic() - self.started, 3),
+            }
+
+
+def merge_raw(target, source):
+    """Add the counts of raw telemetry ``source`` into ``target``."""
+    for key, value in source.items():
+        if isinstance(value, dict):
+            merge_raw(target.setdefault(key, {}), value)
+        else:
+            target[key] = target.get(key, 0) + value
+    return target
+
+
+def percentile(hist, q):
+    """Upper bound (seconds) of the bucket holding the q-th quantile."""
+    total = sum(hist.values())
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for index in sorted(hist, key=int):
+        seen += hist[index]
+        if seen >= rank:
+            return round(bucket_upper_seconds(int(index)), 4)
+    return None
+
+
+def summarize(raw, wall_seconds=None):
+    """
+    Per-stage count, mean and p50/p95/p99 seconds, token and tool totals
+    and throughput. ``wall_seconds`` overrides the run time used for
+    rows_per_second (work units of one task run in parallel).
+    """
+    stages = {}
+    for name, entry in raw.get("stages", {}).items():
+        count = entry.get("count", 0)
+        stages[name] = {
+            "count": count,
+            "total_seconds": round(entry.get("total_ms", 0) / 1000, 3),
+            "mean_seconds": (
+                round(entry.get("total_ms", 0) / 1000 / count, 4) if count else None
+            ),
+            "p50_seconds": percentile(entry.get("hist", {}), 0.5),
+            "p95_seconds": percentile(entry.get("hist", {}), 0.95),
+            "p99_seconds": percentile(entry.get("hist", {}), 0.99),
+        }
+    elapsed = wall_seconds or raw.get("elapsed_seconds") or 0
+    rows = raw.get("rows", 0)
+    return {
+        "stages": stages,
+        "tokens": {
+            "prompt": raw.get("tokens", {}).get("prompt", 0),
+            "completion": raw.get("tokens", {}).get("completion", 0),
+        },
+        "tool_calls": raw.get("tool_calls", {}),
+        "rows": rows,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(rows / elapsed, 2) if elapsed else None,
+    }
+
+
+def current():
+    return _current.get()
+
+
+@contextmanager
+def collect():
+    """Make a new Telemetry the current collector for the enclosed block."""
+    telemetry = Telemetry()
+    token = _current.set(telemetry)
+    try:
+        yield telemetry
+    finally:
+        _current.reset(token)
+
+
+def propagate(fn):
+    """Wrap ``fn`` to run with the caller's collector (for worker threads)."""
+    telemetry = _current.get()
+
+    def wrapper(*args, **kwargs):
+        token = _current.set(telemetry)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+
+    return wrapper
+
+
+@contextmanager
+def stage(name):
+    """Time the enclosed block as one observation of stage ``name``."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        telemetry = _current.get()
+        if telemetry is not None:
+            telemetry.observe(name, time.monotonic() - started)
+
+
+def timed(name, fn):
+    with stage(name):
+        return fn()
+
+
+def record_usage(usage):
+    """Add an OpenAI response's token usage to the current collector."""
+    telemetry = _current.get()
+    if telemetry is not None and usage is not None:
+        telemetry.add_tokens(
+            getattr(usage, "prompt_tokens", 0), getattr(usage, "completion_tokens", 0)
+        )
+
+
+def record_tool(name):
+    telemetry = _current.get()
+    if telemetry is not None:
+        telemetry.count_tool(name)
+
+
+def record_rows(count):
+    telemetry = _current.get()
+    if telemetry is not None:
+        telemetry.add_rows(count)
+
+
+def store(metadata, telemetry, task_type, wall_seconds=None):
+    """
+    Merge a finished run's counts into ``metadata`` (telemetry_raw plus the
+    telemetry summary) and into the shared /metrics counters.
+    """
+    raw = telemetry.raw()
+    merged = merge_raw(metadata.setdefault("telemetry_raw", {}), raw)
+    metadata["telemetry"] = summarize(merged, wall_seconds=wall_seconds)
+    try:
+        export(raw, task_type)
+    except Exception as e:
+        logger.warning(f"Could not export task telemetry: {e}")
+
+
+# Shared counters (Prometheus export)
+
+
+def _key(*parts):
+    return ":".join((METRICS_PREFIX,) + tuple(str(p) for p in parts))
+
+
+def _incr(key, amount):
+    if not amount:
+        return
+    cache.add(key, 0, timeout=None)
+    cache.incr(key, amount)
+
+
+def export(raw, task_type):
+    """Add one run's counts to the cache-backed counters read by render_metrics."""
+    for name, entry in raw["stages"].items():
+        buckets = Counter()
+        for index, count in entry["hist"].items():
+            upper = bucket_upper_seconds(int(index))
+            le = next((b for b in EXPORT_BUCKETS if upper <= b), "+Inf")
+            buckets[le] += count
+        for le, count in buckets.items():
+            _incr(_key("stage_bucket", task_type, name, le), count)
+        _incr(_key("stage_count", task_type, name), entry["count"])
+        _incr(_key("stage_ms", task_type, name), entry["total_ms"])
+    for direction, count in raw["tokens"].items():
+        _incr(_key("tokens", task_type, direction), count)
+    if raw["tool_calls"]:
+        tools = set(cache.get(_key("tools"), [])) | set(raw["tool_calls"])
+        cache.set(_key("tools"), sorted(tools), timeout=None)
+        for tool_name, count in raw["tool_calls"].items():
+            _incr(_key("tool_calls", tool_name), count)
+    _incr(_key("rows", task_type), raw["rows"])
+
+
+def render_metrics(task_types, gauges=()):
+    """
+    Prometheus text exposition of the shared counters. ``gauges`` are extra
+    (name, help, [(labels, value)]) families computed at scrape time.
+    """
+    tools = cache.get(_key("tools"), [])
+    keys = [_key("tool_calls", tool_name) for tool_name in tools]
+    for task_type in task_types:
+        keys.append(_key("rows", task_type))
+        keys += [_key("tokens", task_type, d) for d in ("prompt", "completion")]
+        for name in STAGES:
+            keys += [
+                _key("stage_count", task_type, name),
+                _key("stage_ms", task_type, name),
+            ]
+            keys += [
+                _key("stage_bucket", task_type, name, le)
+                for le in EXPORT_BUCKETS + ("+Inf",)
+            ]
+    values = cache.get_many(keys)
+
+    def value(*parts):
+        return values.get(_key(*parts), 0)
+
+    lines = [
+        "# HELP ledgerflow_stage_seconds Latency of agent pipeline stages",
+        "# TYPE ledgerflow_stage_seconds histogram",
+    ]
+    for task_type in task_types:
+        for name in STAGES:
+            count = value("stage_count", task_type, name)
+            if not count:
+                continue
+            labels = f'task_type="{task_type}",stage="{name}"'
+            cumulative = 0
+            for le in EXPORT_BUCKETS + ("+Inf",):
+                cumulative += value("stage_bucket", task_type, name, le)
+                lines.append(
+                    f'ledgerflow_stage_seconds_bucket{{{labels},le="{le}"}} {cumulative}'
+                )
+            lines.append(
+                f"ledgerflow_stage_seconds_sum{{{labels}}} "
+                f"{value('stage_ms', task_type, name) / 1000}"
+            )
+            lines.append(f"ledgerflow_stage_seconds_count{{{labels}}} {count}")
+    lines += [
+        "# HELP ledgerflow_llm_tokens_total LLM tokens used by processing tasks",
+        "# TYPE ledgerflow_llm_tokens_total counter",
+    ]
+    for task_type in task_types:
+        for direction in ("prompt", "completion"):
+            lines.append(
+                f'ledgerflow_llm_tokens_total{{task_type="{task_type}",'
+                f'direction="{direction}"}} {value("tokens", task_type, direction)}'
+            )
+    lines += [
+        "# HELP ledgerflow_tool_calls_total Agent tool invocations",
+        "# TYPE ledgerflow_tool_calls_total counter",
+    ]
+    for tool_name in tools:
+        lines.append(
+            f'ledgerflow_tool_calls_total{{tool="{tool_name}"}} '
+            f'{value("tool_calls", tool_name)}'
+        )
+    lines += [
+        "# HELP ledgerflow_task_rows_total Transactions processed by tasks",
+        "# TYPE ledgerflow_task_rows_total counter",
+    ]
+    for task_type in task_types:
+        lines.append(
+            f'ledgerflow_task_rows_total{{task_type="{task_type}"}} '
+            f'{value("rows", task_type)}'
+        )
+    for name, help_text, samples in gauges:
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for labels, sample in samples:
+            label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+            lines.append(f"{name}{{{label_text}}} {sample}")
+    return "\n".join(lines) + "\n"
@@ -1,3 +1,1027 @@
-from django.test import TestCase
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from datetime import date, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin as django_admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from ledgerflow.celery import app as celery_app
+
+from profiles.models import (
+    Agent,
+    BusinessProfile,
+    IngestionJob,
+    IngestionJobFile,
+    LLMConfig,
+    ProcessingTask,
+    StatementFile,
+    TaskTransactionState,
+    Tool,
+    Transaction,
+)
+from profiles.management.commands.process_batch import (
+    build_filter_query,
+    iter_keyset_batches,
+)
+from profiles import agent_registry, llm_cache, prompt_utils, telemetry
+from profiles.admin import (
+    IngestionJobFileInline,
+    apply_agent_results,
+    build_agent_prompts,
+)
+from profiles.agent_registry import get_compiled_agent
+from profiles.agent_runner import AgentResult, _build_result, run_agent_concurrently
+from profiles.batch_prompting import run_classification_batches
+from profiles.ingestion import HashingFile, ingest_transactions
+from profiles.ingestion_queue import (
+    claim_next_job,
+    create_ingestion_job,
+    job_progress,
+    save_job_file,
+)
+from profiles.learned_classifier import split_by_classifier, train_client
+from profiles.rate_limit import RateLimiter
+from profiles.scheduler import TASK, next_candidates, queue_stats
+from profiles.statement_parsing import ParseResult, parse_statement_files
+from profiles.result_writer import ResultWriter
+from profiles.task_queue import (
+    cancel_task,
+    claim_next_task,
+    claim_task,
+    pause_task,
+    reclaim_stale_tasks,
+    resume_task,
+    work_once,
+)
+from profiles.tasks import enqueue_processing_task
+from profiles.task_progress import tail_log
+from profiles.telemetry import Telemetry, merge_raw, summarize
+from profiles.task_runner import TaskProgress, make_cursor, run_processing_task
+
+LOCMEM_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+}
+
+
+def fake_payee_responder(body):
+    """Offline LocalBatchClient responder returning a canned payee lookup."""
+    user_prompt = body["messages"][-1]["content"]
+    # Match the transaction line only: the prompt's examples mention LOWE'S
+    description = re.search(r"^Transaction: (.*)$", user_prompt, re.M).group(1)
+    payee = "Lowe's" if "LOWE" in description else "Blue Bottle Coffee"
+    content = {
+        "payee": payee,
+        "normalized_description": "Purchase",
+        "confidence": "high",
+        "reasoning": "Matched from description",
+        "transaction_type": "purchase",
+    }
+    return {
+        "choices": [{"message": {"role": "assistant", "content": json.dumps(content)}}]
+    }
+
+
+def fake_parse_statement_file(path, parser_module=None):
+    """Stands in for the parsers in the process pool (picklable by name)."""
+    if path.endswith("bad.pdf"):
+        raise RuntimeError("parser crashed")
+    return ParseResult(parser=parser_module, output=os.getpid())
+
+
+class ProcessingTaskTestMixin:
+    def setUp(self):
+        self.client_profile = BusinessProfile.objects.create(
+            client_id="test-client", company_name="Test Co"
+        )
+        llm = LLMConfig.objects.create(provider="openai", model="test-model")
+        self.payee_agent = Agent.objects.create(
+            name="Payee Lookup Agent", purpose="Payee lookup", prompt="", llm=llm
+        )
+
+    def create_transaction(self, description, amount="-10.00"):
+        return Transaction.objects.create(
+            client=self.client_profile,
+            transaction_date=date(2024, 1, 15),
+            amount=Decimal(amount),
+            description=description,
+            payee_extraction_method="None",
+            classification_method="None",
+        )
+
+    def create_task(self, transactions, task_type="payee_lookup", **metadata):
+        task = ProcessingTask.objects.create(
+            task_type=task_type,
+            client=self.client_profile,
+            transaction_count=len(transactions),
+            task_metadata=metadata,
+        )
+        task.transactions.add(*transactions)
+        return task
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BatchApiExecutionTests(ProcessingTaskTestMixin, TestCase):
+    def test_batch_api_task_runs_offline_with_local_stand_in(self):
+        transactions = [
+            self.create_transaction("POS PURCHASE LOWE'S #1636 ALBUQUERQ NM"),
+            self.create_transaction("POS PURCHASE LOWE'S #0042 ALBUQUERQ NM"),
+            self.create_transaction("SQ *BLUE BOTTLE 06/14"),
+        ]
+        task = self.create_task(transactions, execution_mode="batch_api")
+
+        with tempfile.TemporaryDirectory() as batch_dir, override_settings(
+            LLM_BATCH_BACKEND="local",
+            LLM_BATCH_DIR=batch_dir,
+            LLM_BATCH_LOCAL_RESPONDER="profiles.tests.fake_payee_responder",
+        ):
+            success_count, error_count = run_processing_task(task)
+
+        self.assertEqual((success_count, error_count), (3, 0))
+        task.refresh_from_db()
+        self.assertEqual(task.status, "completed")
+        # Both Lowe's rows share one request
+        self.assertEqual(task.task_metadata["batch_api"]["request_count"], 2)
+        self.assertEqual(task.task_metadata["batch_api"]["fallback_count"], 0)
+        telemetry = task.task_metadata["telemetry"]
+        self.assertEqual(telemetry["rows"], 3)
+        self.assertIn("db_write", telemetry["stages"])
+        payees = set(
+            Transaction.objects.filter(client=self.client_profile).values_list(
+                "payee", flat=True
+            )
+        )
+        self.assertEqual(payees, {"Lowe's", "Blue Bottle Coffee"})
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class BatchPromptingTests(ProcessingTaskTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.agent = Agent.objects.create(
+            name="Classification Agent",
+            purpose="Classification",
+            prompt="Classify for {{ business_profile.company_name }}."
+            "---USER---{{ transaction.description }}",
+            llm=self.payee_agent.llm,
+        )
+
+    def test_invalid_items_fall_back_and_batches_stay_per_client(self):
+        transactions = [self.create_transaction(f"OFFICE DEPOT #{i}") for i in range(4)]
+        other = BusinessProfile.objects.create(client_id="other", company_name="Other")
+        foreign = self.create_transaction("STAPLES #9")
+        foreign.client = other
+        foreign.save()
+        requests = []
+
+        def fake_request(compiled, system_prompt, user_prompt):
+            requests.append((system_prompt, user_prompt))
+            ids = re.findall(r"transaction_id: (\d+)", user_prompt)
+            results = [
+                {
+                    "transaction_id": int(transaction_id),
+                    "classification_type": "business",
+                    "worksheet": "6A",
+                    "category_id": "Other",
+                    "confidence": "high",
+                }
+                for transaction_id in ids
+            ]
+            if len(results) == 4:
+                results[1]["confidence"] = "certain"  # invalid
+                results[2]["category_id"] = "BIZ-Snacks"  # not an allowed category
+                del results[3]  # missing
+            return {"results": results}, SimpleNamespace(
+                prompt_tokens=100, completion_tokens=20
+            )
+
+        def fake_fallback(agent, transactions, **kwargs):
+            for transaction in transactions:
+                telemetry.record_usage(
+                    SimpleNamespace(prompt_tokens=30, completion_tokens=10)
+                )
+                yield AgentResult(transaction, {"classification_method": "AI"}, None)
+
+        metrics = {}
+        with mock.patch(
+            "profiles.batch_prompting._request_batch", fake_request
+        ), mock.patch(
+            "profiles.batch_prompting.run_agent_concurrently", fake_fallback
+        ), telemetry.collect():
+            results = list(
+                run_classification_batches(
+                    self.agent, transactions + [foreign], 4, metrics=metrics
+                )
+            )
+
+        # One request per client: Agent.prompt's instructions, then the
+        # client's profile and allowed categories
+        requests.sort()
+        self.assertEqual(
+            [system.split("\n")[0] for system, _ in requests],
+            ["Classify for Other.", "Classify for Test Co."],
+        )
+        for system, user in requests:
+            self.assertIn("Allowed Categories", system)
+            self.assertIn("Other: Other Expenses", system)
+        self.assertIn("- Company: Test Co", requests[1][0])
+        self.assertIn("STAPLES", requests[0][1])
+        self.assertNotIn("OFFICE DEPOT", requests[0][1])
+        self.assertEqual(len(results), 5)
+        self.assertTrue(all(result.error is None for result in results))
+        self.assertEqual(
+            [result.transaction.id for result in results[-3:]],
+            [t.id for t in transactions[1:]],
+        )
+        self.assertEqual(metrics["batches"], 2)
+        self.assertEqual(metrics["batched_transactions"], 2)
+        self.assertEqual(metrics["fallback_transactions"], 3)
+        self.assertEqual(metrics["fallback_tokens"], 120)
+        # 240 batch + 120 fallback tokens over all 5 submitted rows
+        self.assertEqual(metrics["tokens_per_transaction"], 72.0)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LLMResponseCacheTests(ProcessingTaskTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        llm_cache.flush_stats()
+        cache.clear()
+        llm_cache.clear_local()
+        self.addCleanup(llm_cache.clear_local)
+
+    def test_repeat_vendor_hits_without_tool_usage(self):
+        agent = get_compiled_agent("Payee Lookup Agent")
+        first = self.create_transaction("POS PURCHASE LOWE'S #1636 ALBUQUERQ NM")
+        repeat = self.create_transaction("POS PURCHASE LOWE'S #0042 ALBUQUERQ NM")
+        key = llm_cache.build_cache_key(agent, agent.model, first)
+
+        self.assertIsNone(llm_cache.lookup(key))
+        llm_cache.store(
+            key,
+            {
+                "payee": "Lowe's",
+                "confidence": "high",
+                "_tool_usage": {"searxng_search": 2},
+            },
+        )
+        # Store numbers are canonicalized away: the repeat vendor shares the key
+        self.assertEqual(llm_cache.build_cache_key(agent, agent.model, repeat), key)
+        cached = llm_cache.lookup(key)
+
+        self.assertNotIn("_tool_usage", cached)
+        self.assertTrue(cached[llm_cache.HIT_MARKER])
+        result = _build_result(self.payee_agent, "payee", repeat, cached)
+        self.assertEqual(result.update_fields["payee"], "Lowe's")
+        self.assertEqual(result.update_fields["payee_extraction_method"], "AI (Cached)")
+        stats = llm_cache.get_stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+
+    @override_settings(
+        LLM_RESPONSE_CACHE_STATS_FLUSH_COUNT=3,
+        LLM_RESPONSE_CACHE_STATS_FLUSH_SECONDS=60,
+    )
+    def test_stats_are_flushed_to_the_shared_cache_in_batches(self):
+        llm_cache.store("llm_response:hot", {"payee": "Lowe's"})
+        llm_cache.lookup("llm_response:hot")
+        llm_cache.lookup("llm_response:cold")
+        self.assertIsNone(cache.get(llm_cache.STATS_HITS_KEY))
+
+        llm_cache.lookup("llm_response:hot")
+        self.assertEqual(
+            (
+                cache.get(llm_cache.STATS_HITS_KEY),
+                cache.get(llm_cache.STATS_MISSES_KEY),
+            ),
+            (2, 1),
+        )
+
+    def test_miss_keeps_the_calls_tool_usage(self):
+        response = {"payee": "Lowe's", "_tool_usage": {"searxng_search": 1}}
+        result = _build_result(
+            self.payee_agent, "payee", self.create_transaction("LOWE'S"), response
+        )
+        self.assertEqual(
+            result.update_fields["payee_extraction_method"], "AI + Searxng Search"
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PromptTemplateTests(ProcessingTaskTestMixin, TestCase):
+    def test_edited_prompt_takes_effect_and_replaces_the_old_source(self):
+        transaction = self.create_transaction("SQ *BLUE BOTTLE 06/14")
+        self.payee_agent.prompt = (
+            "Find the payee.---USER---{{ transaction.description }}"
+        )
+        self.payee_agent.save()
+        agent = get_compiled_agent("Payee Lookup Agent")
+        self.assertEqual(
+            build_agent_prompts(agent, transaction),
+            ("Find the payee.", "SQ *BLUE BOTTLE 06/14"),
+        )
+
+        self.payee_agent.prompt = "Name the merchant.---USER---{{ transaction.amount }}"
+        self.payee_agent.save()
+        agent = get_compiled_agent("Payee Lookup Agent")
+        self.assertEqual(
+            build_agent_prompts(agent, transaction), ("Name the merchant.", "-10.00")
+        )
+        sources = [
+            name
+            for name in prompt_utils._template_sources
+            if name.startswith(f"agent-{agent.id}-")
+        ]
+        self.assertEqual(sources, [f"agent-{agent.id}-{agent.prompt_hash}"])
+
+
+class AgentRunnerTests(ProcessingTaskTestMixin, TestCase):
+    def test_calls_run_in_parallel_and_errors_stay_per_transaction(self):
+        transactions = [self.create_transaction(f"VENDOR {i}") for i in range(5)]
+        transactions.append(self.create_transaction("BROKEN VENDOR"))
+        # Each group of 3 calls only proceeds once all 3 are in flight
+        barrier = threading.Barrier(3, timeout=5)
+        lock = threading.Lock()
+        in_flight = []
+        peak = []
+
+        def fake_call_agent(agent_name, transaction):
+            with lock:
+                in_flight.append(transaction.id)
+                peak.append(len(in_flight))
+            barrier.wait()
+            with lock:
+                in_flight.remove(transaction.id)
+            if transaction.description == "BROKEN VENDOR":
+                raise RuntimeError("LLM exploded")
+            return {"payee": transaction.description.title()}
+
+        with mock.patch("profiles.admin.call_agent", fake_call_agent):
+            results = list(
+                run_agent_concurrently(self.payee_agent, transactions, max_workers=3)
+            )
+
+        self.assertEqual(max(peak), 3)
+        self.assertEqual(len(results), 6)
+        failed = [result for result in results if result.error is not None]
+        self.assertEqual(
+            [result.transaction.id for result in failed], [transactions[-1].id]
+        )
+        self.assertEqual(str(failed[0].error), "LLM exploded")
+        payees = {
+            result.transaction.id: result.update_fields["payee"]
+            for result in results
+            if result.error is None
+        }
+        self.assertEqual(
+            payees, {t.id: t.description.title() for t in transactions[:-1]}
+        )
+
+    def test_admin_action_keeps_going_past_a_failed_transaction(self):
+        broken = self.create_transaction("BROKEN VENDOR")
+        fine = self.create_transaction("FINE VENDOR")
+
+        def fake_call_agent(agent_name, transaction):
+            if transaction.id == broken.id:
+                raise RuntimeError("LLM exploded")
+            return {"payee": "Fine Vendor"}
+
+        with mock.patch("profiles.admin.call_agent", fake_call_agent), mock.patch(
+            "profiles.admin.messages"
+        ) as admin_messages:
+            processed, failed = apply_agent_results(
+                None, self.payee_agent, Transaction.objects.order_by("id")
+            )
+
+        self.assertEqual((processed, failed), (1, [broken.id]))
+        fine.refresh_from_db()
+        self.assertEqual(fine.payee, "Fine Vendor")
+        admin_messages.success.assert_called_once()
+        self.assertIn(str(broken.id), admin_messages.error.call_args.args[1])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class VendorDedupTests(ProcessingTaskTestMixin, TestCase):
+    def test_each_vendor_is_looked_up_once(self):
+        transactions = [
+            self.create_transaction("POS PURCHASE LOWE'S #1636 ALBUQUERQ NM"),
+            self.create_transaction("POS PURCHASE LOWE'S #0042 ALBUQUERQ NM"),
+            self.create_transaction("POS PURCHASE LOWE'S #0042 ALBUQUERQ NM", "-20.00"),
+            self.create_transaction("SQ *BLUE BOTTLE 06/14"),
+        ]
+        task = self.create_task(transactions)
+        calls = []
+
+        def fake_call_agent(agent_name, transaction):
+            calls.append(transaction.id)
+            payee = "Lowe's" if "LOWE" in transaction.description else "Blue Bottle"
+            return {"payee": payee, "confidence": "high"}
+
+        with mock.patch("profiles.admin.call_agent", fake_call_agent):
+            self.assertEqual(run_processing_task(task), (4, 0))
+
+        task.refresh_from_db()
+        self.assertEqual(
+            task.task_metadata["vendor_dedup"],
+            {
+                "transactions": 4,
+                "distinct_vendors": 2,
+                "dedup_ratio": 2.0,
+                "agent_calls_saved": 2,
+            },
+        )
+        self.assertEqual(len(calls), 2)
+        payees = dict(
+            Transaction.objects.filter(client=self.client_profile).values_list(
+                "id", "payee"
+            )
+        )
+        self.assertEqual(
+            payees,
+            {
+                transactions[0].id: "Lowe's",
+                transactions[1].id: "Lowe's",
+                transactions[2].id: "Lowe's",
+                transactions[3].id: "Blue Bottle",
+            },
+        )
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class AgentRegistryTests(ProcessingTaskTestMixin, TestCase):
+    def test_compiled_agents_are_reused_until_a_row_changes(self):
+        agent = get_compiled_agent("Payee Lookup Agent")
+        self.assertIs(get_compiled_agent("Payee Lookup Agent"), agent)
+
+        self.payee_agent.purpose = "Find merchants"
+        self.payee_agent.save()
+        agent = get_compiled_agent("Payee Lookup Agent")
+        self.assertEqual(agent.purpose, "Find merchants")
+
+        tool = Tool.objects.create(name="dumps", module_path="json")
+        self.payee_agent.tools.add(tool)
+        agent = get_compiled_agent("Payee Lookup Agent")
+        self.assertIs(agent.tool_functions["dumps"], json.dumps)
+
+        tool.description = "Serialize a query"
+        tool.save()
+        agent = get_compiled_agent("Payee Lookup Agent")
+        self.assertEqual(
+            agent.tool_definitions[0]["function"]["description"], "Serialize a query"
+        )
+
+        self.payee_agent.tools.remove(tool)
+        self.assertEqual(get_compiled_agent("Payee Lookup Agent").tool_functions, {})
+
+    def test_other_processes_notice_the_version_bump(self):
+        agent = get_compiled_agent("Payee Lookup Agent")
+        # Another process saved an Agent: only the shared version changed
+        cache.incr(agent_registry.VERSION_KEY)
+        agent_registry._version["checked_at"] = 0.0
+        self.assertIsNot(get_compiled_agent("Payee Lookup Agent"), agent)
+
+
+class TailLogTests(SimpleTestCase):
+    def test_tail_reads_only_new_bytes(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".log", delete=False) as f:
+            f.write("".join(f"line {i}\n" for i in range(100)))
+        text, offset = tail_log(f.name, max_bytes=20)
+        # Starts at a line boundary near the end
+        self.assertEqual(text, "line 98\nline 99\n")
+        with open(f.name, "a") as log:
+            log.write("line 100\n")
+        self.assertEqual(tail_log(f.name, offset=offset), ("line 100\n", offset + 9))
+        self.assertEqual(tail_log(f.name + ".missing"), ("", 0))
+
+
+class TelemetryTests(SimpleTestCase):
+    def test_merged_histograms_give_percentiles(self):
+        first, second = Telemetry(), Telemetry()
+        for _ in range(98):
+            first.observe("llm_call", 0.2)
+        second.observe("llm_call", 3.0)
+        second.observe("llm_call", 3.0)
+        raw = merge_raw(first.raw(), second.raw())
+        stats = summarize(raw, wall_seconds=10)["stages"]["llm_call"]
+        self.assertEqual(stats["count"], 100)
+        # Bucket upper bounds are at most 25% above the observation
+        self.assertTrue(0.2 <= stats["p50_seconds"] <= 0.25)
+        self.assertTrue(0.2 <= stats["p95_seconds"] <= 0.25)
+        self.assertTrue(3.0 <= stats["p99_seconds"] <= 3.75)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class MetricsEndpointTests(TestCase):
+    def test_without_a_token_only_staff_can_scrape(self):
+        with override_settings(METRICS_TOKEN=""):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            user = get_user_model().objects.create_user("viewer", password="x")
+            self.client.force_login(user)
+            self.assertEqual(self.client.get("/metrics").status_code, 403)
+            user.is_staff = True
+            user.save()
+            self.assertEqual(self.client.get("/metrics").status_code, 200)
+
+    def test_token_is_required_when_configured(self):
+        with override_settings(METRICS_TOKEN="s3cret"):
+            self.assertEqual(self.client.get("/metrics").status_code, 401)
+            response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer s3cret")
+            self.assertEqual(response.status_code, 200)
+
+
+class RateLimitedError(Exception):
+    status_code = 429
+
+
+@override_settings(RATE_LIMIT_BACKOFF_BASE=0.0, RATE_LIMIT_BACKOFF_MAX=0.0)
+@override_settings(CACHES=LOCMEM_CACHES)
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_processes_share_the_per_minute_budget(self):
+        # Each worker process builds its own limiter for the same name
+        first = RateLimiter("test", requests_per_minute=2)
+        second = RateLimiter("test", requests_per_minute=2)
+        self.assertTrue(first.requests.try_acquire())
+        self.assertTrue(second.requests.try_acquire())
+        self.assertFalse(first.requests.try_acquire())
+        self.assertTrue(
+            RateLimiter("other", requests_per_minute=2).requests.try_acquire()
+        )
+
+    def test_retries_429_and_shrinks_concurrency(self):
+        limiter = RateLimiter("test", requests_per_minute=600, max_concurrency=8)
+        attempts = []
+
+        def flaky():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise RateLimitedError("slow down")
+            return "ok"
+
+        self.assertEqual(limiter.call(flaky, max_retries=2), "ok")
+        self.assertEqual(len(attempts), 3)
+        self.assertLess(limiter.concurrency.limit, 4)
+
+    def test_non_retryable_errors_are_raised_immediately(self):
+        limiter = RateLimiter("test")
+        attempts = []
+
+        def broken():
+            attempts.append(1)
+            raise ValueError("bad request")
+
+        with self.assertRaises(ValueError):
+            limiter.call(broken, max_retries=2)
+        self.assertEqual(len(attempts), 1)
+
+
+class ResultWriterTests(ProcessingTaskTestMixin, TestCase):
+    def test_results_and_progress_are_written_in_batches(self):
+        transactions = [self.create_transaction(f"LOWE'S #{i}") for i in range(5)]
+        task = self.create_task(transactions)
+        progress = TaskProgress(task, flush_rows=4, flush_seconds=60)
+
+        with ResultWriter(progress, flush_rows=2, flush_seconds=60) as writer:
+            for transaction in transactions:
+                writer.add([transaction], {"payee": "Lowe's"})
+            # Two flushes of 2 rows so far; the counters wait for 4
+            task.refresh_from_db()
+            self.assertEqual(task.processed_count, 4)
+        self.assertEqual(progress.finish(), (5, 0))
+
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.processed_count), ("completed", 5))
+        self.assertEqual(
+            Transaction.objects.filter(payee="Lowe's").count(), len(transactions)
+        )
+
+
+class IngestionTests(ProcessingTaskTestMixin, TestCase):
+    def test_bulk_ingest_reports_duplicates_and_bad_rows(self):
+        existing = self.create_transaction("SQ *BLUE BOTTLE 06/14")
+        row = {
+            "transaction_date": "2024-01-16",
+            "amount": "-4.50",
+            "description": "SQ *BLUE BOTTLE 06/15",
+            "category": None,
+            "payee_extraction_method": "None",
+            "classification_method": "None",
+        }
+        rows = [
+            row,
+            dict(row),
+            dict(row, description="SQ *BLUE BOTTLE 06/16", amount="abc"),
+            dict(
+                row,
+                transaction_date=existing.transaction_date,
+                amount=existing.amount,
+                description=existing.description,
+            ),
+        ]
+
+        with self.assertNumQueries(2):
+            report = ingest_transactions(self.client_profile, rows)
+
+        self.assertEqual(report.created, 1)
+        self.assertEqual(
+            [(d["index"], d["reason"]) for d in report.duplicates],
+            [(1, "repeated"), (3, "existing")],
+        )
+        self.assertEqual([e["index"] for e in report.errors], [2])
+        # Hashed as Transaction.save would have hashed the row
+        self.assertEqual(
+            Transaction.objects.get(description=row["description"]).transaction_hash,
+            Transaction.compute_transaction_hash(
+                self.client_profile.pk, "2024-01-16", "-4.50", row["description"], None
+            ),
+        )
+
+    def test_hashing_file_rehashes_when_storage_bypasses_chunks(self):
+        content = b"statement body " * 100
+        upload = HashingFile(SimpleUploadedFile("jan.pdf", content))
+
+        # Like S3's upload_fileobj: reads the file object, not chunks()
+        self.assertEqual(upload.file.read(), content)
+
+        self.assertEqual(upload.hexdigest(), hashlib.sha256(content).hexdigest())
+
+
+class StatementParsingTests(SimpleTestCase):
+    def test_pool_keeps_order_and_isolates_a_failing_file(self):
+        paths = ["jan.pdf", "bad.pdf", "mar.pdf"]
+        # Workers are spawned: they unpickle the patched function by name
+        with mock.patch(
+            "profiles.statement_parsing.parse_statement_file",
+            fake_parse_statement_file,
+        ):
+            results = list(parse_statement_files(paths, "chase_checking", workers=2))
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[1].error, "Parser error: parser crashed")
+        for result in (results[0], results[2]):
+            self.assertIsNone(result.error)
+            self.assertEqual(result.parser, "chase_checking")
+            # Parsed in a worker process, not in the test process
+            self.assertNotEqual(result.output, os.getpid())
+
+
+class IngestionJobTests(ProcessingTaskTestMixin, TestCase):
+    def test_upload_is_queued_and_files_report_their_status(self):
+        files = [
+            SimpleUploadedFile("jan.csv", b"date,amount\n"),
+            SimpleUploadedFile("feb.csv", b"date,amount\n2024-02-01,1\n"),
+        ]
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            MEDIA_ROOT=media_root, TASK_BACKEND="subprocess"
+        ):
+            job = create_ingestion_job(self.client_profile, files, file_type="csv")
+            claimed = claim_next_job("worker-1")
+            self.assertEqual(claimed.job_id, job.job_id)
+            self.assertIsNone(claim_next_job("worker-2"))
+
+            job_file = job.files.get(index=0)
+            # Hashed while stored
+            self.assertEqual(
+                job_file.statement_hash,
+                hashlib.sha256(b"date,amount\n").hexdigest(),
+            )
+            save_job_file(
+                claimed, job_file, ParseResult(error="No compatible parser found.")
+            )
+
+        progress = job_progress(job.job_id)
+        self.assertEqual(progress["processed_count"], 1)
+        self.assertEqual(
+            [(f["index"], f["status"]) for f in progress["files"]],
+            [(0, "failed"), (1, "pending")],
+        )
+        self.assertEqual(progress["files"][0]["error"], "No compatible parser found.")
+
+    def test_created_and_duplicate_counts_are_shown_per_file(self):
+        job = IngestionJob.objects.create(
+            client=self.client_profile, file_type="csv", file_count=1
+        )
+        job_file = IngestionJobFile.objects.create(
+            job=job,
+            index=0,
+            original_filename="jan.csv",
+            status="completed",
+            result={
+                "transactions_created": 3,
+                "duplicate_transactions": [
+                    {"index": 1, "transaction_hash": "a", "reason": "existing"},
+                    {"index": 4, "transaction_hash": "b", "reason": "repeated"},
+                ],
+            },
+        )
+        files = job_progress(job.job_id)["files"]
+        self.assertEqual(
+            (files[0]["transactions_created"], files[0]["duplicates"]), (3, 2)
+        )
+        inline = IngestionJobFileInline(IngestionJob, django_admin.site)
+        self.assertIn("duplicates", inline.fields)
+        self.assertEqual(
+            (inline.transactions_created(job_file), inline.duplicates(job_file)),
+            (3, 2),
+        )
+
+    def test_subprocess_backend_starts_a_worker_for_the_upload(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            MEDIA_ROOT=media_root, TASK_BACKEND="subprocess"
+        ), mock.patch(
+            "profiles.ingestion_queue.subprocess.Popen"
+        ) as popen, self.captureOnCommitCallbacks(
+            execute=True
+        ):
+            job = create_ingestion_job(
+                self.client_profile,
+                [SimpleUploadedFile("jan.csv", b"date,amount\n")],
+                file_type="csv",
+            )
+        command = popen.call_args.args[0]
+        self.assertEqual(command[-2:], ["process_ingestion_job", str(job.job_id)])
+
+    def test_known_statements_are_skipped_before_parsing(self):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(
+            MEDIA_ROOT=media_root, TASK_BACKEND="subprocess"
+        ):
+            known = StatementFile.objects.create(
+                client=self.client_profile,
+                file=SimpleUploadedFile("jan.csv", b"january\n"),
+                file_type="csv",
+                original_filename="jan.csv",
+            )
+            job = create_ingestion_job(
+                self.client_profile,
+                [
+                    SimpleUploadedFile("jan-again.csv", b"january\n"),
+                    SimpleUploadedFile("feb.csv", b"february\n"),
+                    SimpleUploadedFile("feb-copy.csv", b"february\n"),
+                ],
+                file_type="csv",
+            )
+
+        files = list(job.files.values_list("status", "statement_file_id"))
+        self.assertEqual(
+            files,
+            [("duplicate", known.id), ("pending", None), ("duplicate", None)],
+        )
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.processed_count), ("pending", 2))
+
+
+class ProcessBatchTests(ProcessingTaskTestMixin, TestCase):
+    def test_filters_and_keyset_batches(self):
+        transactions = [
+            self.create_transaction(f"LOWE'S #{i}", amount=amount)
+            for i, amount in enumerate(["-10.00", "25.00", "-3.00", "-7.50"])
+        ]
+        query = build_filter_query(["amount__lt=0", f"id!={transactions[2].id}"])
+        batches = list(
+            iter_keyset_batches(Transaction.objects.filter(query), 1, after_id=0)
+        )
+        self.assertEqual(
+            [[t.id for t in batch] for batch in batches],
+            [[transactions[0].id], [transactions[3].id]],
+        )
+        # Resuming after a checkpoint skips rows already processed
+        resumed = iter_keyset_batches(
+            Transaction.objects.filter(query), 10, after_id=transactions[0].id
+        )
+        self.assertEqual([t.id for t in next(resumed)], [transactions[3].id])
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class RuleEngineTests(ProcessingTaskTestMixin, TestCase):
+    def test_rules_classify_without_agent_calls(self):
+        Agent.objects.create(
+            name="Classification Agent",
+            purpose="Classification",
+            prompt="",
+            llm=LLMConfig.objects.get(model="test-model"),
+        )
+        self.client_profile.category_patterns = "Netflix | Spotify: Personal"
+        self.client_profile.save()
+        transactions = [
+            self.create_transaction("ONLINE TRANSFER TO SAVINGS XXXXXX1234"),
+            self.create_transaction("NETFLIX.COM 866-579-7172 CA"),
+        ]
+        task = self.create_task(transactions, task_type="classification")
+
+        self.assertEqual(run_processing_task(task), (2, 0))
+        task.refresh_from_db()
+        self.assertEqual(task.status, "completed")
+        self.assertEqual(
+            task.task_metadata["rule_engine"]["rules"], {"transfer": 1, "Netflix": 1}
+        )
+        transfer, netflix = (
+            Transaction.objects.get(id=transaction.id) for transaction in transactions
+        )
+        # Built-in rules answer in the allowed category vocabulary
+        self.assertEqual(
+            (transfer.classification_type, transfer.worksheet, transfer.category),
+            ("personal", "Personal", "Personal"),
+        )
+        self.assertEqual(netflix.worksheet, "Personal")
+        self.assertEqual(netflix.classification_method, "Rule")
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class LearnedClassifierTests(ProcessingTaskTestMixin, TestCase):
+    def label(self, description, classification_type, worksheet, category):
+        transaction = self.create_transaction(description)
+        Transaction.objects.filter(id=transaction.id).update(
+            classification_method="Human",
+            classification_type=classification_type,
+            worksheet=worksheet,
+            category=category,
+        )
+
+    def test_confident_predictions_are_applied_locally(self):
+        for suffix in ("01", "02", "03", "04"):
+            self.label(
+                f"ADOBE CREATIVE CLOUD {suffix}/15", "business", "6A", "Software"
+            )
+            self.label(
+                f"STARBUCKS STORE {suffix}/15", "personal", "Personal", "Personal"
+            )
+        model, added, removed = train_client(self.client_profile)
+        self.assertEqual((model.example_count, model.class_count), (8, 2))
+        self.assertEqual((added, removed), (8, 0))
+        # Nothing new to learn on a second run
+        self.assertEqual(train_client(self.client_profile)[1:], (0, 0))
+
+        adobe = self.create_transaction("ADOBE CREATIVE CLOUD 06/15")
+        unknown = self.create_transaction("SOMETHING ELSE ENTIRELY")
+        matched, unmatched = split_by_classifier([adobe, unknown])
+
+        self.assertEqual(unmatched, [unknown])
+        self.assertEqual(matched[0][1]["category"], "Software")
+        self.assertEqual(matched[0][1]["classification_method"], "ML")
+
+
+class TaskQueueTests(ProcessingTaskTestMixin, TestCase):
+    def test_claims_are_exclusive_and_stale_tasks_are_reclaimed(self):
+        task = self.create_task([self.create_transaction("LOWE'S #1636")])
+
+        claimed = claim_next_task("worker-a")
+        self.assertEqual(claimed.task_id, task.task_id)
+        self.assertEqual((claimed.status, claimed.attempts), ("processing", 1))
+        self.assertIsNone(claim_next_task("worker-b"))
+
+        # worker-a dies: its heartbeat goes stale and the task is released
+        ProcessingTask.objects.filter(task_id=task.task_id).update(
+            heartbeat_at=timezone.now() - timedelta(minutes=10)
+        )
+        self.assertEqual(reclaim_stale_tasks(timeout=60), 1)
+        self.assertEqual(claim_next_task("worker-b").worker_id, "worker-b")
+
+    def test_small_tasks_and_idle_clients_go_first(self):
+        backfill = self.create_task(
+            [self.create_transaction(f"LOWE'S #{i}") for i in range(60)]
+        )
+        other = BusinessProfile.objects.create(client_id="other", company_name="Other")
+        interactive = self.create_task([self.create_transaction("HOME DEPOT #1")])
+        interactive.client = other
+        interactive.save()
+        # The backfill's client already has work in flight
+        busy = self.create_task([self.create_transaction("HOME DEPOT #2")])
+        busy.status, busy.worker_id = "processing", "worker-z"
+        busy.save()
+
+        order = [c.id for c in next_candidates() if c.kind == TASK]
+        self.assertEqual(order, [interactive.task_id, backfill.task_id])
+        self.assertEqual(queue_stats()["test-client"]["pending_transactions"], 60)
+
+    def test_paused_task_resumes_from_its_cursor(self):
+        Agent.objects.create(name="Classification Agent", purpose="Classification")
+        transactions = [
+            self.create_transaction(f"ONLINE TRANSFER TO SAVINGS REF {i:04d}")
+            for i in range(4)
+        ]
+        ids = [t.id for t in transactions]
+        self.assertEqual(
+            make_cursor(ids, {ids[0], ids[2]}),
+            {"after_id": ids[0], "done_ids": [ids[2]]},
+        )
+        task = self.create_task(transactions, task_type="classification")
+
+        # The worker sees the pause before its first agent call
+        self.assertTrue(pause_task(claim_task(task.task_id, "worker-a")))
+        run_processing_task(ProcessingTask.objects.get(task_id=task.task_id))
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.control), ("paused", ""))
+
+        # Pretend rows 0 and 2 were done before the pause
+        task.task_metadata["cursor"] = make_cursor(ids, {ids[0], ids[2]})
+        task.processed_count = 2
+        task.save()
+        self.assertTrue(resume_task(task))
+        self.assertEqual(
+            run_processing_task(claim_task(task.task_id, "worker-b")), (4, 0)
+        )
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.processed_count), ("completed", 4))
+        self.assertNotIn("cursor", task.task_metadata)
+
+    def test_cancel_after_the_last_control_check_is_not_overwritten(self):
+        transaction = self.create_transaction("ONLINE TRANSFER TO SAVINGS REF 0001")
+        task = claim_task(self.create_task([transaction]).task_id, "worker-a")
+        progress = TaskProgress(task)
+        progress.record([transaction.id])
+
+        self.assertTrue(cancel_task(task))
+        self.assertEqual(progress.finish(), (1, 0))
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.control), ("failed", ""))
+        self.assertTrue(task.error_details["cancelled"])
+
+    def test_retry_only_processes_rows_that_did_not_succeed(self):
+        Agent.objects.create(name="Classification Agent", purpose="Classification")
+        transactions = [
+            self.create_transaction(f"ONLINE TRANSFER TO SAVINGS REF {i:04d}")
+            for i in range(3)
+        ]
+        task = self.create_task(transactions, task_type="classification")
+        self.assertEqual(run_processing_task(task), (3, 0))
+        self.assertEqual(task.transaction_states.filter(status="done").count(), 3)
+
+        # One row failed last time; the retry only redoes that one
+        TaskTransactionState.objects.filter(transaction=transactions[1]).update(
+            status="failed"
+        )
+        ProcessingTask.objects.filter(task_id=task.task_id).update(status="pending")
+        task.refresh_from_db()
+        self.assertEqual(run_processing_task(task), (3, 0))
+        task.refresh_from_db()
+        self.assertEqual(task.processed_count, 3)
+        self.assertEqual(task.task_metadata["retry"]["agent_calls_saved"], 2)
+        self.assertEqual(task.task_metadata["rule_engine"]["matched"], 1)
+
+    def test_large_task_is_split_into_work_units(self):
+        Agent.objects.create(name="Classification Agent", purpose="Classification")
+        transactions = [
+            self.create_transaction(f"ONLINE TRANSFER TO SAVINGS REF {i:04d}")
+            for i in range(5)
+        ]
+        task = self.create_task(transactions, task_type="classification", chunk_size=2)
+
+        # The first claim splits the task; units are then drained by any worker
+        self.assertTrue(work_once("worker-a"))
+        self.assertEqual(task.work_units.count(), 3)
+        while work_once("worker-b"):
+            pass
+
+        task.refresh_from_db()
+        self.assertEqual(task.status, "completed")
+        self.assertEqual((task.processed_count, task.error_count), (5, 0))
+        self.assertEqual(
+            task.task_metadata["work_units"]["metrics"]["rule_engine"]["matched"], 5
+        )
+
+
+class CeleryExecutionTests(ProcessingTaskTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        # Run tasks inline: no broker needed. The app reads CELERY_* settings
+        # lazily, so reload them with the override in place (and after it).
+        eager = override_settings(
+            CELERY_TASK_ALWAYS_EAGER=True, CELERY_TASK_EAGER_PROPAGATES=True
+        )
+        eager.enable()
+        self.addCleanup(self.load_celery_config)
+        self.addCleanup(eager.disable)
+        self.load_celery_config()
+        self.assertTrue(celery_app.conf.task_always_eager)
+
+    def load_celery_config(self):
+        celery_app.config_from_object(
+            "django.conf:settings", namespace="CELERY", force=True
+        )
+
+    def test_split_task_runs_and_aggregates_through_celery(self):
+        Agent.objects.create(name="Classification Agent", purpose="Classification")
+        transactions = [
+            self.create_transaction(f"ONLINE TRANSFER TO SAVINGS REF {i:04d}")
+            for i in range(5)
+        ]
+        task = self.create_task(transactions, task_type="classification", chunk_size=2)
+
+        result = enqueue_processing_task(task)
+
+        self.assertEqual(result.get()["work_units"], 3)
+        task.refresh_from_db()
+        self.assertEqual(task.status, "completed")
+        self.assertEqual((task.processed_count, task.error_count), (5, 0))
+        self.assertFalse(task.work_units.exclude(status="completed").exists())
@@ -189,10 +189,13 @@ def extract_pdf_metadata(pdf_path):
 # For extensibility: if all fields are None or confidence is low, fallback to vision agent
 
 
-def get_update_fields_from_response(agent, response, agent_type, tool_usage=None):
+def get_update_fields_from_response(
+    agent, response, agent_type, tool_usage=None, cached=False
+):
     """
     Map LLM agent response to transaction update fields for both classification and payee lookup.
     agent_type: 'payee' or 'classification' (REQUIRED, explicit)
+    cached: the response came from the LLM response cache (no LLM or tool calls)
     """
     if agent_type not in ("payee", "classification"):
         raise ValueError(
@@ -200,7 +203,9 @@ def get_update_fields_from_response(agent, response, agent_type, tool_usage=None
         )
 
     # Build method strings
-    if tool_usage and any(tool_usage.values()):
+    if cached:
+        method_str = "AI (Cached)"
+    elif tool_usage and any(tool_usage.values()):
         tool_parts = []
         for name, count in tool_usage.items():
             label = name.replace("_", " ").replace("search", "search").title()
@@ -16,6 +16,12 @@ from django.conf import settings
 from django.core.files.storage import default_storage
 from django.core.exceptions import ValidationError
 from django.db import IntegrityError
+from django.db.models import Count
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+from .ingestion import ingest_transactions
+from .models import ProcessingTask
+from .telemetry import render_metrics
 from .utils import sync_transaction_id_sequence
 
 logger = logging.getLogger(__name__)
@@ -32,31 +38,39 @@ def upload_transactions(request):
             decoded_file = csv_file.read().decode("utf-8").splitlines()
             reader = csv.DictReader(decoded_file)
             client = BusinessProfile.objects.get(client_id="Tim and Gene")
-            for row in reader:
-                try:
-                    Transaction.objects.create(
-                        client=client,
-                        transaction_date=row["transaction_date"],
-                        description=row["description"],
-                        amount=row["amount"],
-                        file_path=row["file_path"],
-                        source=row["source"],
-                        transaction_type=row["transaction_type"],
-                        normalized_amount=row["normalized_amount"],
-                        statement_start_date=row["statement_start_date"] or None,
-                        statement_end_date=row["statement_end_date"] or None,
-                        account_number=row["account_number"],
-                        transaction_id=row["transaction_id"],
-                        classification_method=CLASSIFICATION_METHOD_UNCLASSIFIED,
-                        payee_extraction_method=PAYEE_EXTRACTION_METHOD_UNPROCESSED,
-                        needs_account_number=(
-                            not row.get("account_number")
-                            or str(row.get("account_number")).strip() == ""
-                        ),
-                    )
-                except Exception as e:
-                    logger.error(f"Error processing row {row}: {e}")
-                    messages.error(request, f"Error processing row: {row}")
+            rows = [
+                {
+                    "transaction_date": row["transaction_date"],
+                    "description": row["description"],
+                    "amount": row["amount"],
+                    "file_path": row["file_path"],
+                    "source": row["source"],
+                    "transaction_type": row["transaction_type"],
+                    "normalized_amount": row["normalized_amount"],
+                    "statement_start_date": row["statement_start_date"] or None,
+                    "statement_end_date": row["statement_end_date"] or None,
+                    "account_number": row["account_number"],
+                    "transaction_id": row["transaction_id"],
+                    "classification_method": CLASSIFICATION_METHOD_UNCLASSIFIED,
+                    "payee_extraction_method": PAYEE_EXTRACTION_METHOD_UNPROCESSED,
+                    "needs_account_number": (
+                        not row.get("account_number")
+                        or str(row.get("account_number")).strip() == ""
+                    ),
+                }
+                for row in reader
+            ]
+            report = ingest_transactions(client, rows)
+            for error in report.errors:
+                row = rows[error["index"]]
+                logger.error(f"Error processing row {row}: {error['error']}")
+                messages.error(request, f"Error processing row: {row}")
+            if report.duplicates:
+                messages.warning(
+                    request,
+                    f"Skipped {len(report.duplicates)} transactions that were "
+                    "already uploaded.",
+                )
             messages.success(request, "Transactions uploaded successfully.")
             return redirect("profile-list")
     else:
@@ -114,3 +128,31 @@ def upload_statement_files(request):
     else:
         form = StatementFileUploadForm()
     return render(request, "profiles/upload_statement_files.html", {"form": form})
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint for task telemetry (see profiles.telemetry).
+    Requires the METRICS_TOKEN bearer token, or a staff login when no token
+    is configured.
+    """
+    token = getattr(settings, "METRICS_TOKEN", "")
+    if token:
+        if not constant_time_compare(
+            request.headers.get("Authorization", ""), f"Bearer {token}"
+        ):
+            return HttpResponse(status=401)
+    elif not request.user.is_staff:
+        return HttpResponse(status=401 if request.user.is_anonymous else 403)
+    task_types = [task_type for task_type, _ in ProcessingTask.TASK_TYPES]
+    depth = [
+        ({"task_type": row["task_type"], "status": row["status"]}, row["tasks"])
+        for row in ProcessingTask.objects.filter(status__in=("pending", "processing"))
+        .values("task_type", "status")
+        .annotate(tasks=Count("task_id"))
+        .order_by("task_type", "status")
+    ]
+    gauges = [("ledgerflow_tasks", "Processing tasks by status", depth)]
+    return HttpResponse(
+        render_metrics(task_types, gauges), content_type="text/plain; version=0.0.4"
+    )